@@ -0,0 +1,112 @@
+"""
+Two-step planner (intent_planner, then query_generate) versus the fused planner
+(GRAPH_PLANNER_MODE="fused") on a fixed question set: latency, LLM calls and tokens per
+question, and whether both modes take the same route and give the same answer.
+
+Runs against the real LLM and Hasura configured in .env, as the given tenant.
+Answer agreement is the difflib similarity of the two final answers.
+
+Usage: python -m benchmarks.bench_fused_planner COMPANY_TYPE COMPANY_ID USER_ID [repeats]
+"""
+import asyncio
+import statistics
+import sys
+import time
+from difflib import SequenceMatcher
+
+from langchain_core.messages import HumanMessage  # type: ignore
+
+from blood_bank.blood_graph_builder import blood_build_graph
+from hospital.graph_builder import build_graph
+from metrics import GraphMetricsHandler
+from utils import store_datetime
+
+QUESTIONS = {
+    "HOSPITAL": [
+        "Show my pending orders",
+        "Track my orders",
+        "What was the total cost for last month?",
+        "How many O+ orders did we place this month?",
+        "Which blood bank delivered the most orders this year?",
+        "List rejected orders with their reasons",
+        "What is the age of the patient in my last order?",
+        "Hi, what can you do?",
+        "Show orders for blood group Z+",
+    ],
+    "BLOODBANK": [
+        "Show pending requests",
+        "Which hospitals sent requests today?",
+        "How many A- requests were completed last month?",
+        "List cancelled orders with their reasons",
+        "What is the total billing for June 2025?",
+        "Which blood component is requested most?",
+        "Hello!",
+        "Show requests from Unknown Hospital",
+    ],
+}
+BUILDERS = {"HOSPITAL": build_graph, "BLOODBANK": blood_build_graph}
+MODES = ("two_step", "fused")
+
+
+async def run_once(graph, question, company_id, user_id):
+    handler = GraphMetricsHandler()
+    inputs = {
+        "messages": [HumanMessage(content=question, additional_kwargs={"tag": "user_input"})],
+        "history": [],
+        "history_context": "so consider this context. Now, I am asked ",
+        "nodes": ["input"],
+        "time": [store_datetime()],
+    }
+    config = {"configurable": {"company_id": company_id, "user_id": user_id}, "callbacks": [handler]}
+    start = time.perf_counter()
+    output = await graph.ainvoke(inputs, config=config)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return {
+        "ms": elapsed_ms,
+        "llm_calls": handler.llm_calls,
+        "tokens": handler.prompt_tokens + handler.completion_tokens,
+        "route": output["nodes"][-1],
+        "answer": output["messages"][-1].content,
+    }
+
+
+async def main():
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+    company_type, company_id, user_id = sys.argv[1].upper(), sys.argv[2], sys.argv[3]
+    repeats = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+    graphs = {mode: BUILDERS[company_type](planner_mode=mode) for mode in MODES}
+
+    results = {mode: [] for mode in MODES}
+    print(f"{'question':<52}{'mode':<10}{'p50 ms':>9}{'calls':>7}{'tokens':>8}  route")
+    for question in QUESTIONS[company_type]:
+        for mode in MODES:
+            runs = [await run_once(graphs[mode], question, company_id, user_id) for _ in range(repeats)]
+            results[mode].append(runs)
+            last = runs[-1]
+            print(
+                f"{question[:50]:<52}{mode:<10}{statistics.median(r['ms'] for r in runs):>9.0f}"
+                f"{last['llm_calls']:>7}{last['tokens']:>8}  {last['route']}"
+            )
+
+    print()
+    for mode in MODES:
+        runs = [r for question_runs in results[mode] for r in question_runs]
+        print(
+            f"{mode:<10} p50 {statistics.median(r['ms'] for r in runs):>7.0f} ms   "
+            f"mean calls {statistics.mean(r['llm_calls'] for r in runs):.2f}   "
+            f"mean tokens {statistics.mean(r['tokens'] for r in runs):.0f}"
+        )
+
+    same_route = 0
+    similarity = []
+    for two_step, fused in zip(*(results[mode] for mode in MODES)):
+        same_route += two_step[-1]["route"] == fused[-1]["route"]
+        similarity.append(SequenceMatcher(None, two_step[-1]["answer"], fused[-1]["answer"]).ratio())
+    print(f"route agreement  {same_route}/{len(similarity)}")
+    print(f"answer agreement mean similarity {statistics.mean(similarity):.2f}, min {min(similarity):.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+"""
+Per-request graph setup cost: compiling a graph on every /chat call (old behaviour)
+versus looking it up in the graph registry (compiled once per process).
+
+Usage: python -m benchmarks.bench_graph_setup [iterations]
+"""
+import statistics
+import sys
+import time
+
+from blood_bank.blood_graph_builder import blood_build_graph
+from graph_registry import compile_graphs, get_graph
+from hospital.graph_builder import build_graph
+
+
+def measure(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.mean(samples), statistics.median(samples), max(samples)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    compile_graphs()
+
+    cases = [
+        ("HOSPITAL  compile per request", build_graph),
+        ("HOSPITAL  registry lookup", lambda: get_graph("HOSPITAL")),
+        ("BLOODBANK compile per request", blood_build_graph),
+        ("BLOODBANK registry lookup", lambda: get_graph("BLOODBANK")),
+    ]
+    print(f"{'case':<32}{'mean ms':>10}{'p50 ms':>10}{'max ms':>10}")
+    for name, fn in cases:
+        mean, p50, worst = measure(fn, iterations)
+        print(f"{name:<32}{mean:>10.3f}{p50:>10.3f}{worst:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Per-call Hasura latency with and without connection pooling, measured against a
+local stub GraphQL server (HTTP/1.1 keep-alive, no TLS, so real savings are larger).
+
+Usage: python -m benchmarks.bench_hasura_pool [calls]
+"""
+import asyncio
+import json
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import requests
+
+from hasura.http_client import close_clients, get_async_client, get_session
+
+PAYLOAD = {"query": "query { chat_sessions { session_id } }"}
+BODY = json.dumps({"data": {"chat_sessions": [{"session_id": "2025-07-08"}]}}).encode()
+
+
+class StubGraphQLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<32}{statistics.mean(samples):>10.3f}{statistics.median(samples):>10.3f}{p95:>10.3f}")
+
+
+def bench_sync(url, calls):
+    unpooled, pooled = [], []
+    for _ in range(calls):
+        start = time.perf_counter()
+        requests.post(url, json=PAYLOAD, timeout=10).json()
+        unpooled.append((time.perf_counter() - start) * 1000)
+    session = get_session()
+    for _ in range(calls):
+        start = time.perf_counter()
+        session.post(url, json=PAYLOAD, timeout=10).json()
+        pooled.append((time.perf_counter() - start) * 1000)
+    report("sync  requests.post (no pool)", unpooled)
+    report("sync  shared session (pooled)", pooled)
+
+
+async def bench_async(url, calls):
+    unpooled, pooled = [], []
+    for _ in range(calls):
+        start = time.perf_counter()
+        async with httpx.AsyncClient(timeout=10) as client:
+            (await client.post(url, json=PAYLOAD)).json()
+        unpooled.append((time.perf_counter() - start) * 1000)
+    client = get_async_client()
+    for _ in range(calls):
+        start = time.perf_counter()
+        (await client.post(url, json=PAYLOAD)).json()
+        pooled.append((time.perf_counter() - start) * 1000)
+    report("async client per call (no pool)", unpooled)
+    report("async shared client (pooled)", pooled)
+    await close_clients()
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGraphQLHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/graphql"
+
+    print(f"{'case':<32}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    bench_sync(url, calls)
+    asyncio.run(bench_async(url, calls))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Memory growth of the session history cache under many users and long sessions.
+Compares the cache's own byte accounting with the heap growth seen by tracemalloc.
+
+Usage: python -m benchmarks.bench_history_cache_memory [users] [sessions_per_user] [turns]
+"""
+import sys
+import tracemalloc
+
+from langchain_core.messages import AIMessage, HumanMessage  # type: ignore
+
+from cache import memory_cache
+
+QUESTION = "Show me the pending orders for O+ blood at the city blood bank for last week"
+ANSWER = "You have 12 pending O+ orders. " * 20
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    turns = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+
+    print(f"{'turn':>6}{'sessions':>10}{'cache MB':>10}{'heap MB':>10}")
+    for turn in range(1, turns + 1):
+        for user in range(users):
+            for session in range(sessions):
+                user_id, session_id = f"USR-{user}", f"2025-07-{session:02d}"
+                if not memory_cache.has_history(user_id, session_id):
+                    memory_cache.set_history(user_id, session_id, [])
+                memory_cache.store_message(
+                    user_id, session_id, [HumanMessage(content=QUESTION), AIMessage(content=ANSWER)]
+                )
+        if turn == 1 or turn % 10 == 0:
+            heap = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(baseline, "filename"))
+            stats = memory_cache.stats()
+            print(f"{turn:>6}{stats['sessions']:>10}{stats['bytes'] / 1e6:>10.2f}{heap / 1e6:>10.2f}")
+
+    sample = memory_cache.get_history("USR-0", "2025-07-00")
+    print(f"messages kept per session: {len(sample)} (limit {memory_cache.HISTORY_MAX_MESSAGES})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import json
+import time
+import uuid
 
 from langchain.tools import Tool, tool
-from langchain_community.tools.graphql.tool import GraphQLAPIWrapper  # type: ignore
 
 # from langchain_core.tools import Tool # type: ignore
 from langchain_core.messages import (  # type: ignore
@@ -10,58 +11,65 @@ from langchain_core.messages import (  # type: ignore
     SystemMessage,
     ToolMessage,
 )
+from langchain_core.runnables import RunnableConfig  # type: ignore
 from langgraph.graph import END, StateGraph  # type: ignore
 
-from config.config import HASURA_ADMIN_SECRET, HASURA_GRAPHQL_URL, HASURA_ROLE
+from config.config import GRAPH_PLANNER_MODE, HASURA_GRAPHQL_URL, SPECULATIVE_QUERY_ENABLED, QUERY_MAX_ITERATIONS
+from cache.filter_cache import filter_values_cache
 from hasura.graphql_memory import HasuraMemory
+from hasura.http_client import SafeGraphQLWrapper
+from hasura.schema_validator import format_graphql_error, schema_validator
 from config.logging_config import setup_logger
+from date_resolver import date_context, resolve_dates
+from entity_extractor import ResolvedEntities, entity_extractor, slots_context
+from history_context import history_builder
+from intent_plan import FusedPlan, IntentPlan
+from model_router import model_router, repeated_graphql_error
+from prompt_assembly import assemble
+from query_templates import match_template
+from speculative_query import filter_vocabulary, query_speculation
 from blood_bank.blood_nodes import (
     AgentState,
     clarify,
     data_analyser,
+    fused_planner_decision,
     general_response,
     intent_planner_decision,
-    llm,
     should_continue,
 )
-from blood_bank.blood_prompt import blood_system_intent_prompt, blood_System_query_prompt_format , blood_system_intent_prompt2
-from utils import store_datetime ,get_current_datetime
+from blood_bank.blood_prompt import blood_system_intent_prompt, blood_System_query_prompt_format , blood_system_intent_prompt2, blood_system_fused_planner_prompt
+from utils import store_datetime
 
 logger = setup_logger()
 
-class SafeGraphQLWrapper:
-    def __init__(self, endpoint: str, headers: dict = None):
-        self.client = GraphQLAPIWrapper(graphql_endpoint=endpoint, custom_headers=headers, fetch_schema_from_transport=False)
-
-    def run(self, query: str) -> str:
-        try:
-            return self.client.run(query)
-        except Exception as e:
-            return f"[GraphQL Error] {str(e)} When running this query: {query}. The query might be malformed or the field might not exist."
-
-def blood_build_graph(company_id,user_id):
-    graphql_client = HasuraMemory(
-        hasura_url=HASURA_GRAPHQL_URL,
-        hasura_secret=HASURA_ADMIN_SECRET,
-        hasura_role=HASURA_ROLE,
-        user_id=user_id,
-        company_id=company_id
-    )
-    headers= {
-                "Content-Type": "application/json",
-                "x-hasura-admin-secret": HASURA_ADMIN_SECRET,
-                "x-hasura-role": HASURA_ROLE,
-                "X-Hasura-Company-Id": company_id,
-                "x-hasura-user-id": user_id
-            }
+# tool_call ids of queries that came from query_templates rather than the LLM
+TEMPLATE_TOOL_CALL_PREFIX = "template_"
+# tool_call ids of queries written by the fused planner together with the intent plan
+PLANNED_TOOL_CALL_PREFIX = "planned_"
+
+def last_tool_query(messages) -> str:
+    """The query of the most recent GraphQLTool call, used to keep repair prompts small."""
+    for msg in reversed(messages):
+        for call in getattr(msg, "tool_calls", None) or []:
+            args = call.get("args", {})
+            return str(args.get("query", args))
+    return ""
+
+def blood_build_graph(planner_mode: str = GRAPH_PLANNER_MODE):
+    """
+    Compile the blood bank graph once; company_id/user_id are read from config["configurable"] per run.
+    planner_mode="fused" starts with fused_planner, which plans and writes the query in one LLM call.
+    """
+    graphql_wrapper = SafeGraphQLWrapper(endpoint=HASURA_GRAPHQL_URL)
     safe_graphql_tool = Tool(
     name="GraphQLTool",
-    func=SafeGraphQLWrapper(endpoint=HASURA_GRAPHQL_URL,headers=headers).run,
+    func=graphql_wrapper.run,
     description="Executes GraphQL queries to retrive data. Returns error messages if the query is invalid."
     )
     
 
-    def get_possible_values():
+    async def get_possible_values(graphql_client: HasuraMemory):
+        """Distinct filter values for the company, served from the TTL cache."""
 
         query=""" query GetFilterOptions {
             bank_names: blood_bank_order_view(distinct_on: hospital_name) {
@@ -78,152 +86,222 @@ def blood_build_graph(company_id,user_id):
             }
             } """
         
-        result = graphql_client.run_query(query)
+        cache_key = ("BLOODBANK", graphql_client.permission_scope)
+        result = await filter_values_cache.get(cache_key, lambda: graphql_client.arun_query(query))
         # print("blood bank get_possible_values: ",result)
         return result
     
 
     tools_list = [safe_graphql_tool]
 
-    llm_bind_tool=llm.bind_tools(tools_list)
-    
-
     tool_map = {tool.name: tool for tool in tools_list}
 
-    def intent_planner(state: AgentState):
+    def planner_prompt(state: AgentState, entities: ResolvedEntities, question_dates: str, instructions: str = "", name: str = "blood_bank.intent_planner"):
+        """
+        Intent planner prompt: the static instructions (``instructions`` extend its output format),
+        then the values resolved from the question and the current time, then the messages.
+        """
+        field_context = f"{slots_context(entities)}\n{question_dates}\n"
+        return assemble(
+            name,
+            SystemMessage(content=blood_system_intent_prompt + blood_system_intent_prompt2 + instructions),
+            SystemMessage(content=field_context),
+            *state["messages"]
+        )
+
+    async def intent_planner(state: AgentState, config: RunnableConfig):
         logger.info("intent_planner is executing..")
         new_nodes = state["nodes"] + ["intent_planner"]
         new_time = state["time"] + [store_datetime()]
-
+        # The question's time phrases, resolved once for the speculative query and the planner
+        question_dates = date_context(resolve_dates(state["messages"][-1].content))
+
+        speculation = None
+        if SPECULATIVE_QUERY_ENABLED:
+            # Most messages are data queries: generate the query from the raw message meanwhile
+            speculation = query_speculation.start(model_router.runnable("speculative_query", tools=tools_list), assemble(
+                "blood_bank.speculative_query",
+                blood_System_query_prompt_format,
+                *history_builder.build(state.get("history"), "speculative_query").messages,
+                HumanMessage(content=(
+                    f"User question: {state['messages'][-1].content}\n"
+                    f"{question_dates}"
+                ))
+            ))
+        possible_values = {}
         try:
             # Fetch allowed values for schema-restricted fields
-            possible_values = get_possible_values() or {}
-            data = possible_values
-
-            # Extract and flatten the field values
-            bank_names = [item["hospital_name"] for item in data.get("bank_names", [])]
-            blood_groups = [item["blood_group"] for item in data.get("blood_groups", [])]
-            reasons = [item["reason"] for item in data.get("reasons", [])]
-            statuses = [item["status"] for item in data.get("statuses", [])]
-
-            # Build a formatted string to guide the LLM
-            field_context = f"""
-            VALID FIELDS AND VALUES
-            You must validate these restricted fields using exact or normalized values. If the user provides a value outside of these, ask for clarification.
-            Valid values for field validation:
-                - `hospital_name` (requested Hospital): {bank_names}
-                - `blood_group`: {blood_groups}
-                - `reason` (Cause of request): {reasons}
-                - `status` (upcoming status): {statuses}
-                - `order_line_items` (Blood Components):  
-                  [Single Donor Platelet, Platelet Concentrate, Packed Red Cells, Whole Human Blood, Platelet Rich Plasma, Fresh Frozen Plasma, Cryo Precipitate] 
-                - current time for Time based fields: {get_current_datetime()}
-                        """.strip()
-            
-            # Compose the final prompt input to LLM
-            full_prompt = [
-                SystemMessage(content=blood_system_intent_prompt + field_context + blood_system_intent_prompt2),
-                *state["messages"]
-            ]
-
-            # Single-step LLM invocation (no tool call needed)
-            response = llm.invoke(full_prompt)
-
+            possible_values = await get_possible_values(HasuraMemory.from_config(config)) or {}
+            entities = entity_extractor.resolve("BLOODBANK", state["messages"][-1].content, possible_values)
+            if entities.clarification:
+                # A value the company has no data for: ask back without the planner call
+                plan = IntentPlan.clarification(state["messages"][-1].content, entities.clarification)
+            else:
+                # The planner answers in the model's JSON-schema mode, parsed straight into an IntentPlan
+                plan = await model_router.ainvoke("intent_planner", planner_prompt(state, entities, question_dates), schema=IntentPlan)
             logger.info("intent_planner LLM response received.")
-            return {
-                "messages": state["messages"] + [
-                    AIMessage(content=response.content, additional_kwargs={"tag": "intent_planner"})
-                ],
-                "intent_planner_response": [response.content],
-                "nodes": new_nodes,
-                "time": new_time
-            }
 
         except Exception as e:
             logger.error(f"Error in intent_planner: {e}")
-            fallback_response = f"""{{
-                "intent": "general",
-                "rephrased_question": {json.dumps(state["messages"][0].content)},
-                "chain_of_thought": "No chain of thoughts available",
-                "ask_for": "",
-                "fields_needed": ""
-            }}"""
-            return {
-                "messages": state["messages"] + [AIMessage(content=fallback_response, additional_kwargs={"tag": "intent_planner"})],
-                "intent_planner_response": [fallback_response],
-                "nodes": new_nodes,
-                "time": new_time
-            }
+            plan = IntentPlan.fallback(state["messages"][0].content)
+
+        # Kept only if the plan confirms a data query with the same meaning, otherwise cancelled
+        speculative_query = await query_speculation.resolve(
+            speculation, plan, state["messages"][-1].content, filter_vocabulary(possible_values)
+        )
+
+        return {
+            "messages": state["messages"] + [
+                AIMessage(content=plan.model_dump_json(), additional_kwargs={"tag": "intent_planner"})
+            ],
+            "intent_plan": plan,
+            "date_slots": resolve_dates(plan.rephrased_question),
+            "speculative_query": speculative_query,
+            "nodes": new_nodes,
+            "time": new_time
+        }
+
+    async def fused_planner(state: AgentState, config: RunnableConfig):
+        """intent_planner and query_generate in one LLM call; without a planned query, query_generate runs as usual."""
+        logger.info("fused_planner is executing..")
+        new_nodes = state["nodes"] + ["intent_planner"]
+        new_time = state["time"] + [store_datetime()]
+        # The question's time phrases, resolved once per turn
+        question_dates = date_context(resolve_dates(state["messages"][-1].content))
 
-    def query_generate(state: AgentState):
+        try:
+            possible_values = await get_possible_values(HasuraMemory.from_config(config)) or {}
+            entities = entity_extractor.resolve("BLOODBANK", state["messages"][-1].content, possible_values)
+            if entities.clarification:
+                plan = IntentPlan.clarification(state["messages"][-1].content, entities.clarification)
+            else:
+                plan = await model_router.ainvoke(
+                    "fused_planner", planner_prompt(state, entities, question_dates, blood_system_fused_planner_prompt, "blood_bank.fused_planner"), schema=FusedPlan
+                )
+            logger.info("fused_planner LLM response received.")
+        except Exception as e:
+            logger.error(f"Error in fused_planner: {e}")
+            plan = IntentPlan.fallback(state["messages"][0].content)
+
+        messages = state["messages"] + [
+            AIMessage(content=plan.model_dump_json(exclude={"graphql_query"}), additional_kwargs={"tag": "intent_planner"})
+        ]
+        loop_count = state.get("loop_count") or 0
+        query = getattr(plan, "graphql_query", "").strip()
+        if plan.route() == "data_query" and query:
+            # Executed by graphql_tool like any other call; an error goes through query_generate's repair path
+            messages.append(AIMessage(
+                content=f"Calling `{safe_graphql_tool.name}` tool to process your request...",
+                additional_kwargs={"tag": "tool_call"},
+                tool_calls=[{
+                    "name": safe_graphql_tool.name,
+                    "args": {"query": query},
+                    "id": f"{PLANNED_TOOL_CALL_PREFIX}{uuid.uuid4().hex}",
+                    "type": "tool_call",
+                }],
+            ))
+            new_nodes.append("query_generate")
+            new_time.append(store_datetime())
+            loop_count += 1
+
+        return {
+            "messages": messages,
+            "intent_plan": plan,
+            "date_slots": resolve_dates(plan.rephrased_question),
+            "nodes": new_nodes,
+            "time": new_time,
+            "loop_count": loop_count
+        }
+
+    async def query_generate(state: AgentState, config: RunnableConfig):
         logger.info("query_generate is executing...")
   
         last_message = state["messages"][-1]
-        if last_message.content.strip().startswith("[GraphQL Error]"):
-            # print("GraphQl Error: ",last_message.content)
+        loop_count = state.get("loop_count") or 0
+        deadline = config.get("configurable", {}).get("deadline")
+        out_of_budget = loop_count >= QUERY_MAX_ITERATIONS or (deadline is not None and time.monotonic() >= deadline)
+
+        if isinstance(last_message, ToolMessage) and out_of_budget:
+            # Retry budget or request deadline used up: answer from what we have instead of looping again
+            logger.warning(f"query_generate: stopping after {loop_count} iterations")
+            if last_message.content.strip().startswith("[GraphQL Error]"):
+                response = AIMessage(content=f"Data unavailable: the query could not be corrected. Last error: {last_message.content}")
+            else:
+                response = AIMessage(content=last_message.content)
+
+        elif last_message.content.strip().startswith("[GraphQL Error]"):
+            # Repair prompt carries only the last failing query and its error, not the whole conversation
             input_message = HumanMessage(
                 content=f"""
                 User question: {state['messages'][0].content}
+                Failed query: {last_tool_query(state["messages"])}
                 Response from graphql tool: {last_message.content}
                 Please fix the query.
+                {date_context(state.get("date_slots"))}
                 """
             )
-            response = llm_bind_tool.invoke([blood_System_query_prompt_format] + [input_message]) 
+            # The same query failing again goes to the escalation model
+            response = await model_router.ainvoke(
+                "repair", assemble("blood_bank.query_generate", blood_System_query_prompt_format, input_message),
+                tools=tools_list, escalate=repeated_graphql_error(state["messages"])
+            )
         
+        elif isinstance(last_message, ToolMessage) and last_message.tool_call_id.startswith((TEMPLATE_TOOL_CALL_PREFIX, PLANNED_TOOL_CALL_PREFIX)):
+            # Templated or planned query succeeded: hand the data straight to data_analyser, no LLM round trip
+            response = AIMessage(content=last_message.content)
+
         elif isinstance(last_message,ToolMessage):
             # print("query_generate: Tool response:", last_message.content)
             input_message = HumanMessage(
-            content=f"Response from tool: {last_message.content}"
+                content=(
+                    f"User question: {state['messages'][0].content}\n"
+                    f"Query: {last_tool_query(state['messages'])}\n"
+                    f"Response from tool: {last_message.content}\n"
+                    f"{date_context(state.get('date_slots'))}"
+                )
             )
             # print("input_message: ",input_message)
 
-            response = llm_bind_tool.invoke([blood_System_query_prompt_format] + state["messages"] + [input_message])
-            # response = llm_bind_tool.invoke([blood_System_query_prompt_format] +["User question :"+ state["messages"] +"\n"+ last_message.content])
-            # print("state[messages]:", state["messages"])
+            response = await model_router.ainvoke(
+                "query_generate", assemble("blood_bank.query_generate", blood_System_query_prompt_format, input_message), tools=tools_list
+            )
         else:
-            json_data = {}
-            try:
-                content = state["intent_planner_response"][0].strip()
-                # print("query_generate: Intent planner output:", content)
-                try:
-                    json_data = json.loads(content)
-                except json.JSONDecodeError:
-                    try:
-                        import re
-                        corrected_content = re.sub(r"(\w+):", r'"\1":', content) 
-                        json_data = json.loads(corrected_content)
-                    except Exception:
-                        logger.error("query_generate: Failed to parse intent planner output.")
-                        json_data = {
-                            "rephrased_question": state["messages"][0].content,
-                            "chain_of_thought": "No reasoning available.",
-                            "fields_needed": ""
-                        }
-
-                required_keys = ["rephrased_question", "chain_of_thought"]
-                if not all(key in json_data for key in required_keys):
-                    logger.info(f"query_generate: Missing required {required_keys}keys in intent response.")
-
-                    json_data.setdefault("rephrased_question", state["messages"][0].content)
-                    json_data.setdefault("chain_of_thought", "")
-                    json_data.setdefault("fields_needed", "")
-
-                input_message = HumanMessage(
-                    content=(
-                        f"User question: {json_data['rephrased_question']}\n"
-                        f"Chain of Thought: {json_data['chain_of_thought']}\n"
-                        f"Suggested fields: {json_data['fields_needed']}"
-                    )
+            plan = state.get("intent_plan") or IntentPlan.fallback(state["messages"][0].content)
+            input_message = HumanMessage(
+                content=(
+                    f"User question: {plan.rephrased_question}\n"
+                    f"Chain of Thought: {plan.chain_of_thought}\n"
+                    f"Suggested fields: {', '.join(plan.fields_needed)}\n"
+                    f"{date_context(state.get('date_slots'))}"
+                )
+            )
+            # High-frequency question shapes are answered from a template, without an LLM call
+            template_query = match_template(
+                "BLOODBANK", plan, await get_possible_values(HasuraMemory.from_config(config))
+            )
+            speculative_query = state.get("speculative_query")
+            if template_query:
+                logger.info("query_generate: using query template.")
+                response = AIMessage(
+                    content=f"Calling `{safe_graphql_tool.name}` tool to process your request...",
+                    additional_kwargs={"tag": "tool_call"},
+                    tool_calls=[{
+                        "name": safe_graphql_tool.name,
+                        "args": {"query": template_query},
+                        "id": f"{TEMPLATE_TOOL_CALL_PREFIX}{uuid.uuid4().hex}",
+                        "type": "tool_call",
+                    }],
+                )
+                if speculative_query is not None:
+                    query_speculation.superseded(speculative_query)
+            elif speculative_query is not None:
+                logger.info("query_generate: using speculative query.")
+                query_speculation.used()
+                response = speculative_query
+            else:
+                response = await model_router.ainvoke(
+                    "query_generate", assemble("blood_bank.query_generate", blood_System_query_prompt_format, input_message), tools=tools_list
                 )
-
-            except Exception as e:
-                logger.error(f"query_generate error: {e}")
-                # fallback: use original user message
-                input_message = state["messages"][0]
-                # input_message = [first_message.content if hasattr(first_message, "content") else str(first_message)]
-
-            
-            response = llm_bind_tool.invoke([blood_System_query_prompt_format, input_message])
             
 
         # handle tool_call message if no content
@@ -241,10 +319,12 @@ def blood_build_graph(company_id,user_id):
         return {
             "messages": state["messages"] + [response],
             "nodes": state["nodes"],
-            "time": state["time"]
+            "time": state["time"],
+            "loop_count": loop_count + 1,
+            "speculative_query": None
         }
 
-    def call_tool(state: AgentState):
+    async def call_tool(state: AgentState, config: RunnableConfig):
         last_ai_message = state["messages"][-1]
         
         if not hasattr(last_ai_message, "tool_calls") or not last_ai_message.tool_calls:
@@ -268,7 +348,13 @@ def blood_build_graph(company_id,user_id):
                 else:
                     args = call.get("args", {})
                     tool_input = args.get("query", args)
-                    tool_result = tool_map[tool_name].run(tool_input)
+                    graphql_client = HasuraMemory.from_config(config)
+                    # Rejected locally against the Hasura schema, so doomed queries never hit the network
+                    errors = await schema_validator.validate(tool_input, graphql_client) if isinstance(tool_input, str) else []
+                    if errors:
+                        tool_result = format_graphql_error(tool_input, errors)
+                    else:
+                        tool_result = await graphql_wrapper.arun(tool_input, headers=graphql_client.headers)
                     
             except Exception as e:
                 logger.error(f"Tool execution failed: {e}")
@@ -283,21 +369,35 @@ def blood_build_graph(company_id,user_id):
             "tool_calls_history": (state.get("tool_calls_history", []) + [tool_outputs])
         }
    
+    fused = planner_mode == "fused"
     sample_builder= StateGraph(AgentState)
-    sample_builder.add_node("intent_planner", intent_planner)
+    if fused:
+        sample_builder.add_node("fused_planner", fused_planner)
+    else:
+        sample_builder.add_node("intent_planner", intent_planner)
     sample_builder.add_node("query_generate", query_generate)
     sample_builder.add_node("general_response", general_response)
     sample_builder.add_node("data_analyser", data_analyser)
     sample_builder.add_node("graphql_tool", call_tool)
     sample_builder.add_node("clarify", clarify)
 
-    sample_builder.add_conditional_edges("intent_planner", intent_planner_decision,
-                                         {
-            "data_query": "query_generate",
-            "general": "general_response",
-            "clarification": "clarify"
-        }
-    )
+    if fused:
+        sample_builder.add_conditional_edges("fused_planner", fused_planner_decision,
+                                             {
+                "query": "graphql_tool",
+                "data_query": "query_generate",
+                "general": "general_response",
+                "clarification": "clarify"
+            }
+        )
+    else:
+        sample_builder.add_conditional_edges("intent_planner", intent_planner_decision,
+                                             {
+                "data_query": "query_generate",
+                "general": "general_response",
+                "clarification": "clarify"
+            }
+        )
    
     sample_builder.add_conditional_edges("query_generate", should_continue, {
         "tool_call": "graphql_tool",
@@ -309,7 +409,7 @@ def blood_build_graph(company_id,user_id):
     sample_builder.add_edge("general_response",END)
     sample_builder.add_edge("clarify",END)
 
-    sample_builder.set_entry_point("intent_planner")
+    sample_builder.set_entry_point("fused_planner" if fused else "intent_planner")
 
     graph=sample_builder.compile() 
     
@@ -1,4 +1,3 @@
-from utils import get_current_datetime
 
 blood_System_query_prompt_template = """
 You are a GraphQL Query and Data Retrieval Expert supporting blood bank users to query their assigned orders and operational data from Hasura using GraphQL.
@@ -220,7 +219,8 @@ User: How many orders by hospital this month?
 ---
 """
 
-blood_System_query_prompt_format = blood_System_query_prompt_template + f"Current Date and Time (Use this for time references): {get_current_datetime()}."
+# The current time and resolved dates go into each request's message (date_resolver.date_context), not here at import time
+blood_System_query_prompt_format = blood_System_query_prompt_template
 
 blood_system_data_analysis_prompt_template = """
 Role:
@@ -476,7 +476,8 @@ Tracking details for your recent orders:
 
 """
 
-blood_system_data_analysis_prompt_format = blood_system_data_analysis_prompt_template+ f"\nCurrent date and time (Use this for time references): {get_current_datetime()}." 
+# The current time comes with the question, keeping the prompt a cacheable prefix
+blood_system_data_analysis_prompt_format = blood_system_data_analysis_prompt_template
 
 blood_system_intent_prompt = """ 
 SYSTEM INSTRUCTION  
@@ -689,6 +690,18 @@ User: "Track my order"
 
 """
 
+# Appended to the intent planner prompt by the fused planner (GRAPH_PLANNER_MODE="fused")
+blood_system_fused_planner_prompt = """
+---
+
+COMBINED PLANNING AND QUERY GENERATION
+Your JSON output has one more key, "graphql_query":
+- When intent is "data_query" and ask_for is empty, set it to the complete GraphQL query that answers rephrased_question, written by the QUERY GENERATION RULES below. Only the query text: no markdown, no comments.
+- Otherwise set it to "".
+
+QUERY GENERATION RULES
+""" + blood_System_query_prompt_format
+
 blood_system_general_response_prompt = """
 Role:
 You are a helpful and friendly assistant named `Inhlth`, designed to support blood banks in managing and analyzing blood supply and cost data.
@@ -1038,5 +1051,5 @@ There are 2 rejected orders in the current data.
 
 """
 
-blood_short_data_analysis_prompt_format = blood_short_data_analysis_prompt_template+ f"\nCurrent date and time (Use this for time references): {get_current_datetime()}." 
+blood_short_data_analysis_prompt_format = blood_short_data_analysis_prompt_template 
 
@@ -0,0 +1,140 @@
+import re
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional
+
+from cachetools import TTLCache
+
+from config.config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MAX_BYTES,
+    ANSWER_CACHE_MAX_ENTRY_BYTES,
+    ANSWER_CACHE_TTL,
+)
+from date_resolver import resolve_dates
+from utils import get_session_id, normalize_message
+
+# Only self-contained answers are reused; clarify depends on what the user left out
+CACHEABLE_NODES = ("data_analyser", "general_response")
+
+ENTRY_OVERHEAD_BYTES = 400
+
+# Words that make a message lean on earlier turns ("what about last month", "show those again")
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|that|those|these|them|this one|same|previous|above|earlier|again|instead|also|"
+    r"what about|how about|and for|more details?)\b"
+)
+
+
+class CachedAnswer(NamedTuple):
+    response: str
+    node: str
+    elapsed_ms: float
+
+
+class AnswerCache:
+    """
+    Exact-match cache of final answers, keyed by
+    (company_type, permission scope, normalized message, freshness token, date bucket).
+
+    - The permission scope is ``HasuraMemory.permission_scope``: role, company and, unless
+      ``HASURA_PERMISSION_SCOPE`` is "company", user id, so an answer is only reused for a
+      request that Hasura would have shown the same data.
+    - The date bucket is the concrete range of the message's time phrases ("last month" keys
+      on September 2026 all month long), else today's date in Asia/Kolkata, because the
+      prompts embed the current time, so such answers never cross midnight.
+    - The freshness token fingerprints the company's current data (``cache.data_freshness``),
+      so answers stop matching once the data changes; requests without a token bypass the cache.
+    - Entries expire after ``ttl`` seconds; the cache is bounded by total bytes and evicts
+      least recently used entries first.
+    - Follow-up questions in a session with history opt out, since history changes their meaning.
+    """
+
+    def __init__(self, ttl: float = 300, max_bytes: int = 16 * 1024 * 1024, max_entry_bytes: int = 64 * 1024, enabled: bool = True):
+        self.enabled = enabled
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=self._sizeof)
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.latency_saved_ms = 0.0
+
+    @staticmethod
+    def _sizeof(entry: CachedAnswer) -> int:
+        return len(entry.response.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+
+    @staticmethod
+    def depends_on_history(message: str, history: Optional[List[Any]]) -> bool:
+        if not history:
+            return False
+        return len(message.split()) <= 2 or bool(FOLLOW_UP_PATTERN.search(message))
+
+    def key(self, company_type: Any, scope: Hashable, message: str, history: Optional[List[Any]] = None,
+            freshness: Optional[str] = None) -> Optional[Hashable]:
+        """Cache key for a request, or None when the request must not use the cache."""
+        if not self.enabled:
+            return None
+        if freshness is None:
+            self.bypassed += 1
+            return None
+        normalized = normalize_message(message)
+        if not normalized or self.depends_on_history(normalized, history):
+            self.bypassed += 1
+            return None
+        company_type = getattr(company_type, "value", company_type)
+        dates = resolve_dates(normalized)
+        bucket = dates.key() if dates else get_session_id()
+        return (company_type, scope, normalized, freshness, bucket)
+
+    def get(self, key: Optional[Hashable]) -> Optional[CachedAnswer]:
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.latency_saved_ms += entry.elapsed_ms
+        return entry
+
+    def put(self, key: Optional[Hashable], output: Dict[str, Any], elapsed_ms: float) -> None:
+        """Store the final answer of a graph run if it is a self-contained response."""
+        if key is None:
+            return
+        messages = output.get("messages") or []
+        nodes = output.get("nodes") or []
+        if not messages or not nodes or nodes[-1] not in CACHEABLE_NODES:
+            return
+        content = messages[-1].content
+        if not isinstance(content, str) or not content:
+            return
+        entry = CachedAnswer(content, nodes[-1], elapsed_ms)
+        if self._sizeof(entry) > self.max_entry_bytes:
+            return
+        self._entries[key] = entry
+        self.stores += 1
+
+    def invalidate(self) -> None:
+        """Drop every cached answer."""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._entries.currsize,
+            "max_bytes": self._entries.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "latency_saved_ms": round(self.latency_saved_ms, 2),
+        }
+
+
+answer_cache = AnswerCache(
+    ttl=ANSWER_CACHE_TTL,
+    max_bytes=ANSWER_CACHE_MAX_BYTES,
+    max_entry_bytes=ANSWER_CACHE_MAX_ENTRY_BYTES,
+    enabled=ANSWER_CACHE_ENABLED,
+)
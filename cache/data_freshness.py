@@ -0,0 +1,54 @@
+"""
+Data freshness token for the answer cache.
+
+The token is a fingerprint of aggregates that change whenever a company's orders or billing
+change: order counts per status, the latest creation and delivery times, and the row count and
+total of the billing view. It is fetched with one Hasura query and cached per permission scope
+(``HasuraMemory.permission_scope``) for ``ANSWER_CACHE_FRESHNESS_TTL`` seconds, refreshed in the
+background before it expires, so a cached answer outlives a data change by at most that long
+rather than the answer cache TTL.
+
+Without a token (the query failed or the role may not aggregate) the answer cache is bypassed.
+"""
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from cache.filter_cache import FilterValuesCache
+from config.config import ANSWER_CACHE_FRESHNESS_TTL
+from query_templates import ORDER_VIEWS, STATUS_WORDS
+
+
+def freshness_query(order_view: str) -> str:
+    statuses = "\n".join(
+        f'status_{status}: {order_view}_aggregate(where: {{status: {{_eq: "{status}"}}}}) {{ aggregate {{ count }} }}'
+        for status in sorted(set(STATUS_WORDS.values()))
+    )
+    return f"""query DataFreshness {{
+        orders: {order_view}_aggregate {{ aggregate {{ count max {{ creation_date_and_time delivery_date_and_time }} }} }}
+        {statuses}
+        costs: cost_and_billing_view_aggregate {{ aggregate {{ count sum {{ total_cost }} }} }}
+    }}"""
+
+
+class DataFreshness:
+    def __init__(self, ttl: float = 30, refresh_ahead: float = 0.5):
+        self._cache = FilterValuesCache(ttl=ttl, refresh_ahead=refresh_ahead)
+
+    async def token(self, company_type: Any, graphql_client) -> Optional[str]:
+        """Fingerprint of the company's current data, or None when it could not be read."""
+        company_type = getattr(company_type, "value", company_type)
+        order_view = ORDER_VIEWS.get(company_type)
+        if order_view is None:
+            return None
+        query = freshness_query(order_view)
+        data = await self._cache.get((company_type, graphql_client.permission_scope), lambda: graphql_client.arun_query(query))
+        if not data:
+            return None
+        return hashlib.blake2b(json.dumps(data, sort_keys=True, default=str).encode("utf-8"), digest_size=8).hexdigest()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+data_freshness = DataFreshness(ttl=ANSWER_CACHE_FRESHNESS_TTL)
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from config.config import FILTER_CACHE_REFRESH_AHEAD, FILTER_CACHE_TTL
+from config.logging_config import setup_logger
+
+logger = setup_logger()
+
+Loader = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class FilterValuesCache:
+    """
+    Per-company cache for the distinct filter values (bank/hospital names, blood groups,
+    reasons, statuses) that intent_planner validates against.
+
+    - Entries live for ``ttl`` seconds.
+    - Once an entry is older than ``refresh_ahead * ttl`` it is still served, and a single
+      background refresh replaces it before it expires.
+    - Concurrent misses for the same key share one Hasura round trip (single flight).
+    - Empty/failed loads are never cached; a stale value is served instead when there is one.
+    """
+
+    def __init__(self, ttl: float = 600, refresh_ahead: float = 0.8, maxsize: int = 1000):
+        self.ttl = ttl
+        self.refresh_after = ttl * refresh_ahead
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.load_errors = 0
+
+    async def get(self, key: Hashable, loader: Loader) -> Dict[str, Any]:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None and now - entry[1] < self.ttl:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            if now - entry[1] >= self.refresh_after and key not in self._inflight:
+                self.refreshes += 1
+                self._start_load(key, loader)
+            return entry[0]
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start_load(key, loader)
+        else:
+            self.coalesced += 1
+
+        value = await asyncio.shield(task)
+        if value:
+            return value
+        # Load failed: fall back to the expired value rather than an empty filter list
+        return entry[0] if entry is not None else {}
+
+    def _start_load(self, key: Hashable, loader: Loader) -> asyncio.Task:
+        task = asyncio.create_task(self._load(key, loader))
+        self._inflight[key] = task
+        return task
+
+    async def _load(self, key: Hashable, loader: Loader) -> Optional[Dict[str, Any]]:
+        try:
+            value = await loader()
+        except Exception as e:
+            logger.error(f"[FILTER_CACHE] Failed to load filter values for {key}: {e}")
+            value = None
+        finally:
+            self._inflight.pop(key, None)
+
+        if not value:
+            self.load_errors += 1
+            return None
+
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "load_errors": self.load_errors,
+        }
+
+
+filter_values_cache = FilterValuesCache(ttl=FILTER_CACHE_TTL, refresh_ahead=FILTER_CACHE_REFRESH_AHEAD)
@@ -1,21 +1,127 @@
-from typing import Any, Dict, List
+from collections import deque
+from typing import Any, Dict, List, Tuple
 
 from cachetools import TTLCache
 
-chat_history_cache = TTLCache(maxsize=1000, ttl=1800) 
+from config.config import (
+    HISTORY_CACHE_MAX_BYTES,
+    HISTORY_CACHE_TTL,
+    HISTORY_MAX_MESSAGES,
+    HISTORY_MAX_TOKENS,
+)
 
-def store_message(user_id: str , message: List[Dict[str, Any]]) -> None:
-    if user_id not in chat_history_cache:
-        chat_history_cache[user_id] = []
-    for msg in message:
-          chat_history_cache[user_id].append(msg)
-    print("[store_message] Current cache state:", len(chat_history_cache[user_id]))
+# Fixed per-message cost (LangChain message object, deque slot, bookkeeping) on top of the
+# content bytes, measured with benchmarks/bench_history_cache_memory.py
+MESSAGE_OVERHEAD_BYTES = 600
+# Fixed per-session cost (key, entry object, deque), so empty sessions still count
+SESSION_OVERHEAD_BYTES = 600
 
-def get_history(user_id: str) -> List[Dict[str, Any]]:
-    return chat_history_cache.get(user_id, [])
 
-def has_history(user_id: str) -> bool:
-    return user_id in chat_history_cache
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for the cache bound."""
+    return max(1, len(text) // 4)
 
 
+class SessionHistory:
+    """
+    Ring buffer of the most recent user/final-response messages of one session,
+    bounded by message count and by an estimated token budget.
+    """
 
+    __slots__ = ("messages", "tokens", "nbytes", "max_messages", "max_tokens")
+
+    def __init__(self, max_messages: int = HISTORY_MAX_MESSAGES, max_tokens: int = HISTORY_MAX_TOKENS):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.messages: deque = deque()
+        self.tokens = 0
+        self.nbytes = SESSION_OVERHEAD_BYTES
+
+    @staticmethod
+    def _cost(msg) -> Tuple[int, int]:
+        content = msg.content if isinstance(msg.content, str) else str(msg.content)
+        return estimate_tokens(content), len(content.encode("utf-8")) + MESSAGE_OVERHEAD_BYTES
+
+    def append(self, msg) -> None:
+        tokens, nbytes = self._cost(msg)
+        self.messages.append((msg, tokens, nbytes))
+        self.tokens += tokens
+        self.nbytes += nbytes
+        # Always keep the newest message, even if it alone exceeds the token budget
+        while len(self.messages) > 1 and (len(self.messages) > self.max_messages or self.tokens > self.max_tokens):
+            _, old_tokens, old_bytes = self.messages.popleft()
+            self.tokens -= old_tokens
+            self.nbytes -= old_bytes
+
+    def extend(self, messages: List[Any]) -> None:
+        for msg in messages:
+            self.append(msg)
+
+    def to_list(self) -> List[Any]:
+        return [msg for msg, _, _ in self.messages]
+
+
+# (user_id, session_id) -> SessionHistory, bounded by total bytes across all sessions
+chat_history_cache = TTLCache(
+    maxsize=HISTORY_CACHE_MAX_BYTES,
+    ttl=HISTORY_CACHE_TTL,
+    getsizeof=lambda entry: entry.nbytes,
+)
+
+
+hits = 0
+misses = 0
+
+
+def _put(key: Tuple[str, str], entry: SessionHistory) -> None:
+    # Re-assigning makes the cache re-measure the entry after it changed size
+    try:
+        chat_history_cache[key] = entry
+    except ValueError:
+        # A single entry larger than the whole cache is simply not cached
+        chat_history_cache.pop(key, None)
+
+
+def store_message(user_id: str, session_id: str, message: List[Any]) -> None:
+    """
+    Append new messages of a session to its ring buffer. Sessions that are not cached are
+    skipped: the next read loads the full recent history from Hasura instead of a partial one.
+    """
+    key = (user_id, session_id)
+    entry = chat_history_cache.get(key)
+    if entry is None:
+        return
+    entry.extend(message)
+    _put(key, entry)
+
+
+def set_history(user_id: str, session_id: str, messages: List[Any]) -> None:
+    """Replace the cached history of a session (used to fill the cache after a Hasura read)."""
+    entry = SessionHistory()
+    entry.extend(messages)
+    _put((user_id, session_id), entry)
+
+
+def get_history(user_id: str, session_id: str) -> List[Any]:
+    entry = chat_history_cache.get((user_id, session_id))
+    return entry.to_list() if entry else []
+
+
+def has_history(user_id: str, session_id: str) -> bool:
+    global hits, misses
+    if (user_id, session_id) in chat_history_cache:
+        hits += 1
+        return True
+    misses += 1
+    return False
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "sessions": len(chat_history_cache),
+        "bytes": chat_history_cache.currsize,
+        "max_bytes": chat_history_cache.maxsize,
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+    }
@@ -0,0 +1,36 @@
+from typing import Any, Dict
+
+from cachetools import LRUCache
+
+from config.config import KNOWN_SESSIONS_MAX
+
+# (user_id, session_id) pairs this process has already upserted into chat_sessions
+known_sessions = LRUCache(maxsize=KNOWN_SESSIONS_MAX)
+
+hits = 0
+misses = 0
+
+
+def is_known(user_id: str, session_id: str) -> bool:
+    global hits, misses
+    if (user_id, session_id) in known_sessions:
+        # Touch the entry so active sessions stay at the recent end of the LRU
+        known_sessions[(user_id, session_id)] = True
+        hits += 1
+        return True
+    misses += 1
+    return False
+
+
+def mark_known(user_id: str, session_id: str) -> None:
+    known_sessions[(user_id, session_id)] = True
+
+
+def stats() -> Dict[str, Any]:
+    lookups = hits + misses
+    return {
+        "sessions": len(known_sessions),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+    }
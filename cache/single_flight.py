@@ -0,0 +1,59 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from config.logging_config import setup_logger
+
+logger = setup_logger()
+
+
+def history_fingerprint(history: Optional[List[Any]]) -> str:
+    """Stable digest of a conversation history; two requests only coalesce when it matches."""
+    digest = hashlib.sha1()
+    for msg in history or []:
+        digest.update(type(msg).__name__.encode())
+        digest.update(str(msg.content).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Runs at most one coroutine per key at a time. Callers arriving while a call for the same
+    key is in flight await that call and get its result (or its exception) instead of
+    starting their own. The shared task is shielded, so one caller disconnecting does not
+    cancel the work the others are waiting on.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Optional[Hashable], fn: Callable[[], Awaitable[Any]]) -> Any:
+        if key is None:
+            return await fn()
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            logger.info(f"[SINGLE_FLIGHT] Joined in-flight run, {self.coalesced} coalesced so far")
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.leaders + self.coalesced
+        return {
+            "inflight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / calls, 4) if calls else 0.0,
+        }
+
+
+# Shared graph executions of identical concurrent chats
+chat_flight = SingleFlight()
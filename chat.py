@@ -1,15 +1,29 @@
 
-from typing import Any, Dict
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 from langchain_core.messages import HumanMessage , AIMessage  # type: ignore
 from langsmith.run_helpers import traceable  # type: ignore
 
-from config.config import HASURA_ADMIN_SECRET, HASURA_GRAPHQL_URL, HASURA_ROLE
-from hospital.graph_builder import build_graph
-from blood_bank.blood_graph_builder import blood_build_graph
+from cache.answer_cache import CachedAnswer, answer_cache
+from cache.data_freshness import data_freshness
+from cache.single_flight import chat_flight, history_fingerprint
+from config.config import (
+    CHAT_COALESCE_ENABLED,
+    GRAPH_REQUEST_DEADLINE,
+    HASURA_ADMIN_SECRET,
+    HASURA_GRAPHQL_URL,
+    HASURA_ROLE,
+)
+from fast_path import FastPathAnswer, fast_path
+from graph_registry import get_graph
+from history_context import HISTORY_CONTEXT_SUFFIX, history_builder
 from hasura.graphql_memory import HasuraMemory
+from session_summary import SUMMARY_LEAD_IN, session_summaries
+from metrics import GraphMetricsHandler, current_request_timings, observe_graph_run, timed
 from config.logging_config import setup_logger
-from utils import get_message_unique_id, store_datetime
+from utils import get_message_unique_id, normalize_message, store_datetime
 
 logger = setup_logger()
 
@@ -17,116 +31,291 @@ from config.logging_config import setup_logger
 
 logger = setup_logger()
 
-@traceable(name="generate_chat_response", tags=["chatbot", "langgraph"])
-def generate_chat_response(chat_request, config: Dict[str, Any], conversation_id: str = get_message_unique_id()) -> str:
-    """Generate a chat response using the graph."""
-      # Use as trace_id
+# Nodes whose LLM output is the final answer shown to the user
+FINAL_RESPONSE_NODES = ("data_analyser", "general_response", "clarify")
+
+FALLBACK_RESPONSE = "I'm having trouble generating a response right now. Please try again later, and I'll do my best to help you."
+
+
+class ChatError(Exception):
+    """Raised while preparing a graph run; the message is safe to return to the user."""
 
+
+async def prepare_graph_run(chat_request, config: Dict[str, Any], conversation_id: str, hasura_memory: Optional[HasuraMemory] = None):
+    """Resolve the Hasura client, compiled graph, history and graph inputs for a chat request."""
     user_id = chat_request.user_id
-    company_type = chat_request.company_type
 
+    from langsmith import utils  # type: ignore
+    if utils.tracing_is_enabled():
+        logger.info(f" LangSmith tracing is enabled. user_id={user_id}")
+    else:
+        logger.info(f" LangSmith tracing is not enabled. user_id={user_id}")
+
+    # Initialize Hasura memory unless the caller already has one for this request
     try:
-        from langsmith import utils  # type: ignore
-        if utils.tracing_is_enabled():
-            logger.info(f" LangSmith tracing is enabled. user_id={user_id}")
-        else:
-            logger.info(f" LangSmith tracing is not enabled. user_id={user_id}")
+        hasura_memory = hasura_memory or HasuraMemory(
+            hasura_url=HASURA_GRAPHQL_URL,
+            hasura_secret=HASURA_ADMIN_SECRET,
+            hasura_role=HASURA_ROLE,
+            company_id=chat_request.company_id,
+            user_id=chat_request.user_id
+        )
+    except Exception as e:
+        logger.error(f"[trace_id={conversation_id}] Failed to initialize HasuraMemory for user_id={user_id}: {e}")
+        raise ChatError("Something went wrong. Please try again later.")
 
-        # Initialize Hasura memory
-        try:
-            hasura_memory = HasuraMemory(
-                hasura_url=HASURA_GRAPHQL_URL,
-                hasura_secret=HASURA_ADMIN_SECRET,
-                hasura_role=HASURA_ROLE,
-                company_id=chat_request.company_id,
-                user_id=chat_request.user_id
-            )
-        except Exception as e:
-            logger.error(f"[trace_id={conversation_id}] Failed to initialize HasuraMemory for user_id={user_id}: {e}")
-            return "Something went wrong. Please try again later."
+    #get the compiled graph, tenant values are passed through the config
+    try:
+        graph = get_graph(chat_request.company_type)
+    except Exception as e:
+        logger.error(f"[trace_id={conversation_id}] Failed to build graph for user_id={user_id}: {e}")
+        raise ChatError("Something went wrong. Please try again later.")
 
-        #build graph
-        try:
-            if company_type == "BLOODBANK":
-                logger.info("BLOODBANK")
-                graph = blood_build_graph(chat_request.company_id, chat_request.user_id)
-
-            else:
-                logger.info("HOSPITAL")
-                graph = build_graph(chat_request.company_id, chat_request.user_id)
-                
-        except Exception as e:
-            logger.error(f"[trace_id={conversation_id}] Failed to build graph for user_id={user_id}: {e}")
-            return "Something went wrong. Please try again later."
+    graph_config = {
+        "configurable": {
+            **config.get("configurable", {}),
+            "company_id": chat_request.company_id,
+            "user_id": chat_request.user_id,
+            # Monotonic deadline for retry loops inside the graph
+            "deadline": time.monotonic() + GRAPH_REQUEST_DEADLINE,
+        },
+        "callbacks": [GraphMetricsHandler()],
+    }
 
-        # validate user input
-        if not chat_request.message:
-            logger.warning(f"[trace_id={conversation_id}] Empty message received from user_id={user_id}")
-            return "Error processing the request. Please provide a valid input."
+    # validate user input
+    if not chat_request.message:
+        logger.warning(f"[trace_id={conversation_id}] Empty message received from user_id={user_id}")
+        raise ChatError("Error processing the request. Please provide a valid input.")
 
-        # fetch history
-        try:
-            history = hasura_memory.get_messages(config)
-        except Exception as e:
-            logger.error(f"[trace_id={conversation_id}] Failed to fetch message history for user_id={user_id}: {e}")
-            history = []
-        # print("history messages :", history)
-
-        history_length = len(history) if history else 0
-        logger.info(f" Retrieved history for user_id={user_id}, length={history_length}")
-        # return "test response"
-        # invoke the graph
-        if history_length > 0:
-            history_context = "\n".join(
-                    f"I am asked {msg.content}" if isinstance(msg, HumanMessage)
-                    else f"then I got {msg.content}"
-                    for msg in history
-                )
-        else:
-            history_context = ""
-
-        message = [HumanMessage(content=chat_request.message, additional_kwargs={"tag": "user_input"})]
-        # print("history_context :", history_context)
-        history_context = history_context + "so consider this context. Now, I am asked "
-        
-        try:
-            output = graph.invoke({
-                "messages": message,
-                "history": history,
-                "history_context": history_context,
-                "nodes": ["input"],
-                "time": [store_datetime()],
-            })
-        except Exception as e:
-            logger.error(f"[trace_id={conversation_id}] Graph invocation failed for user_id={user_id}: {e}")
-            return "Sorry, I could not generate a response at this time. Please try again later."
+    # fetch history and the session's rolling summary together
+    with timed("history"):
+        history, summary = await asyncio.gather(
+            hasura_memory.aget_messages(config),
+            session_summaries.get(hasura_memory, HasuraMemory._thread_id(config)),
+            return_exceptions=True,
+        )
+    if isinstance(history, Exception):
+        logger.error(f"[trace_id={conversation_id}] Failed to fetch message history for user_id={user_id}: {history}")
+        history = []
+    if isinstance(summary, Exception):
+        logger.error(f"[trace_id={conversation_id}] Failed to fetch session summary for user_id={user_id}: {summary}")
+        summary = None
+    # print("history messages :", history)
 
-        logger.info(f"Graph invocation successful. user_id={user_id}")
-        logger.debug(f"[trace_id={conversation_id}] Output nodes: {output.get('nodes')}, time: {output.get('time')}")
+    history_length = len(history) if history else 0
+    logger.info(f" Retrieved history for user_id={user_id}, length={history_length}")
+    # The summary covers the older turns; the ones after it go in verbatim, within the planner's
+    # token budget and with long answers cut
+    summary_text = summary.text if summary else ""
+    recent = session_summaries.unsummarized(summary, history) if summary_text else history
+    context = history_builder.build(recent, "intent_planner")
+    logger.info(
+        f"[trace_id={conversation_id}] History context: tokens={context.tokens}, "
+        f"messages={len(context.messages)}, dropped={context.dropped}, summarized={summary.messages if summary else 0}"
+    )
+    message = [HumanMessage(content=chat_request.message, additional_kwargs={"tag": "user_input"})]
+    history_context = context.text() + HISTORY_CONTEXT_SUFFIX
+    if summary_text:
+        history_context = f"{SUMMARY_LEAD_IN}{summary_text}\n{history_context}"
 
-        # Save messages
-        try:
-            store_messages = output.get("messages", [])
-            hasura_memory.save_messages(
+    inputs = {
+        "messages": message,
+        "history": history,
+        "history_context": history_context,
+        "nodes": ["input"],
+        "time": [store_datetime()],
+    }
+    return hasura_memory, graph, inputs, graph_config
+
+
+def report_graph_usage(graph_config: Dict[str, Any], output: Dict[str, Any], conversation_id: str) -> None:
+    usage = observe_graph_run(graph_config["callbacks"][0], output)
+    logger.info(
+        f"[trace_id={conversation_id}] Graph usage: iterations={usage['iterations']}, llm_calls={usage['llm_calls']}, "
+        f"prompt_tokens={usage['prompt_tokens']}, cached_tokens={usage['cached_tokens']}, "
+        f"completion_tokens={usage['completion_tokens']}"
+    )
+
+
+async def save_graph_output(hasura_memory: HasuraMemory, config: Dict[str, Any], output: Dict[str, Any], conversation_id: str, user_id: str, history: Optional[List[Any]] = None) -> str:
+    """
+    Queue the graph messages for write-behind persistence, schedule the background update of
+    the session summary with the new turn and return the final response text.
+    """
+    logger.info(f"Graph invocation successful. user_id={user_id}")
+    timings = current_request_timings()
+    logger.debug(
+        f"[trace_id={conversation_id}] Output nodes: {output.get('nodes')}, time: {output.get('time')}, "
+        f"timings: {timings.header() if timings else None}"
+    )
+
+    store_messages = output.get("messages", [])
+    try:
+        with timed("persist"):
+            hasura_memory.enqueue_messages(
                 config,
                 store_messages,
                 nodes=output.get("nodes"),
                 time=output.get("time"),
                 conversation_id=conversation_id
             )
+    except Exception as e:
+        logger.error(f"[trace_id={conversation_id}] Failed to store messages for user_id={user_id}: {e}")
+
+    if store_messages and history is not None:
+        # The turn as the history will hold it: the question and the final response
+        turn = [store_messages[0], AIMessage(content=store_messages[-1].content)]
+        session_summaries.schedule(hasura_memory, HasuraMemory._thread_id(config), list(history) + turn)
+
+    return store_messages[-1].content.replace("*", "") if store_messages else FALLBACK_RESPONSE
+
+
+def cached_answer_output(inputs: Dict[str, Any], cached: CachedAnswer) -> Dict[str, Any]:
+    """Graph-shaped output for a cached answer, so the conversation is persisted like a graph run."""
+    return {
+        "messages": inputs["messages"] + [AIMessage(content=cached.response)],
+        "nodes": inputs["nodes"] + [cached.node],
+        "time": inputs["time"] + [store_datetime()],
+    }
+
+
+def fast_path_output(inputs: Dict[str, Any], answer: FastPathAnswer) -> Dict[str, Any]:
+    """Graph-shaped output for a fast-path answer, persisted as a general_response turn."""
+    return {
+        "messages": inputs["messages"] + [AIMessage(content=answer.response, additional_kwargs={"tag": "fast_path"})],
+        "nodes": inputs["nodes"] + ["general_response"],
+        "time": inputs["time"] + [store_datetime()],
+    }
+
+
+async def answer_cache_key(chat_request, hasura_memory: HasuraMemory, history) -> Optional[tuple]:
+    """Answer cache key of a chat, including the freshness token of the company's data."""
+    if not answer_cache.enabled:
+        return None
+    with timed("freshness"):
+        freshness = await data_freshness.token(chat_request.company_type, hasura_memory)
+    return answer_cache.key(chat_request.company_type, hasura_memory.permission_scope, chat_request.message, history, freshness)
+
+
+def coalesce_key(chat_request, hasura_memory: HasuraMemory, history) -> Optional[tuple]:
+    """
+    Identical concurrent chats (same question and history) within one permission scope share
+    one graph run: the users of a company when HASURA_PERMISSION_SCOPE is "company", otherwise
+    only the same user's concurrent chats.
+    """
+    if not CHAT_COALESCE_ENABLED:
+        return None
+    company_type = getattr(chat_request.company_type, "value", chat_request.company_type)
+    return (company_type, hasura_memory.permission_scope, normalize_message(chat_request.message), history_fingerprint(history))
+
+
+def own_output(inputs: Dict[str, Any], output: Dict[str, Any]) -> Dict[str, Any]:
+    """A shared graph output with this request's own input message, ready to be persisted."""
+    own = inputs["messages"]
+    return {**output, "messages": own + output.get("messages", [])[len(own):]}
+
+
+@traceable(name="generate_chat_response", tags=["chatbot", "langgraph"])
+async def generate_chat_response(chat_request, config: Dict[str, Any], conversation_id: str = get_message_unique_id(), hasura_memory: Optional[HasuraMemory] = None) -> str:
+    """Generate a chat response using the graph."""
+    user_id = chat_request.user_id
+
+    try:
+        try:
+            hasura_memory, graph, inputs, graph_config = await prepare_graph_run(chat_request, config, conversation_id, hasura_memory)
+        except ChatError as e:
+            return str(e)
+
+        with timed("fast_path"):
+            small_talk = fast_path.match(chat_request.company_type, chat_request.message, inputs["history"])
+        if small_talk:
+            logger.info(f"[trace_id={conversation_id}] Fast path '{small_talk.rule}' answer for user_id={user_id}")
+            return await save_graph_output(hasura_memory, config, fast_path_output(inputs, small_talk), conversation_id, user_id, inputs["history"])
+
+        cache_key = await answer_cache_key(chat_request, hasura_memory, inputs["history"])
+        cached = answer_cache.get(cache_key)
+        if cached:
+            logger.info(f"[trace_id={conversation_id}] Answer cache hit for user_id={user_id}")
+            return await save_graph_output(hasura_memory, config, cached_answer_output(inputs, cached), conversation_id, user_id, inputs["history"])
+
+        async def run_graph():
+            start = time.monotonic()
+            output = await graph.ainvoke(inputs, config=graph_config)
+            answer_cache.put(cache_key, output, (time.monotonic() - start) * 1000)
+            report_graph_usage(graph_config, output, conversation_id)
+            return output
+
+        try:
+            with timed("graph"):
+                output = await chat_flight.do(coalesce_key(chat_request, hasura_memory, inputs["history"]), run_graph)
         except Exception as e:
-            logger.error(f"[trace_id={conversation_id}] Failed to store messages for user_id={user_id}: {e}")
+            logger.error(f"[trace_id={conversation_id}] Graph invocation failed for user_id={user_id}: {e}")
+            return "Sorry, I could not generate a response at this time. Please try again later."
 
-        # Return response
-        return (
-            store_messages[-1].content.replace("*", "")
-            if store_messages else
-            "I'm having trouble generating a response right now. Please try again later, and I'll do my best to help you."
-        )
+        # Every conversation is persisted under its own user, session and conversation_id
+        return await save_graph_output(hasura_memory, config, own_output(inputs, output), conversation_id, user_id, inputs["history"])
 
     except Exception as e:
         logger.error(f"[trace_id={conversation_id}] Unexpected error for user_id={user_id}: {e}")
         return "We're experiencing technical difficulties. Our team is working to resolve this as soon as possible. Please try again later."
 
 
+async def stream_chat_response(chat_request, config: Dict[str, Any], conversation_id: str, hasura_memory: Optional[HasuraMemory] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run the graph and yield progress events as they happen:
+    ``node_start``/``node_end`` for every graph node, ``token`` for each LLM chunk of a
+    final-response node, then a single ``final`` event with the full response.
+    Messages are saved after the final event so persistence never delays the answer.
+    """
+    user_id = chat_request.user_id
+    try:
+        hasura_memory, graph, inputs, graph_config = await prepare_graph_run(chat_request, config, conversation_id, hasura_memory)
+    except ChatError as e:
+        yield {"event": "final", "response": str(e)}
+        return
+
+    small_talk = fast_path.match(chat_request.company_type, chat_request.message, inputs["history"])
+    if small_talk:
+        yield {"event": "final", "response": small_talk.response}
+        await save_graph_output(hasura_memory, config, fast_path_output(inputs, small_talk), conversation_id, user_id, inputs["history"])
+        return
+
+    cache_key = await answer_cache_key(chat_request, hasura_memory, inputs["history"])
+    cached = answer_cache.get(cache_key)
+    if cached:
+        output = cached_answer_output(inputs, cached)
+        yield {"event": "final", "response": cached.response.replace("*", "")}
+        await save_graph_output(hasura_memory, config, output, conversation_id, user_id, inputs["history"])
+        return
+
+    output = None
+    start = time.monotonic()
+    try:
+        async for event in graph.astream_events(inputs, config=graph_config, version="v2"):
+            kind = event["event"]
+            node = event.get("metadata", {}).get("langgraph_node")
+
+            if kind == "on_chat_model_stream" and node in FINAL_RESPONSE_NODES:
+                token = event["data"]["chunk"].content
+                if token:
+                    yield {"event": "token", "node": node, "content": token.replace("*", "")}
+            elif kind in ("on_chain_start", "on_chain_end") and node and event["name"] == node:
+                yield {"event": "node_start" if kind == "on_chain_start" else "node_end", "node": node}
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                output = event["data"].get("output")
+    except Exception as e:
+        logger.error(f"[trace_id={conversation_id}] Graph streaming failed for user_id={user_id}: {e}")
+        yield {"event": "final", "response": "Sorry, I could not generate a response at this time. Please try again later."}
+        return
+
+    if not output:
+        yield {"event": "final", "response": FALLBACK_RESPONSE}
+        return
+
+    answer_cache.put(cache_key, output, (time.monotonic() - start) * 1000)
+    report_graph_usage(graph_config, output, conversation_id)
+    store_messages = output.get("messages", [])
+    response = store_messages[-1].content.replace("*", "") if store_messages else FALLBACK_RESPONSE
+    yield {"event": "final", "response": response}
 
+    await save_graph_output(hasura_memory, config, output, conversation_id, user_id, inputs["history"])
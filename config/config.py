@@ -1,4 +1,5 @@
 # app/config.py
+import json
 from typing import List, Optional
 
 from dotenv import load_dotenv
@@ -19,12 +20,76 @@ class Settings(BaseSettings):
     # OpenAI settings
     OPENAI_API_KEY: str = Field(..., env="OPENAI_API_KEY")
     OPENAI_MODEL: str = Field("gpt-4o-mini", env="OPENAI_MODEL")
+    # Per-node model/max_tokens/timeout overrides as JSON, e.g. {"data_analyser": {"model": "gpt-4o"}}
+    LLM_ROUTES: str = Field("", env="LLM_ROUTES")
+    LLM_DEFAULT_TIMEOUT: float = Field(30.0, env="LLM_DEFAULT_TIMEOUT")
+    # Stronger model for calls that failed to parse or keep producing invalid queries ("" disables)
+    LLM_ESCALATION_MODEL: str = Field("gpt-4o", env="LLM_ESCALATION_MODEL")
+    LLM_ESCALATE_AFTER_ERRORS: int = Field(2, env="LLM_ESCALATE_AFTER_ERRORS")
     
     # Hasura settings
     HASURA_ADMIN_SECRET: str = Field(..., env="HASURA_ADMIN_SECRET")
     HASURA_GRAPHQL_URL: str = Field(..., env="HASURA_GRAPHQL_URL")
     HASURA_ROLE: str = Field("admin", env="HASURA_ROLE")
+    # What HASURA_ROLE's permissions filter on: "user" (x-hasura-user-id) or "company" (X-Hasura-Company-Id only).
+    # Cached filter values, cached answers and coalesced graph runs are shared within this scope.
+    HASURA_PERMISSION_SCOPE: str = Field("user", env="HASURA_PERMISSION_SCOPE")
+    HASURA_POOL_SIZE: int = Field(20, env="HASURA_POOL_SIZE")
+    HASURA_TIMEOUT: float = Field(10.0, env="HASURA_TIMEOUT")
+    HASURA_KEEPALIVE_EXPIRY: float = Field(30.0, env="HASURA_KEEPALIVE_EXPIRY")
+    # Introspection result to validate generated queries against ("" = introspect once per process)
+    HASURA_SCHEMA_SNAPSHOT: str = Field("", env="HASURA_SCHEMA_SNAPSHOT")
+    HASURA_SCHEMA_RETRY_AFTER: float = Field(60.0, env="HASURA_SCHEMA_RETRY_AFTER")
     
+    # Cache settings
+    FILTER_CACHE_TTL: float = Field(600.0, env="FILTER_CACHE_TTL")
+    FILTER_CACHE_REFRESH_AHEAD: float = Field(0.8, env="FILTER_CACHE_REFRESH_AHEAD")
+    HISTORY_MAX_MESSAGES: int = Field(20, env="HISTORY_MAX_MESSAGES")
+    HISTORY_MAX_TOKENS: int = Field(3000, env="HISTORY_MAX_TOKENS")
+    HISTORY_CACHE_MAX_BYTES: int = Field(64 * 1024 * 1024, env="HISTORY_CACHE_MAX_BYTES")
+    HISTORY_CACHE_TTL: float = Field(1800.0, env="HISTORY_CACHE_TTL")
+    # Token budget of the history given to each node ("node:tokens,..."); other nodes get the default
+    HISTORY_CONTEXT_BUDGETS: str = Field("intent_planner:1500,speculative_query:600", env="HISTORY_CONTEXT_BUDGETS")
+    HISTORY_CONTEXT_DEFAULT_TOKENS: int = Field(1000, env="HISTORY_CONTEXT_DEFAULT_TOKENS")
+    # Longer assistant answers are cut to this many tokens in the history context
+    HISTORY_ANSWER_MAX_TOKENS: int = Field(200, env="HISTORY_ANSWER_MAX_TOKENS")
+    KNOWN_SESSIONS_MAX: int = Field(100_000, env="KNOWN_SESSIONS_MAX")
+    # Rolling per-session summary; the newest messages stay verbatim in the prompt
+    SESSION_SUMMARY_ENABLED: bool = Field(True, env="SESSION_SUMMARY_ENABLED")
+    SESSION_SUMMARY_RECENT_MESSAGES: int = Field(6, env="SESSION_SUMMARY_RECENT_MESSAGES")
+    SESSION_SUMMARY_MAX_TOKENS: int = Field(300, env="SESSION_SUMMARY_MAX_TOKENS")
+    SESSION_SUMMARY_CACHE_MAX: int = Field(10_000, env="SESSION_SUMMARY_CACHE_MAX")
+    SESSION_SUMMARY_CACHE_TTL: float = Field(1800.0, env="SESSION_SUMMARY_CACHE_TTL")
+    ANSWER_CACHE_ENABLED: bool = Field(True, env="ANSWER_CACHE_ENABLED")
+    ANSWER_CACHE_TTL: float = Field(300.0, env="ANSWER_CACHE_TTL")
+    ANSWER_CACHE_MAX_BYTES: int = Field(16 * 1024 * 1024, env="ANSWER_CACHE_MAX_BYTES")
+    ANSWER_CACHE_MAX_ENTRY_BYTES: int = Field(64 * 1024, env="ANSWER_CACHE_MAX_ENTRY_BYTES")
+    # How long a company's data freshness token is reused before Hasura is asked again
+    ANSWER_CACHE_FRESHNESS_TTL: float = Field(30.0, env="ANSWER_CACHE_FRESHNESS_TTL")
+    CHAT_COALESCE_ENABLED: bool = Field(True, env="CHAT_COALESCE_ENABLED")
+    # Company types whose greetings/thanks/capability questions are answered without the graph (comma-separated)
+    FAST_PATH_COMPANY_TYPES: str = Field("HOSPITAL,BLOODBANK", env="FAST_PATH_COMPANY_TYPES")
+
+    # Write-behind persistence of chat messages
+    WRITE_BEHIND_BATCH_SIZE: int = Field(50, env="WRITE_BEHIND_BATCH_SIZE")
+    WRITE_BEHIND_FLUSH_INTERVAL: float = Field(1.0, env="WRITE_BEHIND_FLUSH_INTERVAL")
+    WRITE_BEHIND_MAX_QUEUE: int = Field(5000, env="WRITE_BEHIND_MAX_QUEUE")
+    WRITE_BEHIND_SPILL_PATH: str = Field("logs/chat_messages_spill.jsonl", env="WRITE_BEHIND_SPILL_PATH")
+    # Rows still rejected after this many inserts move to the dead-letter file
+    WRITE_BEHIND_MAX_ATTEMPTS: int = Field(5, env="WRITE_BEHIND_MAX_ATTEMPTS")
+    WRITE_BEHIND_DEAD_LETTER_PATH: str = Field("logs/chat_messages_dead_letter.jsonl", env="WRITE_BEHIND_DEAD_LETTER_PATH")
+    # Unique constraint on chat_messages (conversation_id, step) that makes a re-insert a no-op, e.g.
+    # "chat_messages_conversation_id_step_key"; empty (plain inserts) until the database has one
+    CHAT_MESSAGES_CONFLICT_CONSTRAINT: str = Field("", env="CHAT_MESSAGES_CONFLICT_CONSTRAINT")
+
+    # Graph settings
+    QUERY_MAX_ITERATIONS: int = Field(3, env="QUERY_MAX_ITERATIONS")
+    GRAPH_REQUEST_DEADLINE: float = Field(45.0, env="GRAPH_REQUEST_DEADLINE")
+    # "two_step" (intent_planner, then query_generate) or "fused" (one planner call that also writes the query)
+    GRAPH_PLANNER_MODE: str = Field("two_step", env="GRAPH_PLANNER_MODE")
+    # Two-step mode: start query generation on the raw message while intent_planner runs
+    SPECULATIVE_QUERY_ENABLED: bool = Field(False, env="SPECULATIVE_QUERY_ENABLED")
+
     # App settings
     # APP_DEBUG: bool = Field("False", env="APP_DEBUG")
     APP_DEBUG: bool = Field(False, env="APP_DEBUG")
@@ -61,6 +126,12 @@ OPENAI_API_KEY = settings.OPENAI_API_KEY
 HASURA_ADMIN_SECRET = settings.HASURA_ADMIN_SECRET
 HASURA_GRAPHQL_URL = settings.HASURA_GRAPHQL_URL
 HASURA_ROLE = settings.HASURA_ROLE
+HASURA_PERMISSION_SCOPE = settings.HASURA_PERMISSION_SCOPE.strip().lower()
+HASURA_POOL_SIZE = settings.HASURA_POOL_SIZE
+HASURA_TIMEOUT = settings.HASURA_TIMEOUT
+HASURA_KEEPALIVE_EXPIRY = settings.HASURA_KEEPALIVE_EXPIRY
+HASURA_SCHEMA_SNAPSHOT = settings.HASURA_SCHEMA_SNAPSHOT
+HASURA_SCHEMA_RETRY_AFTER = settings.HASURA_SCHEMA_RETRY_AFTER
 API_KEY = settings.API_KEY
 API_KEY_NAME = settings.API_KEY_NAME
 APP_DEBUG = settings.APP_DEBUG
@@ -68,8 +139,49 @@ LOG_LEVEL = settings.LOG_LEVEL
 RATE_LIMIT_PER_MINUTE = settings.RATE_LIMIT_PER_MINUTE
 ALLOWED_ORIGINS = settings.ALLOWED_ORIGINS
 OPENAI_MODEL = settings.OPENAI_MODEL
+LLM_ROUTES = json.loads(settings.LLM_ROUTES) if settings.LLM_ROUTES.strip() else {}
+LLM_DEFAULT_TIMEOUT = settings.LLM_DEFAULT_TIMEOUT
+LLM_ESCALATION_MODEL = settings.LLM_ESCALATION_MODEL.strip()
+LLM_ESCALATE_AFTER_ERRORS = settings.LLM_ESCALATE_AFTER_ERRORS
 LANGCHAIN_TRACING_V2 = settings.LANGCHAIN_TRACING_V2
 LANGCHAIN_ENDPOINT = settings.LANGCHAIN_ENDPOINT
 LANGCHAIN_API_KEY = settings.LANGCHAIN_API_KEY
+FILTER_CACHE_TTL = settings.FILTER_CACHE_TTL
+FILTER_CACHE_REFRESH_AHEAD = settings.FILTER_CACHE_REFRESH_AHEAD
+HISTORY_MAX_MESSAGES = settings.HISTORY_MAX_MESSAGES
+HISTORY_MAX_TOKENS = settings.HISTORY_MAX_TOKENS
+HISTORY_CACHE_MAX_BYTES = settings.HISTORY_CACHE_MAX_BYTES
+HISTORY_CACHE_TTL = settings.HISTORY_CACHE_TTL
+HISTORY_CONTEXT_BUDGETS = {
+    node.strip(): int(tokens)
+    for node, _, tokens in (item.partition(":") for item in settings.HISTORY_CONTEXT_BUDGETS.split(","))
+    if node.strip() and tokens.strip()
+}
+HISTORY_CONTEXT_DEFAULT_TOKENS = settings.HISTORY_CONTEXT_DEFAULT_TOKENS
+HISTORY_ANSWER_MAX_TOKENS = settings.HISTORY_ANSWER_MAX_TOKENS
+KNOWN_SESSIONS_MAX = settings.KNOWN_SESSIONS_MAX
+SESSION_SUMMARY_ENABLED = settings.SESSION_SUMMARY_ENABLED
+SESSION_SUMMARY_RECENT_MESSAGES = settings.SESSION_SUMMARY_RECENT_MESSAGES
+SESSION_SUMMARY_MAX_TOKENS = settings.SESSION_SUMMARY_MAX_TOKENS
+SESSION_SUMMARY_CACHE_MAX = settings.SESSION_SUMMARY_CACHE_MAX
+SESSION_SUMMARY_CACHE_TTL = settings.SESSION_SUMMARY_CACHE_TTL
+ANSWER_CACHE_ENABLED = settings.ANSWER_CACHE_ENABLED
+ANSWER_CACHE_TTL = settings.ANSWER_CACHE_TTL
+ANSWER_CACHE_MAX_BYTES = settings.ANSWER_CACHE_MAX_BYTES
+ANSWER_CACHE_MAX_ENTRY_BYTES = settings.ANSWER_CACHE_MAX_ENTRY_BYTES
+ANSWER_CACHE_FRESHNESS_TTL = settings.ANSWER_CACHE_FRESHNESS_TTL
+CHAT_COALESCE_ENABLED = settings.CHAT_COALESCE_ENABLED
+FAST_PATH_COMPANY_TYPES = tuple(t.strip().upper() for t in settings.FAST_PATH_COMPANY_TYPES.split(",") if t.strip())
+WRITE_BEHIND_BATCH_SIZE = settings.WRITE_BEHIND_BATCH_SIZE
+WRITE_BEHIND_FLUSH_INTERVAL = settings.WRITE_BEHIND_FLUSH_INTERVAL
+WRITE_BEHIND_MAX_QUEUE = settings.WRITE_BEHIND_MAX_QUEUE
+WRITE_BEHIND_SPILL_PATH = settings.WRITE_BEHIND_SPILL_PATH
+WRITE_BEHIND_MAX_ATTEMPTS = settings.WRITE_BEHIND_MAX_ATTEMPTS
+WRITE_BEHIND_DEAD_LETTER_PATH = settings.WRITE_BEHIND_DEAD_LETTER_PATH
+CHAT_MESSAGES_CONFLICT_CONSTRAINT = settings.CHAT_MESSAGES_CONFLICT_CONSTRAINT
+QUERY_MAX_ITERATIONS = settings.QUERY_MAX_ITERATIONS
+GRAPH_REQUEST_DEADLINE = settings.GRAPH_REQUEST_DEADLINE
+GRAPH_PLANNER_MODE = settings.GRAPH_PLANNER_MODE
+SPECULATIVE_QUERY_ENABLED = settings.SPECULATIVE_QUERY_ENABLED
 
 
@@ -0,0 +1,307 @@
+"""
+Deterministic resolution of time phrases ("today", "last week", "June 2025", "last 3 months")
+into concrete filter values, in Asia/Kolkata time.
+
+query_generate (and the fused planner) get the resolved ``creation_date_and_time`` range and
+``month_year`` keys as slots in their prompt, together with the current time at the moment of
+the request, instead of working them out from a timestamp. The query templates and the
+answer cache key on the same concrete ranges.
+
+Ranges are half-open: ``_gte`` the first day at 00:00, ``_lt`` the day after the last one.
+"since June" runs up to today; separate phrases ("june 2024 and june 2025") stay separate
+ranges.
+"""
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+TIMEZONE = ZoneInfo("Asia/Kolkata")
+# A span longer than this lists no month_year keys (the LLM groups or filters by date instead)
+MAX_MONTH_KEYS = 24
+
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+RELATIVE_MONTH_RE = re.compile(r"\b(this|current|last|previous)\s+month\b")
+MONTH_RE = re.compile(
+    r"\b(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|"
+    r"oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b[\s,-]*(\d{4})?"
+)
+
+DateSpan = Tuple[date, date]
+
+
+class DateRange(NamedTuple):
+    phrase: str
+    start: date
+    end: date  # exclusive
+    open_ended: bool  # "since …": runs up to and including today
+
+
+class DateSlots(NamedTuple):
+    ranges: List[DateRange]
+    month_years: List[str]
+
+    @property
+    def phrases(self) -> List[str]:
+        return [r.phrase for r in self.ranges]
+
+    def creation_filter(self) -> Optional[Dict[str, str]]:
+        """The ``creation_date_and_time`` filter of a single range; separate periods have none."""
+        if len(self.ranges) != 1:
+            return None
+        return {"_gte": _iso(self.ranges[0].start), "_lt": _iso(self.ranges[0].end)}
+
+    def month_year_filter(self) -> Optional[Dict[str, object]]:
+        if not self.month_years:
+            return None
+        if len(self.month_years) == 1:
+            return {"_eq": self.month_years[0]}
+        return {"_in": self.month_years}
+
+    @property
+    def whole_months(self) -> bool:
+        return all(r.start.day == 1 and r.end.day == 1 and not r.open_ended for r in self.ranges)
+
+    def key(self) -> Tuple[Tuple[str, str], ...]:
+        return tuple((r.start.isoformat(), r.end.isoformat()) for r in self.ranges)
+
+    def context(self) -> str:
+        """Prompt section with the resolved filter values."""
+        lines = ["RESOLVED DATES (use these exact values, do not recompute them):"]
+        for r in self.ranges:
+            until = " (up to now)" if r.open_ended else ""
+            lines.append(f"    - “{r.phrase}”: `creation_date_and_time`: {{ _gte: \"{_iso(r.start)}\", _lt: \"{_iso(r.end)}\" }}{until}")
+        if len(self.ranges) > 1:
+            lines.append("    These are separate periods: filter each one (e.g. with _or), do not merge them into one range.")
+        if self.month_years:
+            lines.append(f"    - `month_year`: {', '.join(self.month_years)}")
+        return "\n".join(lines)
+
+
+def now_ist() -> datetime:
+    return datetime.now(TIMEZONE)
+
+
+def _iso(day: date) -> str:
+    return datetime.combine(day, time()).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _month_start(day: date, months: int = 0) -> date:
+    """First day of the month ``months`` away from ``day``'s month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _shift_months(day: date, months: int) -> date:
+    first = _month_start(day, months)
+    last_day = (_month_start(first, 1) - timedelta(days=1)).day
+    return first.replace(day=min(day.day, last_day))
+
+
+def _month_number(name: str) -> int:
+    return next(i for i, month in enumerate(MONTHS, 1) if month.startswith(name[:3]))
+
+
+def _unit_span(unit: str, today: date, offset: int) -> DateSpan:
+    """The calendar week/month/quarter/year ``offset`` units from the current one."""
+    if unit == "week":
+        start = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+        return start, start + timedelta(weeks=1)
+    if unit == "month":
+        start = _month_start(today, offset)
+        return start, _month_start(start, 1)
+    if unit == "quarter":
+        start = _month_start(today, -((today.month - 1) % 3) + 3 * offset)
+        return start, _month_start(start, 3)
+    start = date(today.year + offset, 1, 1)
+    return start, date(start.year + 1, 1, 1)
+
+
+def _relative_unit(match: re.Match, today: date, year_hint: Optional[int]) -> DateSpan:
+    which, unit = match.group(1), match.group(2)
+    if which == "past":
+        return _rolling(1, unit, today)
+    offset = {"this": 0, "current": 0, "last": -1, "previous": -1, "next": 1}[which]
+    return _unit_span(unit, today, offset)
+
+
+def _rolling(count: int, unit: str, today: date) -> DateSpan:
+    """The last ``count`` days/weeks/months/years up to and including today."""
+    end = today + timedelta(days=1)
+    if unit == "day":
+        return end - timedelta(days=count), end
+    if unit == "week":
+        return end - timedelta(weeks=count), end
+    months = count if unit == "month" else 12 * count
+    return _shift_months(end, -months), end
+
+
+def _rolling_match(match: re.Match, today: date, year_hint: Optional[int]) -> DateSpan:
+    return _rolling(int(match.group(1)), match.group(2), today)
+
+
+def _day(offset: int) -> Callable[[re.Match, date, Optional[int]], DateSpan]:
+    def span(match: re.Match, today: date, year_hint: Optional[int]) -> DateSpan:
+        day = today + timedelta(days=offset)
+        return day, day + timedelta(days=1)
+    return span
+
+
+def _single_day(day: date) -> DateSpan:
+    return day, day + timedelta(days=1)
+
+
+def _iso_date(match: re.Match, today: date, year_hint: Optional[int]) -> DateSpan:
+    return _single_day(date(int(match.group(1)), int(match.group(2)), int(match.group(3))))
+
+
+def _implied_year(month: int, today: date, year_hint: Optional[int]) -> int:
+    """
+    Year of a month named without one: the year written elsewhere in the question
+    ("june and july 2025"), else the month's latest occurrence.
+    """
+    if year_hint:
+        return year_hint
+    return today.year if month <= today.month else today.year - 1
+
+
+def _day_month(match: re.Match, today: date, year_hint: Optional[int]) -> DateSpan:
+    groups = match.groupdict()
+    month = _month_number(groups["month"])
+    year = int(groups["year"]) if groups.get("year") else _implied_year(month, today, year_hint)
+    return _single_day(date(year, month, int(groups["day"])))
+
+
+def _month(match: re.Match, today: date, year_hint: Optional[int]) -> DateSpan:
+    name, year = (match.groups() + (None,))[:2]
+    month = _month_number(name)
+    year = int(year) if year else _implied_year(month, today, year_hint)
+    start = date(year, month, 1)
+    return start, _month_start(start, 1)
+
+
+def _year(match: re.Match, today: date, year_hint: Optional[int]) -> DateSpan:
+    year = int(match.group(1))
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+MONTH_NAME = MONTH_RE.pattern.split(r"\b[\s,-]*")[0].replace(r"\b(", r"(?:", 1)
+YEAR_RE = re.compile(r"\b((?:19|20)\d{2})\b")
+ORDINAL = r"(?P<day>[0-3]?\d)(?:st|nd|rd|th)?"
+
+# Checked in order; each match is removed before the next pattern runs
+PATTERNS: List[Tuple[re.Pattern, Callable[[re.Match, date, Optional[int]], DateSpan]]] = [
+    (re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b"), _iso_date),
+    (re.compile(rf"\b{ORDINAL}\s+(?:of\s+)?(?P<month>{MONTH_NAME})\b(?:[\s,]+(?P<year>\d{{4}}))?"), _day_month),
+    (re.compile(rf"\b(?P<month>{MONTH_NAME})\s+{ORDINAL}\b(?!\s*\d)(?:,?\s+(?P<year>\d{{4}}))?"), _day_month),
+    (re.compile(r"\bday before yesterday\b"), _day(-2)),
+    (re.compile(r"\b(?:today|tonight)\b"), _day(0)),
+    (re.compile(r"\byesterday\b"), _day(-1)),
+    (re.compile(r"\btomorrow\b"), _day(1)),
+    (re.compile(r"\b(?:last|past|previous)\s+(\d+)\s+(day|week|month|year)s?\b"), _rolling_match),
+    (re.compile(r"\b(this|current|last|previous|past|next)\s+(week|month|quarter|year)\b"), _relative_unit),
+    # A bare "may" is usually the verb; it counts as a month with a year or after a preposition
+    (re.compile(r"\b(?:in|for|during|of|since|from)\s+(may)\b(?![\s,-]*\d{4})"), _month),
+    (re.compile(MONTH_RE.pattern.replace("|may|", "|may(?=[\\s,-]*\\d{4})|", 1)), _month),
+    (re.compile(r"\b(?:in|for|during|of|year)\s+(20\d{2})\b"), _year),
+]
+
+
+# Word before a phrase that makes it the start of an open range ("since june": June up to now)
+OPEN_START_WORDS = {"since", "from", "after", "starting"}
+# "from/between <phrase> to/and <phrase>" is one range from the first to the second
+RANGE_START_WORDS = {"from", "between"}
+RANGE_JOIN_WORDS = {"to", "until", "till", "through", "and", "-"}
+LEAD_WORD_RE = re.compile(r"(\S+)\s*$")
+
+
+def _month_keys(ranges: List[DateRange]) -> List[str]:
+    keys: List[str] = []
+    for r in ranges:
+        month = _month_start(r.start)
+        while month < r.end and len(keys) <= MAX_MONTH_KEYS:
+            key = f"{MONTHS[month.month - 1].capitalize()}-{month.year}"
+            if key not in keys:
+                keys.append(key)
+            month = _month_start(month, 1)
+    return keys if len(keys) <= MAX_MONTH_KEYS else []
+
+
+def _lead_word(text: str, start: int, phrase: str) -> str:
+    """The word introducing a phrase: its own first word ("since may") or the one before it."""
+    first = phrase.split()[0]
+    if first in OPEN_START_WORDS | RANGE_START_WORDS:
+        return first
+    match = LEAD_WORD_RE.search(text[:start])
+    return match.group(1) if match else ""
+
+
+def _find_phrases(text: str, today: date, year_hint: Optional[int]) -> List[Tuple[int, int, str, DateSpan]]:
+    """(start, end, phrase, span) of every time phrase in ``text``, in reading order."""
+    found = []
+    masked = text
+    for pattern, span in PATTERNS:
+        for match in pattern.finditer(masked):
+            try:
+                found.append((match.start(), match.end(), match.group(0).strip(" ,-"), span(match, today, year_hint)))
+            except ValueError:
+                # Not a real date ("31 june"): leave the phrase to the LLM
+                continue
+        # Blank out matches with spaces so positions stay comparable across patterns
+        masked = pattern.sub(lambda m: " " * len(m.group(0)), masked)
+    return sorted(found)
+
+
+def resolve_dates(text: str, now: Optional[datetime] = None) -> Optional[DateSlots]:
+    """
+    Concrete ranges and month_year keys of the time phrases in ``text``, or None when it has none.
+    Phrases after since/from/after run up to today; "from X to Y" is one range; other phrases
+    stay separate ranges ("june 2024 and june 2025" is two months, not the year between them).
+    """
+    today = (now or now_ist()).date()
+    text = " ".join((text or "").lower().split())
+    years = set(YEAR_RE.findall(text))
+    year_hint = int(years.pop()) if len(years) == 1 else None
+    found = _find_phrases(text, today, year_hint)
+
+    ranges: List[DateRange] = []
+    index = 0
+    while index < len(found):
+        start, end, phrase, span = found[index]
+        lead = _lead_word(text, start, phrase)
+        if lead in RANGE_START_WORDS and index + 1 < len(found):
+            next_start, _, next_phrase, next_span = found[index + 1]
+            if text[end:next_start].strip() in RANGE_JOIN_WORDS:
+                phrase = text[start:found[index + 1][1]].strip(" ,-")
+                if not phrase.startswith(lead):
+                    phrase = f"{lead} {phrase}"
+                ranges.append(DateRange(phrase, span[0], next_span[1], False))
+                index += 2
+                continue
+        if lead in OPEN_START_WORDS:
+            first_day = span[1] if lead == "after" else span[0]
+            if not phrase.startswith(lead):
+                phrase = f"{lead} {phrase}"
+            ranges.append(DateRange(phrase, first_day, today + timedelta(days=1), True))
+        else:
+            ranges.append(DateRange(phrase, span[0], span[1], False))
+        index += 1
+
+    if not ranges:
+        return None
+    return DateSlots(ranges, _month_keys(ranges))
+
+
+def strip_dates(text: str) -> str:
+    """``text`` without its time phrases."""
+    text = " ".join((text or "").lower().split())
+    for pattern, _ in PATTERNS:
+        text = pattern.sub(" ", text)
+    return text
+
+
+def date_context(slots: Optional[DateSlots], now: Optional[datetime] = None) -> str:
+    """Current time plus the resolved dates, for the planner and query prompts."""
+    now = now or now_ist()
+    context = f"Current Date and Time (Use this for time references): {now.strftime('%Y-%m-%d %I:%M:%S %p')}."
+    return f"{context}\n{slots.context()}" if slots else context
@@ -0,0 +1,237 @@
+"""
+Local entity extraction for the intent planner.
+
+Finds blood groups, blood components, statuses and blood bank / hospital names in the user's
+message and matches them (fuzzily for names and components) against the company's cached
+filter values. Matched values are normalized to their stored spelling and handed to the
+planner as resolved slots, instead of listing every allowed value in its prompt. A value that
+matches nothing yields the clarification message directly, without an LLM call.
+
+A name matches on its full spelling or on its distinctive words; a single word of a longer name
+("city" of City Blood Bank) only right after "from/by/at/with", so ordinary words do not turn
+into filters.
+"""
+import re
+import time
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from query_templates import BLOOD_GROUP_RE, STATUS_WORDS, WORD_RE, canonical_blood_group
+
+# Field holding the counterpart's name in each company type's order view
+NAME_FIELDS = {"HOSPITAL": "blood_bank_name", "BLOODBANK": "hospital_name"}
+
+COMPONENTS = [
+    "Single Donor Platelet", "Platelet Concentrate", "Packed Red Cells", "Whole Human Blood",
+    "Platelet Rich Plasma", "Fresh Frozen Plasma", "Cryo Precipitate",
+]
+# Abbreviations and common spellings; bare "platelets" or "plasma" are ambiguous and left to the LLM
+COMPONENT_ALIASES = [
+    (re.compile(r"\b(?:single donor platelets?|sdp)\b"), "Single Donor Platelet"),
+    (re.compile(r"\b(?:platelet concentrates?|random donor platelets?|rdp)\b"), "Platelet Concentrate"),
+    (re.compile(r"\b(?:packed red (?:blood )?cells?|packed rbcs?|prbcs?|prc|red cells?)\b"), "Packed Red Cells"),
+    (re.compile(r"\b(?:whole (?:human )?blood)\b"), "Whole Human Blood"),
+    (re.compile(r"\b(?:platelet rich plasma|prp)\b"), "Platelet Rich Plasma"),
+    (re.compile(r"\b(?:fresh frozen plasma|ffp)\b"), "Fresh Frozen Plasma"),
+    (re.compile(r"\b(?:cryo ?precipitates?|cryo)\b"), "Cryo Precipitate"),
+]
+
+# Words that do not identify a blood bank / hospital on their own
+GENERIC_NAME_WORDS = {
+    "blood", "bank", "banks", "hospital", "hospitals", "centre", "center", "the", "and", "of", "pvt", "ltd",
+    "limited", "private", "clinic", "medical", "multispeciality", "multi", "speciality", "super", "care",
+}
+# "from XYZ blood bank" / "by ABC hospital": a counterpart name the user expects us to know
+NAME_MENTION = r"\b(?:from|by|at|of|to|for|with|in)\s+((?:[a-z0-9&.'-]+\s+){{1,4}}?)(?:{})s?\b"
+NAME_MENTION_RES = {
+    "blood_bank_name": re.compile(NAME_MENTION.format(r"blood\s+bank|bank")),
+    "hospital_name": re.compile(NAME_MENTION.format("hospital")),
+}
+NOT_A_NAME = {"my", "our", "the", "all", "which", "each", "every", "any", "this", "that", "a", "your", "their"}
+# Words that introduce a counterpart ("orders from apollo"); a lone word of a longer name must follow one
+NAME_CUE_WORDS = {"from", "by", "at", "with"}
+# Ordinary words that are never taken for a name core on their own
+STOPWORDS = NOT_A_NAME | NAME_CUE_WORDS | {
+    "an", "in", "on", "of", "to", "for", "and", "or", "me", "us", "is", "are", "was", "list", "give", "show",
+    "get", "what", "how", "many", "much", "last", "next", "new", "old", "main", "central",
+}
+MIN_CORE_CHARS = 3
+
+NAME_MATCH_RATIO = 0.8
+COMPONENT_MATCH_RATIO = 0.85
+
+
+class ResolvedEntities(NamedTuple):
+    slots: Dict[str, List[str]]
+    clarification: str
+
+
+def _similarity(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def _windows(words: Sequence[str], size: int) -> List[str]:
+    return [" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))]
+
+
+def _best_window_ratio(words: Sequence[str], phrase: str) -> float:
+    size = len(phrase.split())
+    return max((_similarity(window, phrase) for window in _windows(words, size)), default=0.0)
+
+
+def _options(values: Sequence[str], limit: int = 3) -> str:
+    return ", ".join(values[:limit])
+
+
+def _values(possible_values: Dict[str, Any], key: str, field: str) -> List[str]:
+    return [item[field] for item in possible_values.get(key, []) if isinstance(item, dict) and item.get(field)]
+
+
+def _blood_groups(text: str, allowed: List[str]) -> Tuple[List[str], Optional[str]]:
+    found, unknown = [], None
+    normalized = {value.upper().replace("−", "-").replace(" ", ""): value for value in allowed}
+    for match in BLOOD_GROUP_RE.finditer(text):
+        group = canonical_blood_group(*match.groups())
+        if not allowed:
+            found.append(group)
+        elif group in normalized:
+            found.append(normalized[group])
+        else:
+            unknown = group
+    clarification = None
+    if unknown:
+        clarification = (
+            f"I couldn’t find any data for ‘{unknown}’. I have options like {_options(allowed)}. "
+            "Could you let me know which one fits best?"
+        )
+    return list(dict.fromkeys(found)), clarification
+
+
+def _components(text: str, words: Sequence[str]) -> List[str]:
+    found = [component for pattern, component in COMPONENT_ALIASES if pattern.search(text)]
+    for component in COMPONENTS:
+        if component not in found and _best_window_ratio(words, component.lower()) >= COMPONENT_MATCH_RATIO:
+            found.append(component)
+    return found
+
+
+def _statuses(words: Sequence[str]) -> List[str]:
+    return list(dict.fromkeys(STATUS_WORDS[word] for word in words if word in STATUS_WORDS))
+
+
+def _name_core(name: str) -> str:
+    return " ".join(word for word in WORD_RE.findall(name.lower()) if word not in GENERIC_NAME_WORDS)
+
+
+def _cued_words(words: Sequence[str]) -> List[str]:
+    """The words right after a cue word ("from the city" -> "city")."""
+    cued = []
+    for index, word in enumerate(words[:-1]):
+        if word in NAME_CUE_WORDS:
+            following = words[index + 1:index + 3]
+            cued.append(following[1] if following[0] == "the" and len(following) > 1 else following[0])
+    return cued
+
+
+def _name_matches(name: str, words: Sequence[str], cued: Sequence[str]) -> bool:
+    full = " ".join(WORD_RE.findall(name.lower()))
+    if full and re.search(rf"\b{re.escape(full)}\b", " ".join(words)):
+        return True
+    core = _name_core(name)
+    # Short or ordinary cores ("a" of Blood Bank A) only match as part of the full name
+    if len(core) < MIN_CORE_CHARS or core in STOPWORDS:
+        return False
+    if len(core.split()) > 1 or core == full:
+        return _best_window_ratio(words, core) >= NAME_MATCH_RATIO
+    # One word of a longer name ("city" of City Blood Bank) is a name only after a cue: "from city"
+    return bool(cued) and _best_window_ratio(cued, core) >= NAME_MATCH_RATIO
+
+
+def _names(text: str, words: Sequence[str], allowed: List[str], name_field: str) -> Tuple[List[str], Optional[str]]:
+    cued = _cued_words(words)
+    found = [name for name in allowed if _name_matches(name, words, cued)]
+    if found or not allowed:
+        return found, None
+
+    # A name-like mention that matches none of the company's counterparts
+    label = "hospital" if name_field == "hospital_name" else "blood bank"
+    for match in NAME_MENTION_RES[name_field].finditer(text):
+        mention = [word for word in match.group(1).split() if word not in NOT_A_NAME]
+        if mention and not all(word in GENERIC_NAME_WORDS or word in STATUS_WORDS for word in mention):
+            said = match.group(0).split(None, 1)[1]
+            return [], (
+                f"I couldn’t find any {label} named ‘{said}’. I have options like {_options(allowed)}. "
+                "Could you let me know which one you mean?"
+            )
+    return [], None
+
+
+def resolve_entities(company_type: Any, message: str, possible_values: Optional[Dict[str, Any]]) -> ResolvedEntities:
+    """Resolved slots of ``message`` (field -> stored values), or a clarification for a value we do not have."""
+    company_type = getattr(company_type, "value", company_type)
+    possible_values = possible_values or {}
+    text = " ".join((message or "").lower().split())
+    words = WORD_RE.findall(BLOOD_GROUP_RE.sub(" ", text))
+    name_field = NAME_FIELDS.get(company_type, "blood_bank_name")
+
+    slots: Dict[str, List[str]] = {}
+    blood_groups, clarification = _blood_groups(text, _values(possible_values, "blood_groups", "blood_group"))
+    if clarification:
+        return ResolvedEntities({}, clarification)
+    names, clarification = _names(text, words, _values(possible_values, "bank_names", name_field), name_field)
+    if clarification:
+        return ResolvedEntities({}, clarification)
+
+    for field, values in (
+        ("blood_group", blood_groups),
+        (name_field, names),
+        ("order_line_items", _components(text, words)),
+        ("status", _statuses(words)),
+    ):
+        if values:
+            slots[field] = values
+    return ResolvedEntities(slots, "")
+
+
+class EntityExtractor:
+    def __init__(self):
+        self.resolved = 0
+        self.clarifications = 0
+        self.slots = 0
+        self._seconds = 0.0
+
+    def resolve(self, company_type: Any, message: str, possible_values: Optional[Dict[str, Any]]) -> ResolvedEntities:
+        start = time.perf_counter()
+        entities = resolve_entities(company_type, message, possible_values)
+        self._seconds += time.perf_counter() - start
+        if entities.clarification:
+            self.clarifications += 1
+        else:
+            self.resolved += 1
+            self.slots += sum(len(values) for values in entities.slots.values())
+        return entities
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.resolved + self.clarifications
+        return {
+            "resolved": self.resolved,
+            "clarifications": self.clarifications,
+            "slots": self.slots,
+            "avg_extract_us": round(self._seconds / total * 1e6, 2) if total else 0.0,
+        }
+
+
+def slots_context(entities: ResolvedEntities) -> str:
+    """Planner prompt section listing the resolved slots."""
+    lines = [f"    - `{field}`: {', '.join(values)}" for field, values in entities.slots.items()]
+    if not lines:
+        lines = ["    - (no restricted values mentioned)"]
+    return (
+        "RESOLVED VALUES\n"
+        "Values mentioned in the question were already matched against this company's data. "
+        "Use these exact values and do not ask for clarification about blood groups, blood components, "
+        "statuses or names:\n" + "\n".join(lines)
+    )
+
+
+entity_extractor = EntityExtractor()
@@ -0,0 +1,157 @@
+"""
+Rule-based fast path in front of the graph for small talk: greetings, thanks, goodbyes and
+"what can you do". These otherwise cost an intent_planner and a general_response LLM call.
+
+A message is answered here only when the whole message matches one rule (surrounding
+politeness and punctuation aside) and it contains nothing that looks like a data request:
+order/cost/status words, blood groups, months or numbers. Capability questions ("how does
+this work") can refer to the previous answer, so they are answered here only in a session
+without history. Everything else goes to the graph.
+Enabled per company type with ``FAST_PATH_COMPANY_TYPES``.
+"""
+import random
+import re
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from config.config import FAST_PATH_COMPANY_TYPES
+from metrics import FAST_PATH_SECONDS
+from query_templates import BLOOD_GROUP_RE, COST_WORDS, MONTH_RE, ORDER_WORDS, STATUS_WORDS, TRACK_WORDS, WORD_RE
+from utils import normalize_message
+
+RULES = {
+    "greeting": r"hi+|hello+|hey+|helo|hai|namaste|greetings|good (?:morning|afternoon|evening)|how are you(?: doing| today)?",
+    "thanks": r"thanks?|thank (?:you|u)|thx|ty|much appreciated|(?:great|cool|nice|perfect),? thanks?",
+    "farewell": r"bye|bye bye|goodbye|good night|see (?:you|ya)(?: later)?",
+    "capability": (
+        r"help|what can you do|what (?:all )?can i ask(?: you)?|what do you do|how can you help(?: me)?|"
+        r"who are you|what are you|how does this work|how do i use (?:this|you)"
+    ),
+}
+# Rules whose phrases can also be follow-ups about the previous answer
+FIRST_TURN_RULES = {"capability"}
+# Politeness around the rule ("ok thanks a lot", "hi there inhlth") that does not change its meaning
+PREFIX = r"(?:(?:ok|okay|oh|so|well|hey|hi|hello)[\s,]+)?"
+SUFFIX = r"(?:[\s,]+(?:there|inhlth|assistant|bot|team|again|a lot|so much|very much|buddy|all))*"
+RULE_PATTERNS = {
+    rule: re.compile(rf"^[\W_]*{PREFIX}(?:{pattern}){SUFFIX}[\W_]*$") for rule, pattern in RULES.items()
+}
+DATA_WORDS = ORDER_WORDS | COST_WORDS | TRACK_WORDS | STATUS_WORDS.keys() | {
+    "blood", "unit", "units", "component", "components", "plasma", "platelet", "platelets", "patient", "patients",
+    "hospital", "hospitals", "bank", "banks", "delivery", "deliveries", "stock", "report", "data",
+}
+
+CAPABILITY_RESPONSES = {
+    "HOSPITAL": """I'm Inhlth Assistant. I can look up your hospital's blood orders and billing, for example:
+• "Track my pending orders"
+• "Show rejected orders from last week"
+• "How many O+ orders did we place this month?"
+• "Give me cost details for June 2025"
+""",
+    "BLOODBANK": """I'm Inhlth Assistant. I can look up the requests hospitals send to your blood bank, for example:
+• "Show pending requests"
+• "Which hospitals sent requests today?"
+• "How many A- requests were completed last month?"
+• "What is the total billing for June 2025?"
+""",
+}
+RESPONSES: Dict[str, Dict[str, List[str]]] = {
+    "HOSPITAL": {
+        "greeting": [
+            """👋 Hello! I'm Inhlth Assistant.
+Ask me about your blood orders, deliveries or billing, for example:
+• "Track my pending orders"
+• "Give me cost details for last month"
+""",
+            """Hi there! This is Inhlth Assistant.
+I can help with order statuses and monthly billing insights. Try:
+• "Show orders rejected this week"
+• "Pending O negative orders"
+""",
+        ],
+        "thanks": ["You're welcome! Let me know if you need anything else about your orders or billing."],
+        "farewell": ["Goodbye! I'm here whenever you need order or billing insights."],
+        "capability": [CAPABILITY_RESPONSES["HOSPITAL"]],
+    },
+    "BLOODBANK": {
+        "greeting": [
+            """👋 Hello! I'm Inhlth Assistant.
+Ask me about the requests hospitals send you, for example:
+• "Show pending requests"
+• "Which hospitals sent requests today?"
+""",
+            """Hi there! This is Inhlth Assistant.
+I can help with request statuses, hospitals and billing. Try:
+• "Requests completed last month"
+• "Total billing for this month"
+""",
+        ],
+        "thanks": ["You're welcome! Let me know if you need anything else about your requests or billing."],
+        "farewell": ["Goodbye! I'm here whenever you need request or billing insights."],
+        "capability": [CAPABILITY_RESPONSES["BLOODBANK"]],
+    },
+}
+
+
+class FastPathAnswer(NamedTuple):
+    rule: str
+    response: str
+
+
+def looks_like_data_request(text: str) -> bool:
+    if BLOOD_GROUP_RE.search(text) or MONTH_RE.search(text) or re.search(r"\d", text):
+        return True
+    return any(word in DATA_WORDS for word in WORD_RE.findall(text))
+
+
+class FastPath:
+    def __init__(self, company_types=FAST_PATH_COMPANY_TYPES):
+        self.company_types = set(company_types)
+        self.hits = 0
+        self.misses = 0
+        self.rule_hits: Dict[str, int] = {}
+        self._match_seconds = 0.0
+
+    def match(self, company_type: Any, message: str, history: Optional[List[Any]] = None) -> Optional[FastPathAnswer]:
+        """A canned answer for small talk, or None when the message must go to the graph."""
+        company_type = getattr(company_type, "value", company_type)
+        if company_type not in self.company_types or company_type not in RESPONSES:
+            return None
+
+        start = time.perf_counter()
+        answer = self._match(company_type, normalize_message(message or ""), bool(history))
+        elapsed = time.perf_counter() - start
+        FAST_PATH_SECONDS.observe(elapsed)
+        self._match_seconds += elapsed
+
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.rule_hits[answer.rule] = self.rule_hits.get(answer.rule, 0) + 1
+        return answer
+
+    @staticmethod
+    def _match(company_type: str, text: str, has_history: bool = False) -> Optional[FastPathAnswer]:
+        # Small talk is short; anything longer (or data-like) is left to the planner
+        if not text or len(text) > 60 or looks_like_data_request(text):
+            return None
+        for rule, pattern in RULE_PATTERNS.items():
+            if has_history and rule in FIRST_TURN_RULES:
+                continue
+            if pattern.match(text):
+                return FastPathAnswer(rule, random.choice(RESPONSES[company_type][rule]))
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "avg_match_us": round(self._match_seconds / total * 1e6, 2) if total else 0.0,
+            **{f"{rule}_hits": count for rule, count in self.rule_hits.items()},
+        }
+
+
+fast_path = FastPath()
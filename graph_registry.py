@@ -0,0 +1,41 @@
+from threading import Lock
+from typing import Callable, Dict
+
+from blood_bank.blood_graph_builder import blood_build_graph
+from config.logging_config import setup_logger
+from hospital.graph_builder import build_graph
+
+logger = setup_logger()
+
+# company_type -> graph builder. Builders take no tenant arguments; company_id,
+# user_id and the Hasura headers are passed through config["configurable"].
+GRAPH_BUILDERS: Dict[str, Callable] = {
+    "HOSPITAL": build_graph,
+    "BLOODBANK": blood_build_graph,
+}
+
+_compiled_graphs: Dict[str, object] = {}
+_lock = Lock()
+
+
+def get_graph(company_type):
+    """Return the compiled graph for a company type, compiling it on first use."""
+    key = getattr(company_type, "value", company_type)
+    graph = _compiled_graphs.get(key)
+    if graph is not None:
+        return graph
+
+    with _lock:
+        graph = _compiled_graphs.get(key)
+        if graph is None:
+            builder = GRAPH_BUILDERS.get(key, build_graph)
+            graph = builder()
+            _compiled_graphs[key] = graph
+            logger.info(f"[GRAPH_REGISTRY] Compiled graph for company_type={key}")
+    return graph
+
+
+def compile_graphs() -> None:
+    """Compile every registered graph, called once at application startup."""
+    for company_type in GRAPH_BUILDERS:
+        get_graph(company_type)
@@ -2,9 +2,9 @@
 # graphql_memory.py
 import json
 import uuid
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
+import httpx
 from requests.exceptions import Timeout, RequestException
 
 from langchain_core.messages import (  # type: ignore
@@ -15,10 +15,25 @@ from langchain_core.messages import (  # type: ignore
 )
 
 from cache import memory_cache
+from config.config import (
+    HASURA_ADMIN_SECRET,
+    HASURA_GRAPHQL_URL,
+    HASURA_PERMISSION_SCOPE,
+    HASURA_ROLE,
+    HASURA_TIMEOUT,
+    HISTORY_MAX_MESSAGES,
+)
 from config.logging_config import setup_logger
+from hasura.http_client import clean_headers, get_async_client, get_session
+from hasura.write_behind import message_writer
+from metrics import observe_hasura
 
 logger = setup_logger()
 
+# Timeouts and transport errors raised by either the sync (requests) or async (httpx) client
+TIMEOUT_ERRORS = (Timeout, httpx.TimeoutException)
+REQUEST_ERRORS = (RequestException, httpx.HTTPError)
+
 
 class HasuraMemory:
     def __init__(
@@ -43,6 +58,46 @@ class HasuraMemory:
             "x-hasura-user-id": self.user_id,
         }
 
+    @property
+    def permission_scope(self) -> Tuple[Optional[str], ...]:
+        """
+        The identity Hasura's permissions see for this client. Everything derived from the
+        company's data (filter values, answers, graph runs) is shared only within one scope.
+        """
+        if HASURA_PERMISSION_SCOPE == "company":
+            return (self.hasura_role, self.company_id)
+        return (self.hasura_role, self.company_id, self.user_id)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "HasuraMemory":
+        """Build a tenant-scoped client from the LangGraph ``configurable`` values."""
+        configurable = config.get("configurable", {})
+        return cls(
+            hasura_url=HASURA_GRAPHQL_URL,
+            hasura_secret=HASURA_ADMIN_SECRET,
+            hasura_role=HASURA_ROLE,
+            user_id=configurable.get("user_id"),
+            company_id=configurable.get("company_id"),
+        )
+
+    def _post(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """POST a GraphQL payload to Hasura over the shared keep-alive pool (blocking)."""
+        with observe_hasura(payload["query"]):
+            response = get_session().post(
+                self.hasura_url, json=payload, headers=clean_headers(self.headers), timeout=timeout or HASURA_TIMEOUT
+            )
+        response.raise_for_status()
+        return response.json()
+
+    async def _apost(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """POST a GraphQL payload to Hasura over the shared async pool."""
+        with observe_hasura(payload["query"]):
+            response = await get_async_client().post(
+                self.hasura_url, json=payload, headers=clean_headers(self.headers), timeout=timeout or HASURA_TIMEOUT
+            )
+        response.raise_for_status()
+        return response.json()
+
     def _safe_serialize(self, obj):
         """Recursively convert complex LangChain objects into JSON-serializable format."""
         try:
@@ -98,27 +153,22 @@ class HasuraMemory:
 
         return deserialized
 
-    def save_messages(
+    @staticmethod
+    def _thread_id(config: Dict[str, Any]) -> str:
+        return config.get("configurable", {}).get("thread_id", "unknown")
+
+    def _message_objects(
         self,
         config: Dict[str, Any],
         messages: list,
         nodes: list,
         time: list,
         conversation_id: str,
-    ) -> None:
-        """Store multiple messages in Hasura, excluding tool-related messages."""
-        logger.info("[SAVE_MESSAGES] Called")
-
-        thread_id = config.get("configurable", {}).get("thread_id", "unknown")
+    ):
+        """Build the chat_messages insert objects and the user/final messages to cache."""
+        thread_id = self._thread_id(config)
         step = 0
 
-        graphql_query = """
-        mutation InsertMultipleCheckpoints($objects: [chat_messages_insert_input!]!) {
-            insert_chat_messages(objects: $objects) {
-                affected_rows
-            }
-        }
-        """
         nodes = [node for node in nodes if node != "tool"]
         objects = []
         cache_messages = []
@@ -158,76 +208,65 @@ class HasuraMemory:
 
             step += 1
 
+        return objects, cache_messages
+
+    def enqueue_messages(
+        self,
+        config: Dict[str, Any],
+        messages: list,
+        nodes: list,
+        time: list,
+        conversation_id: str,
+    ) -> None:
+        """Cache the turn and hand it to the write-behind queue; returns without waiting on Hasura."""
+        objects, cache_messages = self._message_objects(config, messages, nodes, time, conversation_id)
         if not objects:
-            print("[SAVE_MESSAGES] No messages to insert.")
+            logger.info("[SAVE_MESSAGES] No messages to insert.")
             return
+        memory_cache.store_message(self.user_id, self._thread_id(config), cache_messages)
+        message_writer.enqueue(objects)
 
-        variables = {"objects": objects}
-        try:
-            response = requests.post(
-                self.hasura_url,
-                json={"query": graphql_query, "variables": variables},
-                headers=self.headers,
-                timeout=10,
-            )
-            data = response.json()
-            if "errors" in data:
-                logger.error(f"[SAVE_MESSAGES] Error: {data['errors']}")
-                return
-            memory_cache.store_message(self.user_id, cache_messages)
-        except Exception as e:
-            logger.error(f"[SAVE_MESSAGES] Error inserting into Hasura: {e}")
-
-    def get_messages(self, config: Dict[str, Any]) -> List:
-        """Retrieve messages for a thread."""
-        thread_id = config.get("configurable", {}).get("thread_id", "unknown")
-        records_cache = memory_cache.get_history(self.user_id)
-        if records_cache:
-            return records_cache
-        #limit: 30 to reduce the payload size
-        graphql_query = """
-        query MyQuery($thread_id: String) {
+    # Only the newest messages are needed for context: fetch them newest-first, then reverse
+    GET_MESSAGES_QUERY = """
+        query MyQuery($thread_id: String, $user_id: String, $limit: Int) {
             chat_messages(
-                where: {session_id: {_eq: $thread_id}, sender_type: {_in: ["user","final_response"]}},
-                limit: 50
+                where: {session_id: {_eq: $thread_id}, user_id: {_eq: $user_id}, sender_type: {_in: ["user","final_response"]}},
+                order_by: {created_at: desc},
+                limit: $limit
             ) {
                 messages
             }
         }
         """
-        variables = {"thread_id": thread_id}
-        payload = {"query": graphql_query, "variables": variables}
 
+    async def aget_messages(self, config: Dict[str, Any]) -> List:
+        """Retrieve the recent messages of a session, from the session cache when possible."""
+        thread_id = self._thread_id(config)
+        if memory_cache.has_history(self.user_id, thread_id):
+            return memory_cache.get_history(self.user_id, thread_id)
+
+        variables = {"thread_id": thread_id, "user_id": self.user_id, "limit": HISTORY_MAX_MESSAGES}
         try:
-            response = requests.post(
-                self.hasura_url, json=payload, headers=self.headers, timeout=10
-            )
-            response.raise_for_status()
-            data = response.json()
-            records = data.get("data", {}).get("chat_messages", [])
-            if not records:
-                return []
-        except Timeout:
+            data = await self._apost({"query": self.GET_MESSAGES_QUERY, "variables": variables})
+        except TIMEOUT_ERRORS:
             return []
-        except RequestException as e:
+        except REQUEST_ERRORS as e:
             logger.error(f"[get_messages] Request error: {e}")
             return []
         except Exception as e:
             logger.error(f"[get_messages] Unexpected error: {e}")
             return []
 
-        serialized_history = self.deserialize_history(records)
-        memory_cache.store_message(self.user_id, serialized_history)
-        return serialized_history
-
-    def get_history(self, config: Dict[str, Any]) -> List:
-        """Retrieve chat history for a session"""
-        print("[GET_HISTORY] Called with arguments:")
-        print(f"  config: {config}")
-        
-        thread_id = config.get("configurable", {}).get("thread_id", "unknown")
+        if "errors" in data:
+            logger.error(f"[get_messages] Error: {data['errors']}")
+            return []
+        records = data.get("data", {}).get("chat_messages", [])
+        serialized_history = self.deserialize_history(list(reversed(records)))
+        # Cache empty histories too, so a new session is not re-fetched on every message
+        memory_cache.set_history(self.user_id, thread_id, serialized_history)
+        return memory_cache.get_history(self.user_id, thread_id)
 
-        graphql_query = """query MyQuery($session_id: String, $user_id: String = "") {
+    GET_HISTORY_QUERY = """query MyQuery($session_id: String, $user_id: String = "") {
                 chat_messages(where: {session_id: {_eq: $session_id}, sender_type: {_in: ["user", "final_response"]}, user_id: {_eq: $user_id}}, order_by: {created_at: asc}) {
                     role: messages(path: "type")
                     node
@@ -238,72 +277,58 @@ class HasuraMemory:
                 }
                 }
             """
-        
-        variables= {
-            "session_id": thread_id,
-            "user_id": self.user_id
-        }
 
-        payload = {
-            "query": graphql_query,
-            "variables": variables
-        }
-        
+    async def aget_history(self, config: Dict[str, Any]) -> List:
+        """Retrieve chat history for a session"""
+        thread_id = self._thread_id(config)
+        logger.info(f"[GET_HISTORY] Called for thread_id: {thread_id}")
+        variables = {"session_id": thread_id, "user_id": self.user_id}
         try:
-            response = requests.post(self.hasura_url, json=payload, headers=self.headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            if "errors" in data:
-                print(f"[GET_HISTORY] Error: {data['errors']}")
-                return []
-            records = data.get("data", {}).get("chat_messages", [])
-            if not records:
-                print(f"[GET_HISTORY] No data found for thread_id: {thread_id}")
-                return []
-                      
-        except Timeout:
-            print("[get_messages] Timeout occurred while calling Hasura.")
+            data = await self._apost({"query": self.GET_HISTORY_QUERY, "variables": variables})
+        except TIMEOUT_ERRORS:
+            logger.error("[GET_HISTORY] Timeout occurred while calling Hasura.")
             return []
-        except RequestException as e:
-            print(f"[get_messages] Request error: {e}")
+        except REQUEST_ERRORS as e:
+            logger.error(f"[GET_HISTORY] Request error: {e}")
             return []
         except Exception as e:
-            print(f"[get_messages] Unexpected error: {e}")
+            logger.error(f"[GET_HISTORY] Unexpected error: {e}")
+            return []
+
+        if "errors" in data:
+            logger.error(f"[GET_HISTORY] Error: {data['errors']}")
+            return []
+        records = data.get("data", {}).get("chat_messages", [])
+        if not records:
+            logger.info(f"[GET_HISTORY] No data found for thread_id: {thread_id}")
             return []
         logger.info(f"[GET_HISTORY] Extracted - thread_id: {thread_id}")
         return records if isinstance(records, list) else [records]
 
-    def get_session_list(self) -> List:
-        print("[GET_SESSION_LIST] Called")
-        graphql_query = """query MyQuery {
+    SESSION_LIST_QUERY = """query MyQuery {
             chat_messages(distinct_on: session_id, order_by: {session_id: desc}) {
                 session_id
             }
             }
             """
+
+    async def aget_session_list(self) -> List:
+        logger.info("[GET_SESSION_LIST] Called")
         try:
-            response = requests.post(self.hasura_url, json={"query": graphql_query}, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
-            print(f"[GET_SESSION_LIST] Response: {data}")
-            if "errors" in data:
-                print(f"[GET_SESSION_LIST] Error: {data['errors']}")
-                return []
-            records = data.get("data", {}).get("chat_messages", [])
-            if not records:
-                print("[GET_SESSION_LIST] No data found")
-                return []
+            data = await self._apost({"query": self.SESSION_LIST_QUERY})
         except Exception as e:
-            print(f"[GET_SESSION_LIST] Error retrieving checkpoint from Hasura: {e}")
+            logger.error(f"[GET_SESSION_LIST] Error retrieving checkpoint from Hasura: {e}")
             return []
-        result=[msg["session_id"] for msg in records]
-        return result
-
-    def session_init(self, variables):
-        print("Session initiated")
+        if "errors" in data:
+            logger.error(f"[GET_SESSION_LIST] Error: {data['errors']}")
+            return []
+        records = data.get("data", {}).get("chat_messages", [])
+        if not records:
+            logger.info("[GET_SESSION_LIST] No data found")
+            return []
+        return [msg["session_id"] for msg in records]
 
-        try:            
-            query = """ mutation MyMutation($user_id: String!, $session_id: String!, $created_at: timestamp!, $title: String = "") {
+    SESSION_INIT_MUTATION = """ mutation MyMutation($user_id: String!, $session_id: String!, $created_at: timestamp!, $title: String = "") {
                 insert_chat_sessions(objects: {user_id: $user_id, session_id: $session_id, created_at: $created_at, title: $title}, on_conflict: {constraint: chat_sessions_pkey, update_columns: []}) {
                     returning {
                     session_id
@@ -312,17 +337,22 @@ class HasuraMemory:
                 }
                 }
                 """
-            variables= variables
-            data = self.run_mutation(query, variables)
-            print("session_init_data", data)
-            if "errors" in data:
-                print(f"Graphql Error session_init: {data['errors']}")
-                return {"data":"No data"}
-            
-            return data
+
+    async def asession_init(self, variables):
+        """
+        Upsert the chat session: the upsert's data, or None when Hasura did not confirm it
+        (errors are already logged by ``arun_query``).
+        """
+        try:
+            data = await self.arun_mutation(self.SESSION_INIT_MUTATION, variables)
         except Exception as e:
-            print(f"GraphQL query error: {str(e)}")
+            logger.error(f"[SESSION_INIT] GraphQL query error: {e}")
+            return None
+        # An existing session upserts to an empty "returning"; a missing key means the mutation failed
+        if not data or data.get("insert_chat_sessions") is None:
+            logger.error(f"[SESSION_INIT] Session upsert failed for user_id={self.user_id}")
             return None
+        return data
 
     def validate_user_id(self, user_id):
 
@@ -342,9 +372,7 @@ class HasuraMemory:
                 "query": query,
                 "variables": variables
             }
-            response = requests.post(self.hasura_url, json=payload, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
+            data = self._post(payload)
             if "errors" in data:
                 print(f"Graphql Error validate_user_id: {data['errors']}")
                 return False
@@ -354,35 +382,16 @@ class HasuraMemory:
             print(f"GraphQL query error: {str(e)}")
             return False
 
-    def check_session_exists(self, session_id: str) -> bool:
-        query = """
-        query MyQuery($session_id: String = "", $user_id: String = "") {
-        chat_sessions(where: {_and: {session_id: {_eq: $session_id}}, user_id: {_eq: $user_id}}) {
-            user_id
-            session_id
-        }
-        }
-
-        """
-        variables = {"session_id": session_id,"user_id": self.user_id}
-        result = self.run_query(query, variables)
-        print("result", result)
-        exists = result.get("chat_sessions", [])
-        print("exists", exists)
-        return bool(exists)
-
-    def add_feedback(self,conversation_id:str,session_id:str,feedback:str):
-
+    def _feedback_mutation(self, feedback: str) -> str:
         if int(feedback) == 1:
-            query = """
+            return """
                         mutation MyMutation($conversation_id: String = "", $user_id: String = "", $session_id: String = "") {
                 update_chat_messages(where: {conversation_id: {_eq: $conversation_id}, user_id: {_eq: $user_id}, session_id: {_eq: $session_id}}, _set: {feedback: true}) {
                     affected_rows
                 }
                 }
             """
-        else:
-            query = """
+        return """
                         mutation MyMutation($conversation_id: String = "", $user_id: String = "", $session_id: String = "") {
                 update_chat_messages(where: {conversation_id: {_eq: $conversation_id}, user_id: {_eq: $user_id}, session_id: {_eq: $session_id}}, _set: {feedback: false}) {
                     affected_rows
@@ -390,35 +399,74 @@ class HasuraMemory:
                 }
             """
 
+    async def aadd_feedback(self,conversation_id:str,session_id:str,feedback:str):
         variables = {"conversation_id": conversation_id,"session_id":session_id,"user_id": self.user_id}
-        result = self.run_mutation(query, variables)
-        print("result", result)
+        result = await self.arun_mutation(self._feedback_mutation(feedback), variables)
+        logger.info(f"[FEEDBACK] result: {result}")
         return result
 
-    def run_query(self, query, variables=None):
+    # Rolling conversation summary, kept in the jsonb ``summary`` column of chat_sessions
+    GET_SESSION_SUMMARY_QUERY = """
+        query MyQuery($session_id: String, $user_id: String) {
+            chat_sessions(where: {session_id: {_eq: $session_id}, user_id: {_eq: $user_id}}) {
+                summary
+            }
+        }
+        """
+
+    UPDATE_SESSION_SUMMARY_MUTATION = """
+        mutation MyMutation($session_id: String, $user_id: String, $summary: jsonb) {
+            update_chat_sessions(where: {session_id: {_eq: $session_id}, user_id: {_eq: $user_id}}, _set: {summary: $summary}) {
+                affected_rows
+            }
+        }
+        """
+
+    async def aget_session_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The stored summary of a session ({} when it has none), or None when it could not be read."""
+        variables = {"session_id": session_id, "user_id": self.user_id}
         try:
-            payload = {"query": query, "variables": variables}
-            response = requests.post(
-                self.hasura_url, json=payload, headers=self.headers, timeout=10
-            )
-            response.raise_for_status()
-            data = response.json()
-            if "errors" in data:
-                print(f"GraphQL Error run_query: {data['errors']}")
-                return {}
-            return data.get("data", {})
-        except Timeout:
-            print("[run_query] Timeout calling Hasura.")
+            data = await self._apost({"query": self.GET_SESSION_SUMMARY_QUERY, "variables": variables})
+        except Exception as e:
+            logger.error(f"[SESSION_SUMMARY] Error reading the summary: {e}")
+            return None
+        if "errors" in data:
+            logger.error(f"[SESSION_SUMMARY] Error: {data['errors']}")
+            return None
+        sessions = data.get("data", {}).get("chat_sessions", [])
+        return (sessions[0].get("summary") if sessions else None) or {}
+
+    async def aupdate_session_summary(self, session_id: str, summary: Dict[str, Any]) -> bool:
+        variables = {"session_id": session_id, "user_id": self.user_id, "summary": summary}
+        try:
+            data = await self._apost({"query": self.UPDATE_SESSION_SUMMARY_MUTATION, "variables": variables})
+        except Exception as e:
+            logger.error(f"[SESSION_SUMMARY] Error storing the summary: {e}")
+            return False
+        if "errors" in data:
+            logger.error(f"[SESSION_SUMMARY] Error: {data['errors']}")
+            return False
+        return True
+
+    async def arun_query(self, query, variables=None, timeout: Optional[float] = None):
+        try:
+            data = await self._apost({"query": query, "variables": variables}, timeout=timeout)
+        except TIMEOUT_ERRORS:
+            logger.error("[run_query] Timeout calling Hasura.")
             return {}
-        except RequestException as e:
-            print(f"[run_query] Request error: {e}")
+        except REQUEST_ERRORS as e:
+            logger.error(f"[run_query] Request error: {e}")
             return {}
         except Exception as e:
-            print(f"[run_query] Unexpected error: {e}")
+            logger.error(f"[run_query] Unexpected error: {e}")
+            return {}
+        if "errors" in data:
+            logger.error(f"GraphQL Error run_query: {data['errors']}")
             return {}
+        return data.get("data", {})
 
-    def run_mutation(self, query, variables=None):
-        return self.run_query(query, variables)
+    async def arun_mutation(self, query, variables=None, timeout: Optional[float] = None):
+        return await self.arun_query(query, variables, timeout=timeout)
 
 
 
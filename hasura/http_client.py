@@ -0,0 +1,93 @@
+# http_client.py
+import json
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.config import HASURA_KEEPALIVE_EXPIRY, HASURA_POOL_SIZE, HASURA_TIMEOUT
+from config.logging_config import setup_logger
+from metrics import observe_hasura
+
+logger = setup_logger()
+
+# Process-wide keep-alive pools shared by every HasuraMemory and the GraphQL tool.
+_session: Optional[requests.Session] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_session() -> requests.Session:
+    """Return the shared, pooled ``requests`` session for blocking callers."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HASURA_POOL_SIZE, pool_maxsize=HASURA_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the shared, pooled ``httpx`` client for the async request path."""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=HASURA_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=HASURA_POOL_SIZE,
+                max_keepalive_connections=HASURA_POOL_SIZE,
+                keepalive_expiry=HASURA_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _async_client
+
+
+async def close_clients() -> None:
+    """Close both pools, called on application shutdown."""
+    global _session, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+def clean_headers(headers: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """Drop unset header values (httpx rejects None, requests silently skips it)."""
+    return {k: v for k, v in (headers or {}).items() if v is not None}
+
+
+class SafeGraphQLWrapper:
+    """GraphQL tool backend: runs a query over the shared pool and returns errors as text."""
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+
+    def _format(self, query: str, data: Dict[str, Any]) -> str:
+        if "errors" in data:
+            return f"[GraphQL Error] {data['errors']} When running this query: {query}. The query might be malformed or the field might not exist."
+        return json.dumps(data.get("data", {}), indent=2)
+
+    def run(self, query: str, headers: dict = None, timeout: Optional[float] = None) -> str:
+        try:
+            with observe_hasura(query):
+                response = get_session().post(
+                    self.endpoint, json={"query": query}, headers=clean_headers(headers), timeout=timeout or HASURA_TIMEOUT
+                )
+            response.raise_for_status()
+            return self._format(query, response.json())
+        except Exception as e:
+            return f"[GraphQL Error] {str(e)} When running this query: {query}. The query might be malformed or the field might not exist."
+
+    async def arun(self, query: str, headers: dict = None, timeout: Optional[float] = None) -> str:
+        try:
+            with observe_hasura(query):
+                response = await get_async_client().post(
+                    self.endpoint, json={"query": query}, headers=clean_headers(headers), timeout=timeout or HASURA_TIMEOUT
+                )
+            response.raise_for_status()
+            return self._format(query, response.json())
+        except Exception as e:
+            return f"[GraphQL Error] {str(e)} When running this query: {query}. The query might be malformed or the field might not exist."
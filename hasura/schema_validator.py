@@ -0,0 +1,117 @@
+# schema_validator.py
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from graphql import GraphQLError, GraphQLSchema, build_client_schema, get_introspection_query, parse, validate
+
+from config.config import HASURA_SCHEMA_RETRY_AFTER, HASURA_SCHEMA_SNAPSHOT
+from config.logging_config import setup_logger
+
+logger = setup_logger()
+
+INTROSPECTION_QUERY = get_introspection_query(descriptions=False)
+
+
+def format_graphql_error(query: str, errors: List[str]) -> str:
+    """Same shape as the tool's Hasura errors, so the existing repair prompts consume it unchanged."""
+    return f"[GraphQL Error] {' '.join(errors)} When running this query: {query}. The query might be malformed or the field might not exist."
+
+
+def _describe(error: GraphQLError) -> str:
+    if error.locations:
+        loc = error.locations[0]
+        return f"{error.message} (line {loc.line}, column {loc.column})"
+    return error.message
+
+
+class SchemaValidator:
+    """
+    Validates generated queries locally against the Hasura schema before they are executed.
+
+    The schema is loaded once per process: from ``snapshot_path`` when that file exists,
+    otherwise by introspecting Hasura (the result is written to ``snapshot_path`` when one is
+    configured). If the schema cannot be loaded, queries are only syntax-checked and the
+    introspection is retried after ``retry_after`` seconds.
+    """
+
+    def __init__(self, snapshot_path: str = "", retry_after: float = 60.0):
+        self.snapshot_path = snapshot_path
+        self.retry_after = retry_after
+        self._schema: Optional[GraphQLSchema] = None
+        self._failed_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self.source = "none"
+        self.validated = 0
+        self.rejected = 0
+
+    async def get_schema(self, graphql_client) -> Optional[GraphQLSchema]:
+        if self._schema is not None:
+            return self._schema
+        if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_after:
+            return None
+        async with self._lock:
+            if self._schema is None:
+                self._schema = await self._load(graphql_client)
+                self._failed_at = None if self._schema is not None else time.monotonic()
+        return self._schema
+
+    async def _load(self, graphql_client) -> Optional[GraphQLSchema]:
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, encoding="utf-8") as f:
+                    schema = build_client_schema(json.load(f))
+                self.source = "snapshot"
+                logger.info(f"[SCHEMA] Loaded Hasura schema snapshot from {self.snapshot_path}")
+                return schema
+            except Exception as e:
+                logger.error(f"[SCHEMA] Invalid schema snapshot {self.snapshot_path}: {e}")
+
+        introspection = await graphql_client.arun_query(INTROSPECTION_QUERY)
+        if not introspection or "__schema" not in introspection:
+            logger.error("[SCHEMA] Hasura introspection failed; validating syntax only")
+            return None
+        try:
+            schema = build_client_schema(introspection)
+        except Exception as e:
+            logger.error(f"[SCHEMA] Could not build schema from introspection: {e}")
+            return None
+        self.source = "introspection"
+        logger.info("[SCHEMA] Loaded Hasura schema by introspection")
+
+        if self.snapshot_path:
+            try:
+                with open(self.snapshot_path, "w", encoding="utf-8") as f:
+                    json.dump(introspection, f)
+            except Exception as e:
+                logger.error(f"[SCHEMA] Failed to write schema snapshot {self.snapshot_path}: {e}")
+        return schema
+
+    async def validate(self, query: str, graphql_client) -> List[str]:
+        """Human-readable problems with ``query`` (empty when it is valid for the schema)."""
+        self.validated += 1
+        try:
+            document = parse(query)
+        except GraphQLError as e:
+            self.rejected += 1
+            return [_describe(e)]
+
+        schema = await self.get_schema(graphql_client)
+        if schema is None:
+            return []
+        errors = [_describe(e) for e in validate(schema, document)]
+        if errors:
+            self.rejected += 1
+        return errors
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "schema_loaded": 1 if self._schema is not None else 0,
+            "validated": self.validated,
+            "rejected": self.rejected,
+        }
+
+
+schema_validator = SchemaValidator(snapshot_path=HASURA_SCHEMA_SNAPSHOT, retry_after=HASURA_SCHEMA_RETRY_AFTER)
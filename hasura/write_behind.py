@@ -0,0 +1,290 @@
+# write_behind.py
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from config.config import (
+    CHAT_MESSAGES_CONFLICT_CONSTRAINT,
+    HASURA_ADMIN_SECRET,
+    HASURA_GRAPHQL_URL,
+    HASURA_ROLE,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_DEAD_LETTER_PATH,
+    WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_MAX_ATTEMPTS,
+    WRITE_BEHIND_MAX_QUEUE,
+    WRITE_BEHIND_SPILL_PATH,
+)
+from config.logging_config import setup_logger
+from hasura.http_client import clean_headers, get_async_client
+from metrics import observe_hasura
+
+logger = setup_logger()
+
+
+def insert_chat_messages_mutation(conflict_constraint: str = "") -> str:
+    """
+    The chat_messages insert. With a unique (conversation_id, step) constraint, replaying a batch
+    that did reach Hasura (e.g. its response timed out) is a no-op instead of a duplicate.
+    """
+    on_conflict = f", on_conflict: {{constraint: {conflict_constraint}, update_columns: []}}" if conflict_constraint else ""
+    return f"""
+        mutation InsertMultipleCheckpoints($objects: [chat_messages_insert_input!]!) {{
+            insert_chat_messages(objects: $objects{on_conflict}) {{
+                affected_rows
+            }}
+        }}
+        """
+
+
+INSERT_CHAT_MESSAGES = insert_chat_messages_mutation(CHAT_MESSAGES_CONFLICT_CONSTRAINT)
+
+
+class MessageWriteBehind:
+    """
+    In-process write-behind queue for chat_messages.
+
+    ``enqueue`` returns immediately; a background task flushes many conversations per
+    ``insert_chat_messages`` mutation once ``batch_size`` conversations are queued or
+    ``flush_interval`` seconds have passed. Rows that cannot be written (Hasura down, queue
+    full) are appended to a local JSONL spill file, with the number of failed inserts, and
+    replayed after the next successful flush or on startup. A replayed batch that fails is
+    retried row by row so one rejected row does not hold back the others; a row that failed
+    ``max_attempts`` times moves to the dead-letter file. File IO runs in a worker thread.
+    ``stop`` drains the queue.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 50,
+        flush_interval: float = 1.0,
+        max_queue: int = 5000,
+        spill_path: str = "logs/chat_messages_spill.jsonl",
+        max_attempts: int = 5,
+        dead_letter_path: str = "logs/chat_messages_dead_letter.jsonl",
+        conflict_constraint: str = "",
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spill_path = spill_path
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self.insert_mutation = insert_chat_messages_mutation(conflict_constraint)
+        self._queue: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._replay_lock = asyncio.Lock()
+        # Held around every spill file write and the replay's rename, so no append lands in a replayed file
+        self._file_lock = asyncio.Lock()
+        self._spills: set = set()
+
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.spilled_rows = 0
+        self.replayed_rows = 0
+        self.dead_lettered_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+
+    @property
+    def headers(self) -> Dict[str, Any]:
+        return {
+            "Content-Type": "application/json",
+            "x-hasura-admin-secret": HASURA_ADMIN_SECRET,
+            "x-hasura-role": HASURA_ROLE,
+        }
+
+    def enqueue(self, objects: List[Dict[str, Any]]) -> None:
+        """Queue the chat_messages rows of one conversation turn."""
+        if not objects:
+            return
+        if len(self._queue) >= self.max_queue:
+            logger.warning("[WRITE_BEHIND] Queue full, spilling conversation to disk")
+            spill = asyncio.create_task(self._spill(objects, attempts=0))
+            self._spills.add(spill)
+            spill.add_done_callback(self._spills.discard)
+            return
+
+        self._queue.append(objects)
+        self._ensure_running()
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        self._stopping = False
+        self._ensure_running()
+        await self._replay_spill()
+
+    async def stop(self) -> None:
+        """Stop the flush loop and write out everything still queued."""
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        while self._queue:
+            await self._flush_batch()
+        if self._spills:
+            await asyncio.gather(*self._spills)
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._queue and not self._stopping:
+                await self._flush_batch()
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        rows = []
+        for _ in range(min(self.batch_size, len(self._queue))):
+            rows.extend(self._queue.popleft())
+        return rows
+
+    async def _insert(self, rows: List[Dict[str, Any]]) -> bool:
+        payload = {"query": self.insert_mutation, "variables": {"objects": rows}}
+        try:
+            with observe_hasura(self.insert_mutation, per_request=False):
+                response = await get_async_client().post(HASURA_GRAPHQL_URL, json=payload, headers=clean_headers(self.headers))
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            logger.error(f"[WRITE_BEHIND] Error inserting into Hasura: {e}")
+            return False
+        if "errors" in data:
+            logger.error(f"[WRITE_BEHIND] Error: {data['errors']}")
+            return False
+        return True
+
+    async def _flush_batch(self) -> None:
+        rows = self._take_batch()
+        if not rows:
+            return
+
+        start = time.perf_counter()
+        ok = await self._insert(rows)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._flush_ms_total += elapsed_ms
+
+        if ok:
+            self.flushed_batches += 1
+            self.flushed_rows += len(rows)
+            logger.info(f"[WRITE_BEHIND] Flushed {len(rows)} rows in {elapsed_ms:.1f}ms, queue depth {len(self._queue)}")
+            if os.path.exists(self.spill_path):
+                await self._replay_spill()
+        else:
+            self.failed_batches += 1
+            await self._spill(rows, attempts=1)
+
+    @staticmethod
+    def _append(path: str, entries: List[Dict[str, Any]]) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+    @staticmethod
+    def _take_file(path: str, replay_path: str) -> List[Dict[str, Any]]:
+        if not os.path.exists(path):
+            return []
+        os.replace(path, replay_path)
+        with open(replay_path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        # Spill files written before attempts were tracked hold the bare rows
+        return [entry if "row" in entry else {"row": entry, "attempts": 0} for entry in entries]
+
+    async def _spill(self, rows: List[Dict[str, Any]], attempts: int) -> None:
+        await self._spill_entries([{"row": row, "attempts": attempts} for row in rows])
+
+    async def _spill_entries(self, entries: List[Dict[str, Any]]) -> None:
+        """Spill rows to retry later; rows out of attempts go to the dead-letter file instead."""
+        retry = [entry for entry in entries if entry["attempts"] < self.max_attempts]
+        dead = [entry for entry in entries if entry["attempts"] >= self.max_attempts]
+        async with self._file_lock:
+            if retry:
+                try:
+                    await asyncio.to_thread(self._append, self.spill_path, retry)
+                    self.spilled_rows += len(retry)
+                except Exception as e:
+                    logger.error(f"[WRITE_BEHIND] Failed to spill {len(retry)} rows to {self.spill_path}: {e}")
+            if dead:
+                logger.error(f"[WRITE_BEHIND] Moving {len(dead)} rows to {self.dead_letter_path} after {self.max_attempts} failed inserts")
+                try:
+                    await asyncio.to_thread(self._append, self.dead_letter_path, dead)
+                    self.dead_lettered_rows += len(dead)
+                except Exception as e:
+                    logger.error(f"[WRITE_BEHIND] Failed to dead-letter {len(dead)} rows to {self.dead_letter_path}: {e}")
+
+    async def _replay_spill(self) -> None:
+        """Re-insert spilled rows; rows that fail again are spilled with one more attempt."""
+        async with self._replay_lock:
+            replay_path = f"{self.spill_path}.replay"
+            try:
+                async with self._file_lock:
+                    entries = await asyncio.to_thread(self._take_file, self.spill_path, replay_path)
+            except Exception as e:
+                logger.error(f"[WRITE_BEHIND] Failed to read spill file: {e}")
+                return
+            if not entries:
+                return
+
+            logger.info(f"[WRITE_BEHIND] Replaying {len(entries)} spilled rows")
+            failed: List[Dict[str, Any]] = []
+            for i in range(0, len(entries), self.batch_size):
+                chunk = entries[i:i + self.batch_size]
+                if await self._insert([entry["row"] for entry in chunk]):
+                    self.replayed_rows += len(chunk)
+                    continue
+                # Isolate the rejected rows of the chunk
+                rejected = chunk if len(chunk) == 1 else [entry for entry in chunk if not await self._insert([entry["row"]])]
+                self.replayed_rows += len(chunk) - len(rejected)
+                failed += [{**entry, "attempts": entry["attempts"] + 1} for entry in rejected]
+                if len(rejected) == len(chunk):
+                    # Nothing got through: Hasura is likely down again, keep the rest for later
+                    failed += entries[i + self.batch_size:]
+                    break
+            if failed:
+                await self._spill_entries(failed)
+            await asyncio.to_thread(os.remove, replay_path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._queue),
+            "flushed_rows": self.flushed_rows,
+            "flushed_batches": self.flushed_batches,
+            "failed_batches": self.failed_batches,
+            "spilled_rows": self.spilled_rows,
+            "replayed_rows": self.replayed_rows,
+            "dead_lettered_rows": self.dead_lettered_rows,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self._flush_ms_total / (self.flushed_batches + self.failed_batches), 2)
+            if (self.flushed_batches + self.failed_batches) else 0.0,
+        }
+
+
+message_writer = MessageWriteBehind(
+    batch_size=WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+    max_queue=WRITE_BEHIND_MAX_QUEUE,
+    spill_path=WRITE_BEHIND_SPILL_PATH,
+    max_attempts=WRITE_BEHIND_MAX_ATTEMPTS,
+    dead_letter_path=WRITE_BEHIND_DEAD_LETTER_PATH,
+    conflict_constraint=CHAT_MESSAGES_CONFLICT_CONSTRAINT,
+)
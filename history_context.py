@@ -0,0 +1,148 @@
+"""
+Token-budgeted conversation history for the LLM prompts.
+
+Each node that sees the history gets at most its budget from ``HISTORY_CONTEXT_BUDGETS``
+(``HISTORY_CONTEXT_DEFAULT_TOKENS`` otherwise). Turns are taken from the most recent one
+backward until the next would not fit; assistant answers longer than
+``HISTORY_ANSWER_MAX_TOKENS`` are cut first, so one long table does not push out the rest of
+the conversation.
+
+Tokens are counted with tiktoken's encoding of ``OPENAI_MODEL``, memoized per text, as the
+same messages come back on every turn of a session. Without the encoding (it is downloaded
+on first use) counts fall back to the ~4 characters per token estimate.
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage  # type: ignore
+
+from cache.memory_cache import estimate_tokens
+from config.config import (
+    HISTORY_ANSWER_MAX_TOKENS,
+    HISTORY_CONTEXT_BUDGETS,
+    HISTORY_CONTEXT_DEFAULT_TOKENS,
+    OPENAI_MODEL,
+)
+from config.logging_config import setup_logger
+from metrics import HISTORY_TOKENS
+
+logger = setup_logger()
+
+TRUNCATION_MARK = " …"
+# Appended to the history lines; the planner input continues with the new question
+HISTORY_CONTEXT_SUFFIX = "so consider this context. Now, I am asked "
+
+_encoding: Any = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+
+            try:
+                _encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            _encoding_failed = True
+            logger.warning(f"[HISTORY] tiktoken encoding unavailable, estimating tokens instead: {e}")
+    return _encoding
+
+
+def warm_up() -> None:
+    """Load the encoding (a download on first use) before the first request needs it."""
+    _get_encoding()
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=2048)
+def truncate(text: str, max_tokens: int) -> str:
+    """``text`` cut to about ``max_tokens`` tokens (marked with an ellipsis)."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[: max_tokens * 4] + TRUNCATION_MARK
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]) + TRUNCATION_MARK
+
+
+class HistoryContext(NamedTuple):
+    messages: List[BaseMessage]
+    tokens: int
+    dropped: int
+
+    def text(self) -> str:
+        """The history as the planner's "I am asked … then I got …" lines."""
+        return "\n".join(_line(message) for message in self.messages)
+
+
+def _line(message: BaseMessage) -> str:
+    return f"I am asked {message.content}" if isinstance(message, HumanMessage) else f"then I got {message.content}"
+
+
+class HistoryContextBuilder:
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, default_tokens: int = HISTORY_CONTEXT_DEFAULT_TOKENS,
+                 answer_max_tokens: int = HISTORY_ANSWER_MAX_TOKENS):
+        self.budgets = dict(HISTORY_CONTEXT_BUDGETS if budgets is None else budgets)
+        self.default_tokens = default_tokens
+        self.answer_max_tokens = answer_max_tokens
+        self.builds = 0
+        self.truncated = 0
+        self.dropped = 0
+        self._node_tokens: Dict[str, int] = {}
+
+    def budget(self, node: str) -> int:
+        return self.budgets.get(node, self.default_tokens)
+
+    def build(self, history: Optional[Sequence[BaseMessage]], node: str) -> HistoryContext:
+        """The most recent turns of ``history`` that fit ``node``'s budget, oldest first."""
+        budget = self.budget(node)
+        kept: List[BaseMessage] = []
+        tokens = 0
+        history = list(history or [])
+        for message in reversed(history):
+            if isinstance(message, AIMessage) and count_tokens(str(message.content)) > self.answer_max_tokens:
+                message = AIMessage(content=truncate(str(message.content), self.answer_max_tokens))
+                self.truncated += 1
+            # +1 for the newline joining the lines
+            cost = count_tokens(_line(message)) + 1
+            if tokens + cost > budget:
+                break
+            kept.append(message)
+            tokens += cost
+        kept.reverse()
+
+        context = HistoryContext(kept, tokens, len(history) - len(kept))
+        self.builds += 1
+        self.dropped += context.dropped
+        self._node_tokens[node] = self._node_tokens.get(node, 0) + tokens
+        HISTORY_TOKENS.observe(tokens, node)
+        return context
+
+    def context_text(self, history: Optional[Sequence[BaseMessage]], node: str) -> str:
+        """``history_context`` string for ``node``: the budgeted history lines and the lead-in to the question."""
+        lines = self.build(history, node).text()
+        return f"{lines}{HISTORY_CONTEXT_SUFFIX}" if lines else HISTORY_CONTEXT_SUFFIX
+
+    def stats(self) -> Dict[str, Any]:
+        info = count_tokens.cache_info()
+        return {
+            "builds": self.builds,
+            "truncated_answers": self.truncated,
+            "dropped_messages": self.dropped,
+            "count_cache_hit_ratio": round(info.hits / (info.hits + info.misses), 4) if info.hits + info.misses else 0.0,
+            **{f"{node}_tokens": tokens for node, tokens in self._node_tokens.items()},
+        }
+
+
+history_builder = HistoryContextBuilder()
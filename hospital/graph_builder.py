@@ -1,7 +1,6 @@
 import json
 
 from langchain.tools import Tool, tool
-from langchain_community.tools.graphql.tool import GraphQLAPIWrapper  # type: ignore
 
 # from langchain_core.tools import Tool # type: ignore
 from langchain_core.messages import (  # type: ignore
@@ -10,61 +9,55 @@ from langchain_core.messages import (  # type: ignore
     SystemMessage,
     ToolMessage,
 )
+from langchain_core.runnables import RunnableConfig  # type: ignore
 from langgraph.graph import END, StateGraph  # type: ignore
 
-from config.config import HASURA_ADMIN_SECRET, HASURA_GRAPHQL_URL, HASURA_ROLE
+from config.config import GRAPH_PLANNER_MODE, HASURA_GRAPHQL_URL, SPECULATIVE_QUERY_ENABLED
+from cache.filter_cache import filter_values_cache
 from hasura.graphql_memory import HasuraMemory
+from hasura.http_client import SafeGraphQLWrapper
+from hasura.schema_validator import format_graphql_error, schema_validator
 from config.logging_config import setup_logger
+from date_resolver import date_context, resolve_dates
+from entity_extractor import ResolvedEntities, entity_extractor, slots_context
+from history_context import history_builder
+from intent_plan import FusedPlan, IntentPlan
+from model_router import model_router, repeated_graphql_error
+from prompt_assembly import assemble
+from query_templates import match_template
+from speculative_query import filter_vocabulary, query_speculation
 from hospital.nodes import (
     AgentState,
     clarify,
     data_analyser,
+    fused_planner_decision,
     general_response,
     intent_planner_decision,
-    llm,
     should_continue,
 )
-from hospital.prompt import system_intent_prompt, system_query_prompt_format , system_intent_prompt2 ,System_query_validation_prompt
-from utils import store_datetime ,get_current_datetime
+from hospital.prompt import system_intent_prompt, system_query_prompt_format , system_intent_prompt2 ,System_query_validation_prompt, system_fused_planner_prompt
+from utils import store_datetime
 from summary_generator import format_toon  ,summary_toon
 from toon_format import encode , decode
 
 logger = setup_logger()
 
-class SafeGraphQLWrapper:
-    def __init__(self, endpoint: str, headers: dict = None):
-        self.client = GraphQLAPIWrapper(graphql_endpoint=endpoint, custom_headers=headers, fetch_schema_from_transport=False)
-
-    def run(self, query: str) -> str:
-        try:
-            return self.client.run(query)
-        except Exception as e:
-            return f"[GraphQL Error] {str(e)} When running this query: {query}. The query might be malformed or the field might not exist."
-
-def build_graph(company_id,user_id):
+def build_graph(planner_mode: str = GRAPH_PLANNER_MODE):
+    """
+    Compile the hospital graph once; company_id/user_id are read from config["configurable"] per run.
+    planner_mode="fused" starts with fused_planner, which plans and writes the query in one LLM call.
+    """
     print("[BUILD_GRAPH] Called")
-    graphql_client = HasuraMemory(
-        hasura_url=HASURA_GRAPHQL_URL,
-        hasura_secret=HASURA_ADMIN_SECRET,
-        hasura_role=HASURA_ROLE,
-        user_id=user_id,
-        company_id=company_id
-    )
-    headers= {
-                "Content-Type": "application/json",
-                "x-hasura-admin-secret": HASURA_ADMIN_SECRET,
-                "x-hasura-role": HASURA_ROLE,
-                "X-Hasura-Company-Id": company_id,
-                "x-hasura-user-id": user_id
-            }
-    
+    graphql_wrapper = SafeGraphQLWrapper(endpoint=HASURA_GRAPHQL_URL)
+
     safe_graphql_tool = Tool(
     name="GraphQLTool",
-    func=SafeGraphQLWrapper(endpoint=HASURA_GRAPHQL_URL,headers=headers).run,
+    func=graphql_wrapper.run,
     description="Executes GraphQL queries to retrive data. Returns error messages if the query is invalid."
     )
 
-    def get_possible_values():
+    async def get_possible_values(graphql_client: HasuraMemory):
+        """Distinct filter values for the company, served from the TTL cache."""
         query=""" query GetFilterOptions {
             bank_names: blood_order_view(distinct_on: blood_bank_name) {
                 blood_bank_name
@@ -80,84 +73,123 @@ def build_graph(company_id,user_id):
             }
             } """
         
-        result = graphql_client.run_query(query)
+        cache_key = ("HOSPITAL", graphql_client.permission_scope)
+        result = await filter_values_cache.get(cache_key, lambda: graphql_client.arun_query(query))
         # logger.info(f"get_possible_values: {result}")
         return result
     
     tools_list = [safe_graphql_tool]
-    llm_bind_tool=llm.bind_tools(tools_list)
 
     tool_map = {tool.name: tool for tool in tools_list}
-    def intent_planner(state: AgentState):
+    def planner_prompt(state: AgentState, entities: ResolvedEntities, question_dates: str, instructions: str = "", name: str = "hospital.intent_planner"):
+        """
+        Intent planner prompt: the static instructions (``instructions`` extend its output format),
+        then the values resolved from the question and the current time, then the question.
+        """
+        field_context = f"{slots_context(entities)}\n{question_dates}\n"
+        return assemble(
+            name,
+            SystemMessage(content=system_intent_prompt + system_intent_prompt2 + instructions),
+            SystemMessage(content=field_context),
+            state["history_context"] + " ".join(msg.content for msg in state["messages"])
+        )
+
+    async def intent_planner(state: AgentState, config: RunnableConfig):
         logger.info("intent_planner is executing..")
         new_nodes = state["nodes"] + ["intent_planner"]
         new_time = state["time"] + [store_datetime()]
-
+        # The question's time phrases, resolved once for the speculative query and the planner
+        question_dates = date_context(resolve_dates(state["messages"][-1].content))
+
+        speculation = None
+        if SPECULATIVE_QUERY_ENABLED:
+            # Most messages are data queries: generate the query from the raw message meanwhile
+            speculation = query_speculation.start(model_router.runnable("speculative_query"), assemble(
+                "hospital.speculative_query",
+                SystemMessage(content=system_query_prompt_format),
+                HumanMessage(content=(
+                    history_builder.context_text(state.get("history"), "speculative_query")
+                    + state["messages"][-1].content + "\n"
+                    + question_dates
+                ))
+            ))
+        possible_values = {}
         try:
-            possible_values = get_possible_values() or {}
-            data = possible_values
-
-            bank_names = [item["blood_bank_name"] for item in data.get("bank_names", [])]
-            blood_groups = [item["blood_group"] for item in data.get("blood_groups", [])]
-            reasons = [item["reason"] for item in data.get("reasons", [])]
-            statuses = [item["status"] for item in data.get("statuses", [])]
-
-            field_context = f"""
-            FIELD VALUE VALIDATION RULES
-            You must strictly validate the following fields using the allowed values list.
-            If no exact or fuzzy match is found (case-insensitive, spelling corrections, or common synonyms), you must ask for clarification in ask_for
-
-            You must validate these restricted fields using exact or normalized values.
-            If a user provides a value for any field that cannot be matched to the possible values (even after normalization), you must ask for clarification.
-            For example, if user says B+ but it's not in the allowed list, ask:
-            “I couldn’t find any data for ‘B+’. I have options like O+, AB+, or A-. Could you let me know which one fits best?”
-
-            Valid values for field validation:
-                - `blood_bank_name` (accepted blood banks): {bank_names}
-                - `blood_group`: {blood_groups}
-                - `reason` (Cause of request): {reasons}
-                - `status` (upcoming status): {statuses}
-                - `order_line_items` (Blood Components):  
-                  [Single Donor Platelet, Platelet Concentrate, Packed Red Cells, Whole Human Blood, Platelet Rich Plasma, Fresh Frozen Plasma, Cryo Precipitate] 
-                - current time for Time based fields: {get_current_datetime()}
-                       
-            Clarify with a friendly, helpful message listing a few valid options. Do not assume or auto-correct silently.
-            """.strip()
-            
-            
-            full_prompt = [
-                SystemMessage(content=system_intent_prompt + field_context + system_intent_prompt2),
-                state["history_context"] + " ".join(msg.content for msg in state["messages"])
-            ]
-            # print("full_prompt :", full_prompt)
-
-            response = llm.invoke(full_prompt)
-
+            possible_values = await get_possible_values(HasuraMemory.from_config(config)) or {}
+            entities = entity_extractor.resolve("HOSPITAL", state["messages"][-1].content, possible_values)
+            if entities.clarification:
+                # A value the company has no data for: ask back without the planner call
+                plan = IntentPlan.clarification(state["messages"][-1].content, entities.clarification)
+            else:
+                # The planner answers in the model's JSON-schema mode, parsed straight into an IntentPlan
+                plan = await model_router.ainvoke("intent_planner", planner_prompt(state, entities, question_dates), schema=IntentPlan)
             logger.info("intent_planner LLM response received.")
-            return {
-                "messages": state["messages"] + [
-                    AIMessage(content=response.content, additional_kwargs={"tag": "intent_planner"})
-                ],
-                "intent_planner_response": [response.content],
-                "nodes": new_nodes,
-                "time": new_time
-            }
 
         except Exception as e:
             logger.error(f"Error in intent_planner: {e}")
-            fallback_response = f"""{{
-                "intent": "general",
-                "rephrased_question": {json.dumps(state["messages"][0].content)},
-                "chain_of_thought": "No chain of thoughts available",
-                "ask_for": "",
-                "fields_needed": ""
-            }}"""
-            return {
-                "messages": state["messages"] + [AIMessage(content=fallback_response, additional_kwargs={"tag": "intent_planner"})],
-                "intent_planner_response": [fallback_response],
-                "nodes": new_nodes,
-                "time": new_time
-            }
+            plan = IntentPlan.fallback(state["messages"][0].content)
+
+        # Kept only if the plan confirms a data query with the same meaning, otherwise cancelled
+        speculative_query = await query_speculation.resolve(
+            speculation, plan, state["messages"][-1].content, filter_vocabulary(possible_values)
+        )
+
+        return {
+            "messages": state["messages"] + [
+                AIMessage(content=plan.model_dump_json(), additional_kwargs={"tag": "intent_planner"})
+            ],
+            "intent_plan": plan,
+            "date_slots": resolve_dates(plan.rephrased_question),
+            "speculative_query": speculative_query,
+            "nodes": new_nodes,
+            "time": new_time
+        }
+
+    async def fused_planner(state: AgentState, config: RunnableConfig):
+        """intent_planner and query_generate in one LLM call; a missing or invalid query is left to query_generate."""
+        logger.info("fused_planner is executing..")
+        new_nodes = state["nodes"] + ["intent_planner"]
+        new_time = state["time"] + [store_datetime()]
+        # The question's time phrases, resolved once per turn
+        question_dates = date_context(resolve_dates(state["messages"][-1].content))
+
+        try:
+            possible_values = await get_possible_values(HasuraMemory.from_config(config)) or {}
+            entities = entity_extractor.resolve("HOSPITAL", state["messages"][-1].content, possible_values)
+            if entities.clarification:
+                plan = IntentPlan.clarification(state["messages"][-1].content, entities.clarification)
+            else:
+                plan = await model_router.ainvoke(
+                    "fused_planner", planner_prompt(state, entities, question_dates, system_fused_planner_prompt, "hospital.fused_planner"), schema=FusedPlan
+                )
+            logger.info("fused_planner LLM response received.")
+        except Exception as e:
+            logger.error(f"Error in fused_planner: {e}")
+            plan = IntentPlan.fallback(state["messages"][0].content)
+
+        messages = state["messages"] + [
+            AIMessage(content=plan.model_dump_json(exclude={"graphql_query"}), additional_kwargs={"tag": "intent_planner"})
+        ]
+        loop_count = state.get("loop_count", 0)
+        query = getattr(plan, "graphql_query", "").strip()
+        if plan.route() == "data_query" and query:
+            errors = await schema_validator.validate(query, HasuraMemory.from_config(config))
+            if errors:
+                logger.error(f"fused_planner: planned query is invalid, falling back to query_generate: {errors}")
+            else:
+                messages.append(AIMessage(content=query, additional_kwargs={"tag": "query_generate"}))
+                new_nodes.append("query_generate")
+                new_time.append(store_datetime())
+                loop_count += 1
+
+        return {
+            "messages": messages,
+            "intent_plan": plan,
+            "date_slots": resolve_dates(plan.rephrased_question),
+            "nodes": new_nodes,
+            "time": new_time,
+            "loop_count": loop_count
+        }
 
     def static_query_generate(fields_needed: list):
             all_order_supported_fields = ["age", "blood_bank_name", "blood_group", "creation_date_and_time", "delivery_date_and_time",\
@@ -207,9 +239,8 @@ def build_graph(company_id,user_id):
                 
             """
 
-    def query_generate(state: AgentState):
+    async def query_generate(state: AgentState, config: RunnableConfig):
         logger.info("query_generate is executing...")
-        from graphql import parse, GraphQLError
    
         last_message = state["messages"][-1]
         if last_message.content.strip().startswith("[GraphQL Error]"):
@@ -219,71 +250,68 @@ def build_graph(company_id,user_id):
                 User question: {state['messages'][0].content}
                 Response from graphql tool: {last_message.content}
                 Please fix the query.
+                {date_context(state.get("date_slots"))}
                 """
             )
-            response = llm.invoke([system_query_prompt_format] + [input_message]) 
+            response = await model_router.ainvoke(
+                "repair", assemble("hospital.query_generate", system_query_prompt_format, input_message),
+                escalate=repeated_graphql_error(state["messages"])
+            )
         
         else:
-            json_data = {}
-            try:
-                content = state["intent_planner_response"][0].strip()
-                try:
-                    json_data = json.loads(content)
-                except json.JSONDecodeError:
-                    try:
-                        import re
-                        corrected_content = re.sub(r"(\w+):", r'"\1":', content) 
-                        json_data = json.loads(corrected_content)
-                    except Exception:
-                        logger.error("query_generate: Failed to parse intent planner output.")
-                        json_data = {
-                            "rephrased_question": state["messages"][0].content,
-                            "chain_of_thought": "No reasoning available.",
-                            "fields_needed": ""
-                        }
-
-                required_keys = ["rephrased_question", "chain_of_thought","fields_needed"]
-                if not all(key in json_data for key in required_keys):
-                    logger.info(f"query_generate: Missing required {required_keys} keys in intent response.")
-
-                    json_data.setdefault("rephrased_question", state["messages"][0].content)
-                    json_data.setdefault("chain_of_thought", "")
-                    json_data.setdefault("fields_needed", "")
-
-                input_message = HumanMessage(
-                    content=(
-                        f"User question: {json_data['rephrased_question']}\n"
-                        f"Chain of Thought: {json_data['chain_of_thought']}\n"
-                        f"Suggested fields: {json_data['fields_needed']}"
-                    )
+            plan = state.get("intent_plan") or IntentPlan.fallback(state["messages"][0].content)
+            input_message = HumanMessage(
+                content=(
+                    f"User question: {plan.rephrased_question}\n"
+                    f"Chain of Thought: {plan.chain_of_thought}\n"
+                    f"Suggested fields: {', '.join(plan.fields_needed)}\n"
+                    f"{date_context(state.get('date_slots'))}"
                 )
-                suggested_fields = json_data['fields_needed']
-                # print("suggested_fields :", suggested_fields)
-            except Exception as e:
-                logger.error(f"query_generate error: {e}")
-                input_message = state["messages"][0]
+            )
             system_message = SystemMessage(
                 content=system_query_prompt_format
             )
-            # print("input_message :", input_message.content)
-            response = llm.invoke([system_message, input_message])
+            # High-frequency question shapes are answered from a template, without an LLM call
+            graphql_client = HasuraMemory.from_config(config)
+            template_query = match_template("HOSPITAL", plan, await get_possible_values(graphql_client))
+            speculative_query = state.get("speculative_query")
+            if template_query:
+                logger.info("query_generate: using query template.")
+                response = AIMessage(content=template_query)
+                if speculative_query is not None:
+                    query_speculation.superseded(speculative_query)
+            elif speculative_query is not None:
+                logger.info("query_generate: using speculative query.")
+                query_speculation.used()
+                response = speculative_query
+            else:
+                # print("input_message :", input_message.content)
+                response = await model_router.ainvoke("query_generate", assemble("hospital.query_generate", system_message, input_message))
             print("query_generated : ",response.content)
-            try:
-                parsed = parse(response.content)
-            except GraphQLError as e:
-                logger.error(f"GraphQLError in query_generate: {e}")
-                error_message =  f"[GraphQL Error] {str(e)} When running this query: {response.content}."
+            # Validate against the Hasura schema locally so invalid queries never reach Hasura
+            errors = await schema_validator.validate(response.content, graphql_client)
+            if errors:
+                logger.error(f"GraphQLError in query_generate: {errors}")
+                error_message = format_graphql_error(response.content, errors)
                 query_validation_input_message = HumanMessage(content=f"""
                         User Request: {input_message}
                         Error Message:
                         {error_message}
                         """)
-                try:
-                    response = llm.invoke([SystemMessage(content=System_query_validation_prompt), query_validation_input_message])
-                    parsed = parse(response.content)
-                except Exception as e:
-                    logger.error(f"Failed to parse GraphQL response: {e}")
-                    response.content=static_query_generate(suggested_fields)
+                # A repair that is still invalid is retried once on the escalation model
+                for escalate in (False, True):
+                    try:
+                        response = await model_router.ainvoke("repair", assemble(
+                            "hospital.query_validation", SystemMessage(content=System_query_validation_prompt), query_validation_input_message
+                        ), escalate=escalate)
+                        errors = await schema_validator.validate(response.content, graphql_client)
+                    except Exception as e:
+                        errors = [str(e)]
+                    if not errors or not model_router.can_escalate("repair"):
+                        break
+                if errors:
+                    logger.error(f"Failed to validate repaired GraphQL query: {errors}")
+                    response.content=static_query_generate(plan.fields_needed)
                     logger.error(f"Used static query generation due to validation failure")
                
             logger.info("Query_generated finished successfully.")
@@ -295,10 +323,11 @@ def build_graph(company_id,user_id):
             "messages": state["messages"] + [AIMessage(content=response.content, additional_kwargs={"tag": "query_generate"})],
             "nodes": state["nodes"],
             "time": state["time"],
-            "loop_count": state.get("loop_count", 0) + 1
+            "loop_count": state.get("loop_count", 0) + 1,
+            "speculative_query": None
         }
 
-    def call_tool(state: AgentState):
+    async def call_tool(state: AgentState, config: RunnableConfig):
         last_ai_message = state["messages"][-1]
         
         if not hasattr(last_ai_message, "tool_calls") or not last_ai_message.tool_calls:
@@ -322,7 +351,7 @@ def build_graph(company_id,user_id):
                 else:
                     args = call.get("args", {})
                     tool_input = args.get("query", args)
-                    tool_result = tool_map[tool_name].run(tool_input)
+                    tool_result = await graphql_wrapper.arun(tool_input, headers=HasuraMemory.from_config(config).headers)
                     
             except Exception as e:
                 logger.error(f"Tool execution failed: {e}")
@@ -337,10 +366,10 @@ def build_graph(company_id,user_id):
             "tool_calls_history": (state.get("tool_calls_history", []) + [tool_outputs])
         }
     
-    def run_graphql_query(state: AgentState):
+    async def run_graphql_query(state: AgentState, config: RunnableConfig):
         query = state["messages"][-1].content
         logger.info(f"Running GraphQL query: {query}")
-        data=graphql_client.run_query(query)
+        data=await HasuraMemory.from_config(config).arun_query(query)
         state["nodes"].append("run_graphql_query")
         state["time"].append(store_datetime())
         
@@ -370,8 +399,12 @@ def build_graph(company_id,user_id):
             "time": state["time"]
         }
 
+    fused = planner_mode == "fused"
     sample_builder= StateGraph(AgentState)
-    sample_builder.add_node("intent_planner", intent_planner)
+    if fused:
+        sample_builder.add_node("fused_planner", fused_planner)
+    else:
+        sample_builder.add_node("intent_planner", intent_planner)
     sample_builder.add_node("query_generate", query_generate)
     sample_builder.add_node("general_response", general_response)
     sample_builder.add_node("run_graphql_query", run_graphql_query)
@@ -379,13 +412,23 @@ def build_graph(company_id,user_id):
     # sample_builder.add_node("graphql_tool", call_tool)
     sample_builder.add_node("clarify", clarify)
 
-    sample_builder.add_conditional_edges("intent_planner", intent_planner_decision,
-                                         {
-            "data_query": "query_generate",
-            "general": "general_response",
-            "clarification": "clarify"
-        }
-    )
+    if fused:
+        sample_builder.add_conditional_edges("fused_planner", fused_planner_decision,
+                                             {
+                "query": "run_graphql_query",
+                "data_query": "query_generate",
+                "general": "general_response",
+                "clarification": "clarify"
+            }
+        )
+    else:
+        sample_builder.add_conditional_edges("intent_planner", intent_planner_decision,
+                                             {
+                "data_query": "query_generate",
+                "general": "general_response",
+                "clarification": "clarify"
+            }
+        )
    
     sample_builder.add_conditional_edges("query_generate", should_continue, {
         "query": "run_graphql_query",
@@ -398,7 +441,7 @@ def build_graph(company_id,user_id):
     sample_builder.add_edge("general_response",END)
     sample_builder.add_edge("clarify",END)
 
-    sample_builder.set_entry_point("intent_planner")
+    sample_builder.set_entry_point("fused_planner" if fused else "intent_planner")
     # sample_builder.add_edge("intent_planner", END)
     graph=sample_builder.compile() 
     # graph_code = graph.get_graph(xray=True).draw_mermaid()
@@ -407,6 +450,4 @@ def build_graph(company_id,user_id):
     # graph.get_graph(xray=True).draw_mermaid_png(output_file_path="graph.png")
     return graph
 
-# user_id = "USR-3K2HD8DHYH"
-# company_id = "CMP-RRPZYICLEG"
-# graph=build_graph(company_id,user_id)
+# graph=build_graph()
@@ -7,15 +7,17 @@ from langchain_core.messages import (  # type: ignore
     SystemMessage,
     ToolMessage,
 )
-from langchain_openai import ChatOpenAI  # type: ignore
 from langgraph.graph.message import add_messages  # type: ignore
 
-from config.config import OPENAI_API_KEY
 from config.logging_config import setup_logger
 from hospital.prompt import (
     system_data_analysis_prompt_format,
     system_general_response_prompt
 )
+from date_resolver import DateSlots
+from intent_plan import IntentPlan
+from model_router import model_router
+from prompt_assembly import assemble
 from utils import get_current_datetime, store_datetime
 
 logger = setup_logger()
@@ -24,7 +26,9 @@ import json
 
 class AgentState(TypedDict):
     messages: Annotated[Union[AIMessage, HumanMessage, ToolMessage,SystemMessage],add_messages]
-    intent_planner_response: Optional[list[Dict[str,any]]]
+    intent_plan: Optional[IntentPlan]
+    speculative_query: Optional[AIMessage]
+    date_slots: Optional[DateSlots]
     tool_calls_history: Optional[List[Dict[str, any]]]
     query_generate_response: Optional[Dict[str, any]]
     history: List[Any]
@@ -34,51 +38,35 @@ class AgentState(TypedDict):
     loop_count: Optional[int] = 0
     debug_info: Optional[Dict[str, Any]]
 
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0,api_key=OPENAI_API_KEY)
-
 
 def intent_planner_decision(state: AgentState):
-    try:
-        last_message = state["messages"][-1].content
-        if not isinstance(last_message, str):
-            logger.warning("Non-string message content, routing to general")
-            return "general"
-            
-        output = json.loads(last_message)
-        
-        # Validate required fields
-        if "ask_for" not in output or "intent" not in output:
-            logger.error("Missing required fields in intent response")
-            return "general"
-            
-        if output["ask_for"].strip():
-            return "clarification"
-        elif output["intent"] == "data_query":
-            return "data_query"
-        else:
-            return "general"
-            
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing failed in decision: {e}")
-        return "general"
-    except Exception as e:
-        logger.error(f"Unexpected error in intent_planner_decision: {e}")
+    plan = state.get("intent_plan")
+    if plan is None:
+        logger.error("No intent plan in state, routing to general")
         return "general"
+    return plan.route()
+
+def fused_planner_decision(state: AgentState):
+    # The fused planner records a usable query as its own query_generate step
+    if state["nodes"][-1] == "query_generate":
+        return "query"
+    return intent_planner_decision(state)
 
-def general_response(state: AgentState):
+async def general_response(state: AgentState):
     try:
-        last_message = json.loads(state["messages"][-1].content)
-        input_message = [HumanMessage(content=f"User question: {last_message['rephrased_question']}\nChain of Thought: {last_message['chain_of_thought']}\nCurrent Time: {get_current_datetime()}")]
-        output = llm.invoke([SystemMessage(content=system_general_response_prompt)] + input_message)
-    except json.JSONDecodeError:
-        # Fallback to original user message
-        user_message = next((msg for msg in state["messages"] if isinstance(msg, HumanMessage)), None)
-        if user_message:
-            input_message = [HumanMessage(content=f"User question: {user_message.content}\nCurrent Time: {get_current_datetime()}")]
-            output = llm.invoke([SystemMessage(content=system_general_response_prompt)] + input_message)
+        plan = state.get("intent_plan")
+        if plan is not None:
+            input_message = [HumanMessage(content=f"User question: {plan.rephrased_question}\nChain of Thought: {plan.chain_of_thought}\nCurrent Time: {get_current_datetime()}")]
+            output = await model_router.ainvoke("general_response", assemble("hospital.general_response", SystemMessage(content=system_general_response_prompt), *input_message))
         else:
-            logger.error("No valid user message found in state")
-            output = AIMessage(content="I'm sorry, I couldn't process your request. Please try again.")
+            # Fallback to original user message
+            user_message = next((msg for msg in state["messages"] if isinstance(msg, HumanMessage)), None)
+            if user_message:
+                input_message = [HumanMessage(content=f"User question: {user_message.content}\nCurrent Time: {get_current_datetime()}")]
+                output = await model_router.ainvoke("general_response", assemble("hospital.general_response", SystemMessage(content=system_general_response_prompt), *input_message))
+            else:
+                logger.error("No valid user message found in state")
+                output = AIMessage(content="I'm sorry, I couldn't process your request. Please try again.")
     except Exception as e:
         logger.error(f"Error in general_response: {e}")
         output = AIMessage(content="An error occurred while processing your request.")
@@ -99,32 +87,36 @@ def should_continue(state: AgentState):
         logger.error(f"GraphQLError in query_generate: {e}")
         "end"
 
-def data_analyser(state: AgentState):
+async def data_analyser(state: AgentState):
     logger.info("data_analyser is executing..")
     try:
-        rephrased_question = json.loads(state["intent_planner_response"][0]).get("rephrased_question","")
+        plan = state.get("intent_plan")
+        rephrased_question = plan.rephrased_question if plan is not None else ""
         user_message= rephrased_question if rephrased_question else state["messages"][0]
-        response = llm.invoke([system_data_analysis_prompt_format]+["User question : "+user_message,"Data : "+str(state["messages"][-1].content)+"Response: "])
+        response = await model_router.ainvoke("data_analyser", assemble(
+            "hospital.data_analyser", system_data_analysis_prompt_format,
+            "User question : "+user_message+"\nCurrent Time: "+get_current_datetime(),
+            "Data : "+str(state["messages"][-1].content)+"Response: "
+        ))
 
     except Exception as e:
         logger.error(f"data_analyser error: {e}")
-        response = llm.invoke([system_data_analysis_prompt_format]+state["messages"])
+        response = await model_router.ainvoke("data_analyser", assemble(
+            "hospital.data_analyser", system_data_analysis_prompt_format, *state["messages"], "Current Time: "+get_current_datetime()
+        ))
 
     state["nodes"].append("data_analyser")
     state["time"].append(store_datetime())
     return {"messages": state["messages"] + [AIMessage(content=response.content)],"nodes":state["nodes"],"time":state["time"]}
 
-def clarify(state: AgentState):
-    last_message = state["messages"][-1].content
-    if isinstance(last_message,str):
-        try:
-            output = json.loads(last_message)
-        except Exception as e:
-            logger.error("clarify error: {e}")
-            return {"messages": state["messages"] + [AIMessage(content="we don't understand your question, can you rephrase it?",additional_kwargs={"tag": "clarify"})]}
+async def clarify(state: AgentState):
+    plan = state.get("intent_plan")
+    if plan is None or not plan.ask_for.strip():
+        logger.error("clarify error: no clarification in intent plan")
+        return {"messages": state["messages"] + [AIMessage(content="we don't understand your question, can you rephrase it?",additional_kwargs={"tag": "clarify"})]}
     state["nodes"].append("clarify")
     state["time"].append(store_datetime())
-    return {"messages": state["messages"] + [AIMessage(content=output["ask_for"],additional_kwargs={"tag": "clarify"})],"nodes":state["nodes"],"time":state["time"]}
+    return {"messages": state["messages"] + [AIMessage(content=plan.ask_for,additional_kwargs={"tag": "clarify"})],"nodes":state["nodes"],"time":state["time"]}
 
 # def intent_classify(state: AgentState):
 #     logger.info("intent_classify is executing..")
@@ -1,4 +1,3 @@
-from utils import get_current_datetime
 
 System_query_validation_prompt = """
 You are a GraphQL query validator and corrector. 
@@ -496,7 +495,8 @@ User: How many orders by hospital this month?
 """
 
 System_query_prompt_template = System_small_prompt_template
-system_query_prompt_format = System_query_prompt_template + f"Current Date and Time (Use this for time references): {get_current_datetime()}."
+# The current time and resolved dates go into each request's message (date_resolver.date_context), not here at import time
+system_query_prompt_format = System_query_prompt_template
 
 system_data_analysis_prompt_template = """
 Role: You are a helpful and friendly assistant named Inhlth, designed to analyze blood supply and cost data and answer user questions accurately based on the provided data.
@@ -863,9 +863,10 @@ This month, you placed 6 blood orders — 3 were completed, 2 are still pending,
 
 """
 
-system_current_time_prompt =f"""\nCurrent date and time (Use this for time references): {get_current_datetime()}.\n
+# Static, so the prompt stays a cacheable prefix; the current time comes with the question
+system_current_time_prompt ="""\n
  When mentioning dates or times, always rephrase them in natural, human-friendly terms (e.g., ‘yesterday’, ‘earlier this month’, ‘on Aug 7, 2025’). 
- Use the provided current date as a reference point for relative terms like last week, last month, etc"""  
+ Use the current date given with the question as a reference point for relative terms like last week, last month, etc"""  
 
 system_data_analysis_prompt_format = system_data_analysis_prompt_template+f"{system_data_analysis_prompt_template_few_shot}" + system_current_time_prompt
 
@@ -1189,6 +1190,18 @@ User Input: "What is the status of my order?"
 
  """
 
+# Appended to the intent planner prompt by the fused planner (GRAPH_PLANNER_MODE="fused")
+system_fused_planner_prompt = """
+---
+
+COMBINED PLANNING AND QUERY GENERATION
+Your JSON output has one more key, "graphql_query":
+- When intent is "data_query" and ask_for is empty, set it to the complete GraphQL query that answers rephrased_question, written by the QUERY GENERATION RULES below. Only the query text: no markdown, no comments.
+- Otherwise set it to "".
+
+QUERY GENERATION RULES
+""" + system_query_prompt_format
+
 system_general_response_prompt = """
 Role:
 You are a helpful and friendly assistant named `Inhlth` for hospital staffs, designed to analyze blood supply and cost data and answer user questions.
@@ -1566,4 +1579,4 @@ There are 2 rejected orders in the current data.
 
 """
 
-system_short_data_analysis_prompt_format = system_short_data_analysis_prompt_template+ f"\nCurrent date and time (Use this for time references): {get_current_datetime()}." 
+system_short_data_analysis_prompt_format = system_short_data_analysis_prompt_template
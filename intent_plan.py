@@ -0,0 +1,69 @@
+"""
+Typed output of the intent planner.
+
+Both graphs call the planner through the model's structured-output (JSON schema) mode with
+``IntentPlan`` as the schema, store the parsed object once in ``AgentState["intent_plan"]``
+and let every later node read its fields, instead of re-parsing the planner's JSON text.
+
+Every field is required because OpenAI's strict JSON-schema mode does not accept optional
+properties or defaults; "no clarification" is an empty ``ask_for``.
+"""
+from typing import Any, List, Literal
+
+from pydantic import BaseModel, Field, field_validator
+
+
+class IntentPlan(BaseModel):
+    intent: Literal["general", "data_query"] = Field(
+        description="data_query when the question needs data from the database, otherwise general."
+    )
+    rephrased_question: str = Field(description="The user's question rewritten to be self-contained.")
+    chain_of_thought: str = Field(description="Short reasoning behind the intent and the fields.")
+    ask_for: str = Field(description="Clarification to ask the user when a value cannot be validated; empty otherwise.")
+    fields_needed: List[str] = Field(description="Key fields to return from the data.")
+
+    @field_validator("fields_needed", mode="before")
+    @classmethod
+    def _split_fields(cls, value: Any) -> Any:
+        # The prompt examples use "" for "no fields"; older outputs used a comma-separated string
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [field.strip() for field in value.split(",") if field.strip()]
+        return value
+
+    @classmethod
+    def fallback(cls, question: str) -> "IntentPlan":
+        """Plan used when the planner call fails: answer the original question as a general one."""
+        return cls(
+            intent="general",
+            rephrased_question=question,
+            chain_of_thought="No chain of thoughts available",
+            ask_for="",
+            fields_needed=[],
+        )
+
+    @classmethod
+    def clarification(cls, question: str, ask_for: str) -> "IntentPlan":
+        """Plan asking the user to clarify, decided locally without the planner call."""
+        return cls(
+            intent="data_query",
+            rephrased_question=question,
+            chain_of_thought="A value in the question does not match the company's data",
+            ask_for=ask_for,
+            fields_needed=[],
+        )
+
+    def route(self) -> str:
+        """Branch of the graph this plan leads to: clarification, data_query or general."""
+        if self.ask_for.strip():
+            return "clarification"
+        return "data_query" if self.intent == "data_query" else "general"
+
+
+class FusedPlan(IntentPlan):
+    """IntentPlan of the fused planner, which also writes the GraphQL query of a clear data question."""
+
+    graphql_query: str = Field(
+        description="For a data_query with an empty ask_for: the complete GraphQL query answering rephrased_question; otherwise empty."
+    )
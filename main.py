@@ -1,4 +1,5 @@
 # main.py
+import asyncio
 import json
 import os
 import random
@@ -6,14 +7,32 @@ import time
 from datetime import datetime
 from enum import Enum
 from typing import Dict, List, Optional, Union
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from langsmith import utils
 from pydantic import BaseModel, Field, field_validator
 from langsmith import trace, Client
 
-from chat import generate_chat_response
+import metrics
+import prompt_assembly
+import query_templates
+from cache import memory_cache, session_cache
+from cache.answer_cache import answer_cache
+from cache.data_freshness import data_freshness
+from cache.filter_cache import filter_values_cache
+from cache.single_flight import chat_flight
+from chat import generate_chat_response, stream_chat_response
+from fast_path import fast_path
+from entity_extractor import entity_extractor
+from graph_registry import compile_graphs
+from history_context import history_builder, warm_up as warm_up_history_tokens
+from hasura.http_client import close_clients
+from hasura.schema_validator import schema_validator
+from hasura.write_behind import message_writer
+from session_summary import session_summaries
+from model_router import model_router
+from speculative_query import query_speculation
 from config.config import (
     APP_DEBUG,
     HASURA_ADMIN_SECRET,
@@ -134,13 +153,56 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
+@app.on_event("startup")
+async def warm_graphs():
+    """Compile the LangGraphs once per process instead of per request."""
+    compile_graphs()
+
+@app.on_event("startup")
+async def warm_token_encoding():
+    # Off the event loop: the first load may download the encoding
+    await asyncio.to_thread(warm_up_history_tokens)
+
+@app.on_event("startup")
+async def start_message_writer():
+    await message_writer.start()
+
+@app.on_event("shutdown")
+async def close_hasura_clients():
+    # Drain queued chat messages and running summary updates before the HTTP pools are closed
+    await message_writer.stop()
+    await session_summaries.stop()
+    await close_clients()
+
+metrics.register_collector(lambda: {
+    "filter_cache": filter_values_cache.stats(),
+    "answer_cache": answer_cache.stats(),
+    "data_freshness": data_freshness.stats(),
+    "history_cache": memory_cache.stats(),
+    "session_cache": session_cache.stats(),
+    "chat_single_flight": chat_flight.stats(),
+    "message_writer": message_writer.stats(),
+    "query_templates": query_templates.stats(),
+    "graphql_validation": schema_validator.stats(),
+    "query_speculation": query_speculation.stats(),
+    "fast_path": fast_path.stats(),
+    "entity_extractor": entity_extractor.stats(),
+    "prompt_cache": prompt_assembly.stats(),
+    "history_context": history_builder.stats(),
+    "session_summary": session_summaries.stats(),
+    "model_router": model_router.stats(),
+})
+
+# Endpoints that carry no JSON body / user_id (scraped by monitoring)
+UNAUTHENTICATED_PATHS = ("/metrics",)
+
 def is_valid_user(user_id:str)-> bool:
     return True
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()  # Track start time
-    if request.method == "OPTIONS":
+    if request.method == "OPTIONS" or request.url.path in UNAUTHENTICATED_PATHS:
         return await call_next(request)
     # Read and preserve request body
     try:
@@ -149,9 +211,8 @@ async def log_requests(request: Request, call_next):
         logger.error(f"Failed to read request body: {e}")
         return JSONResponse({"error": "Invalid request body"}, status_code=400)
 
-    async def receive():
-        return {"type": "http.request", "body": body_bytes, "more_body": False}
-    request._receive = receive
+    # BaseHTTPMiddleware caches the body read above and replays it to the route; overriding
+    # request._receive here breaks the disconnect listener of streaming responses.
 
     # Parse body and extract user_id
     try:
@@ -177,11 +238,13 @@ async def log_requests(request: Request, call_next):
         return JSONResponse({"error": "Internal server error"}, status_code=500)
 
     process_time = round((time.time() - start_time) * 1000, 2)  # in ms
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_SECONDS.observe(process_time / 1000, route.path if route else "unmatched")
     logger.info(f"Request completed: {request.method} {request.url.path} (User: {user_id}) - {process_time}ms")
 
     return response
 
-async def session_init(user_id: str,session_id):
+async def session_init(user_id: str,session_id, hasura_client: Optional[HasuraMemory] = None):
     """
     Init endpoint - returns complete response at once
     """
@@ -192,7 +255,8 @@ async def session_init(user_id: str,session_id):
     created_at = store_datetime()
     conversation_id = get_message_unique_id()   
 
-    hasura_client = HasuraMemory(hasura_url=HASURA_GRAPHQL_URL, hasura_secret=HASURA_ADMIN_SECRET, hasura_role=HASURA_ROLE, user_id=user_id)
+    if hasura_client is None:
+        hasura_client = HasuraMemory(hasura_url=HASURA_GRAPHQL_URL, hasura_secret=HASURA_ADMIN_SECRET, hasura_role=HASURA_ROLE, user_id=user_id)
 
     initial_response = random.choice(WELCOME_MESSAGES)
     
@@ -202,7 +266,7 @@ async def session_init(user_id: str,session_id):
         "created_at":created_at,
         "title": session_id 
     }
-    result = hasura_client.session_init(variables=variables)
+    result = await hasura_client.asession_init(variables=variables)
     if not result:
         logger.error("Session init failed, unable to create session")
         return JSONResponse(status_code=500, content={"response": "There was an technical issue. Please try again later."})
@@ -210,19 +274,34 @@ async def session_init(user_id: str,session_id):
     logger.info(f"Session init Success: {result}")
     return {"session_id":session_id,"response":initial_response,"created_at":created_at}
 
-async def process_normal_message(req: ChatRequest):
-    """Process message for normal response"""
-    config = {"configurable": {"thread_id":req.session_id}}
-    hasura_client = HasuraMemory(
+def chat_hasura_client(req: ChatRequest) -> HasuraMemory:
+    """One Hasura client per chat request, shared by the session bootstrap and the graph run."""
+    return HasuraMemory(
         hasura_url=HASURA_GRAPHQL_URL,
         hasura_secret=HASURA_ADMIN_SECRET,
         hasura_role=HASURA_ROLE,
+        company_id=req.company_id,
         user_id=req.user_id,
     )
-    session_exists = hasura_client.check_session_exists(req.session_id)
-    print("session_exists", session_exists)
-    if not session_exists:
-        session_response = await session_init(req.user_id, req.session_id)
+
+async def ensure_session(req: ChatRequest, hasura_client: HasuraMemory):
+    """
+    Upsert the chat session the first time this process sees it. The insert already uses
+    on_conflict, so no existence check is needed and known sessions skip Hasura entirely.
+    """
+    if session_cache.is_known(req.user_id, req.session_id):
+        return
+    result = await session_init(req.user_id, req.session_id, hasura_client=hasura_client)
+    # session_init answers a JSONResponse when the upsert failed: retry on the next request
+    if isinstance(result, dict) and result.get("session_id"):
+        session_cache.mark_known(req.user_id, req.session_id)
+
+async def process_normal_message(req: ChatRequest):
+    """Process message for normal response"""
+    config = {"configurable": {"thread_id":req.session_id}}
+    hasura_client = chat_hasura_client(req)
+    with metrics.timed("bootstrap"):
+        await ensure_session(req, hasura_client)
         
     inputs = {"message": req.message}
 
@@ -231,7 +310,7 @@ async def process_normal_message(req: ChatRequest):
     try:
         with trace(name="chat_session", inputs=inputs) as root_run:
             trace_id = str(root_run.id)
-            response = generate_chat_response(chat_request = req, config=config,conversation_id=trace_id)
+            response = await generate_chat_response(chat_request = req, config=config,conversation_id=trace_id, hasura_memory=hasura_client)
             # response = generate_chat_response(chat_request = req,config = config,conversation_id=conversation_id)
             return ChatResponse(
                 session_id=req.session_id,
@@ -289,13 +368,20 @@ async def health_check():
         "timestamp": datetime.now().isoformat(),
         "endpoints": {
             "normal_chat": "/ai_assistant/chat",
+            "stream_chat": "/ai_assistant/chat/stream",
             "history": "/ai_assistant/get_session_messages",
             "health": "/ai_assistant/health",
+            "metrics": "/ai_assistant/metrics",
             "test": "/ai_assistant",
             "last updated":"2025-11-27"
         }
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of node, Hasura and LLM latencies, token counts and cache stats."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/feedback")
 async def feedback_endpoint(req: FeedbackRequest):
     """
@@ -309,9 +395,10 @@ async def feedback_endpoint(req: FeedbackRequest):
     session_id = req.session_id
     feedback = req.feedback
 
-    result = hasura_obj.add_feedback(conversation_id=conversation_id,session_id=session_id,feedback=feedback)
+    result = await hasura_obj.aadd_feedback(conversation_id=conversation_id,session_id=session_id,feedback=feedback)
     try:
-        client.create_feedback(
+        await asyncio.to_thread(
+        client.create_feedback,
         key="user_feedback",
         score=feedback ,#if req.feedback == "positive" else 0,
         trace_id=req.conversation_id,
@@ -324,43 +411,99 @@ async def feedback_endpoint(req: FeedbackRequest):
     return {"response": "Feedback added successfully!", "last updated":"2025-11-27"}
 
 @app.post("/chat")
-async def chat_endpoint(req: ChatRequest):
+async def chat_endpoint(req: ChatRequest, response: Response):
     """
     Normal chat endpoint - returns complete response at once
     """
     logger.info(f"Chat Request: {req}")     
-    
+    timings = metrics.start_request_timings()
+
     result = await process_normal_message(req)
+    response.headers["Server-Timing"] = timings.header()
     return  result
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """
+    Streaming chat endpoint (server-sent events) - emits node progress, then the answer
+    token by token; the last event carries the ChatResponse metadata.
+    """
+    logger.info(f"Chat Stream Request: {req}")
+    config = {"configurable": {"thread_id":req.session_id}}
+    hasura_client = chat_hasura_client(req)
+
+    async def event_stream():
+        # Flush a first event straight away so the client sees bytes before any Hasura/LLM work
+        yield sse_event("start", {"session_id": req.session_id})
+        conversation_id = get_message_unique_id()
+        try:
+            await ensure_session(req, hasura_client)
+            with trace(name="chat_session", inputs={"message": req.message}) as root_run:
+                conversation_id = str(root_run.id)
+                async for event in stream_chat_response(req, config, conversation_id, hasura_client):
+                    if event["event"] == "final":
+                        final = ChatResponse(
+                            session_id=req.session_id,
+                            response=event["response"],
+                            created_at=get_current_datetime(),
+                            conversation_id=conversation_id
+                        )
+                        yield sse_event("final", final.model_dump())
+                    else:
+                        yield sse_event(event["event"], event)
+        except Exception as e:
+            print("Main Stream Error:", str(e))
+            final = ChatResponse(
+                session_id=req.session_id,
+                response="Oops! Looks like we've got a technical issue in our system. Please try again later.",
+                created_at=req.created_at,
+                conversation_id=conversation_id
+            )
+            yield sse_event("final", final.model_dump())
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/get_session_messages")
-async def get_session_messages(req: HistoryRequest): 
+async def get_session_messages(req: HistoryRequest, response: Response): 
 
     print("get_session_messages request details: ", req.session_id)
+    timings = metrics.start_request_timings()
     hasura_obj = HasuraMemory(hasura_url=HASURA_GRAPHQL_URL, hasura_secret=HASURA_ADMIN_SECRET, hasura_role=HASURA_ROLE, user_id=req.user_id)
 
     try:
-        history = hasura_obj.get_history({"configurable": {"thread_id": req.session_id}})
+        with metrics.timed("history"):
+            history = await hasura_obj.aget_history({"configurable": {"thread_id": req.session_id}})
+        response.headers["Server-Timing"] = timings.header()
         if not history:
             return HistoryResponse(messages=[])
     except Exception as e:
         print(f"Error retrieving messages: {e}")
-        return JSONResponse(status_code=500, content={"message": []})
+        return JSONResponse(status_code=500, content={"message": []}, headers={"Server-Timing": timings.header()})
     
     return HistoryResponse(messages=history)
 
 @app.post("/get_session_list")
-async def get_session_list(req: UserInfo):
+async def get_session_list(req: UserInfo, response: Response):
     print("get_session_list request details: ", req.user_id)
+    timings = metrics.start_request_timings()
     hasura_obj = HasuraMemory(hasura_url=HASURA_GRAPHQL_URL, hasura_secret=HASURA_ADMIN_SECRET, hasura_role=HASURA_ROLE, user_id=req.user_id)
 
     try:
-        session_list = hasura_obj.get_session_list()
+        with metrics.timed("session_list"):
+            session_list = await hasura_obj.aget_session_list()
+        response.headers["Server-Timing"] = timings.header()
         if not session_list:
             return {"sessions_list": []}
     except Exception as e:
         print(f"Error retrieving messages: {e}")
-        return JSONResponse(status_code=500, content={"sessions": []})
+        return JSONResponse(status_code=500, content={"sessions": []}, headers={"Server-Timing": timings.header()})
     
     return {"sessions_list": session_list}
 
@@ -0,0 +1,336 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format at ``/metrics``.
+
+Recording is a dict lookup plus a few integer/float updates under the GIL, so it stays on
+in production. Cache statistics are not recorded per call; they are read from the caches'
+own ``stats()`` when ``/metrics`` is scraped.
+
+The same recording points also feed the per-request ``Server-Timing`` breakdown
+(``RequestTimings``) when a request has started one.
+"""
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler  # type: ignore
+from langchain_core.outputs import LLMResult  # type: ignore
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], Dict[str, Dict[str, Any]]]] = []
+# Prompt tokens of all LLM calls, and how many of them were cache reads
+_prompt_totals = {"prompt": 0, "cached": 0}
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram("chatbot_http_request_duration_seconds", "HTTP request latency by path.", ("path",))
+NODE_SECONDS = Histogram("chatbot_graph_node_duration_seconds", "LangGraph node latency.", ("graph_node",))
+HASURA_SECONDS = Histogram("chatbot_hasura_request_duration_seconds", "Hasura call latency by root operation.", ("operation",))
+LLM_SECONDS = Histogram("chatbot_llm_request_duration_seconds", "LLM call latency by graph node and model.", ("graph_node", "model"))
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens_total", "LLM tokens by graph node, model and kind (prompt, cached_prompt, completion).",
+    ("graph_node", "model", "kind")
+)
+QUERY_ITERATIONS = Histogram(
+    "chatbot_graph_query_iterations", "query_generate iterations per request.", buckets=(0, 1, 2, 3, 4, 5, 8)
+)
+FAST_PATH_SECONDS = Histogram(
+    "chatbot_fast_path_match_duration_seconds", "Rule-based small-talk classification latency.",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005),
+)
+HISTORY_TOKENS = Histogram(
+    "chatbot_history_context_tokens", "Conversation history tokens given to a node per call.", ("graph_node",),
+    buckets=(0, 100, 250, 500, 1000, 1500, 2000, 4000),
+)
+REQUEST_TOKENS = Histogram(
+    "chatbot_request_llm_tokens", "LLM tokens used per request.", buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000)
+)
+
+
+def register_collector(collector: Callable[[], Dict[str, Dict[str, Any]]]) -> None:
+    """
+    Register a callable returning ``{component: stats_dict}`` (e.g. ``{"answer_cache": {...}}``),
+    read on every scrape; numeric values are exported as ``chatbot_<component>_<key>``.
+    """
+    _collectors.append(collector)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+
+    for collector in _collectors:
+        try:
+            components = collector()
+        except Exception:
+            continue
+        for component, values in components.items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"chatbot_{component}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestTimings:
+    """Monotonic per-request timings, rendered as a ``Server-Timing`` header."""
+
+    __slots__ = ("entries", "start")
+
+    def __init__(self):
+        self.entries: List[Tuple[str, float]] = []
+        self.start = time.perf_counter()
+
+    def add(self, name: str, seconds: float) -> None:
+        self.entries.append((name, seconds))
+
+    def header(self) -> str:
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.entries]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> RequestTimings:
+    """Begin collecting timings for the current request (and the tasks it spawns)."""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+
+def current_request_timings() -> Optional[RequestTimings]:
+    return _request_timings.get()
+
+
+def record_timing(name: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Time a step of the current request for its Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - start)
+
+
+_OPERATION_RE = re.compile(r"\{\s*(\w+)")
+
+
+@lru_cache(maxsize=1024)
+def hasura_operation(query: str) -> str:
+    """Name of the first root field of a GraphQL document (e.g. ``insert_chat_messages``)."""
+    match = _OPERATION_RE.search(query or "")
+    return match.group(1) if match else "unknown"
+
+
+@contextmanager
+def observe_hasura(query: str, per_request: bool = True) -> Iterator[None]:
+    """
+    Time a Hasura call. Background work (the write-behind flusher) passes
+    ``per_request=False`` so it never lands in the timings of whichever request started it.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        operation = hasura_operation(query)
+        HASURA_SECONDS.observe(elapsed, operation)
+        if per_request:
+            record_timing(f"hasura.{operation}", elapsed)
+
+
+class GraphMetricsHandler(BaseCallbackHandler):
+    """
+    LangChain callback attached to each graph run: times every graph node and every chat
+    model call (attributed to the node that made it) and counts the tokens it used.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._nodes: Dict[UUID, Tuple[str, float]] = {}
+        self._llm_calls: Dict[UUID, Tuple[str, str, float]] = {}
+        # Totals for this graph run
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._nodes[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._nodes.pop(run_id, None)
+        if started:
+            elapsed = time.perf_counter() - started[1]
+            NODE_SECONDS.observe(elapsed, started[0])
+            record_timing(f"node.{started[0]}", elapsed)
+
+    on_chain_error = on_chain_end
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        # The routed model of the call (an escalated call reports the escalation model)
+        model = metadata.get("ls_model_name") or (kwargs.get("invocation_params") or {}).get("model", "unknown")
+        self._llm_calls[run_id] = (metadata.get("langgraph_node", "unknown"), model, time.perf_counter())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._llm_calls.pop(run_id, None)
+        if not started:
+            return
+        node, model, start = started
+        elapsed = time.perf_counter() - start
+        LLM_SECONDS.observe(elapsed, node, model)
+        record_timing(f"llm.{node}", elapsed)
+        prompt_tokens, completion_tokens = llm_token_usage(response)
+        cached_tokens = llm_cached_tokens(response)
+        self.llm_calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        _prompt_totals["prompt"] += prompt_tokens
+        _prompt_totals["cached"] += cached_tokens
+        if prompt_tokens:
+            LLM_TOKENS.inc(prompt_tokens, node, model, "prompt")
+        if cached_tokens:
+            LLM_TOKENS.inc(cached_tokens, node, model, "cached_prompt")
+        if completion_tokens:
+            LLM_TOKENS.inc(completion_tokens, node, model, "completion")
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._llm_calls.pop(run_id, None)
+        if started:
+            node, model, start = started
+            elapsed = time.perf_counter() - start
+            LLM_SECONDS.observe(elapsed, node, model)
+            record_timing(f"llm.{node}", elapsed)
+
+
+def observe_graph_run(handler: GraphMetricsHandler, output: Dict[str, Any]) -> Dict[str, int]:
+    """Record and return the query iterations and LLM usage of one finished graph run."""
+    usage = {
+        "iterations": output.get("loop_count") or 0,
+        "llm_calls": handler.llm_calls,
+        "prompt_tokens": handler.prompt_tokens,
+        "completion_tokens": handler.completion_tokens,
+        "cached_tokens": handler.cached_tokens,
+    }
+    QUERY_ITERATIONS.observe(usage["iterations"])
+    REQUEST_TOKENS.observe(handler.prompt_tokens + handler.completion_tokens)
+    return usage
+
+
+def llm_token_usage(response: LLMResult) -> Tuple[int, int]:
+    """(prompt, completion) tokens of an LLM result, from usage_metadata or the OpenAI llm_output."""
+    try:
+        message = response.generations[0][0].message
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    except (IndexError, AttributeError):
+        pass
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+
+def llm_cached_tokens(response: LLMResult) -> int:
+    """Prompt tokens of an LLM result served from the provider's prompt cache."""
+    try:
+        usage = getattr(response.generations[0][0].message, "usage_metadata", None)
+        if usage:
+            return (usage.get("input_token_details") or {}).get("cache_read", 0)
+    except (IndexError, AttributeError):
+        pass
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    return (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+
+
+def prompt_cache_stats() -> Dict[str, Any]:
+    """Share of all prompt tokens so far that the provider served from its prompt cache."""
+    prompt, cached = _prompt_totals["prompt"], _prompt_totals["cached"]
+    return {
+        "prompt_tokens": prompt,
+        "cached_tokens": cached,
+        "cached_share": round(cached / prompt, 4) if prompt else 0.0,
+    }
@@ -0,0 +1,173 @@
+"""
+Per-node model routing.
+
+Every LLM call names the graph node it serves; the node's route sets its model, ``max_tokens``
+and timeout. Routes default to ``OPENAI_MODEL`` with the limits in ``DEFAULT_ROUTES`` and are
+overridden per node by ``LLM_ROUTES``, e.g.
+``{"data_analyser": {"model": "gpt-4o", "max_tokens": 2000}, "repair": {"timeout": 30}}``.
+
+A call is escalated to ``LLM_ESCALATION_MODEL`` only on a failure signal:
+
+- its output could not be parsed into the expected schema (retried once on the stronger model),
+- the caller asks for it: ``query_generate`` after ``LLM_ESCALATE_AFTER_ERRORS`` GraphQL errors
+  in one run, or a repaired query that still fails validation.
+
+Latency and tokens per node and model are recorded by ``GraphMetricsHandler``; ``stats`` reports
+calls, escalations and failures per node.
+"""
+import json
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple
+
+from langchain_core.exceptions import OutputParserException  # type: ignore
+from langchain_core.messages import BaseMessage  # type: ignore
+from langchain_openai import ChatOpenAI  # type: ignore
+from pydantic import ValidationError
+
+from config.config import (
+    LLM_DEFAULT_TIMEOUT,
+    LLM_ESCALATE_AFTER_ERRORS,
+    LLM_ESCALATION_MODEL,
+    LLM_ROUTES,
+    OPENAI_API_KEY,
+    OPENAI_MODEL,
+    SESSION_SUMMARY_MAX_TOKENS,
+)
+from config.logging_config import setup_logger
+
+logger = setup_logger()
+
+GRAPHQL_ERROR_PREFIX = "[GraphQL Error]"
+# Output that did not fit the requested schema
+PARSE_ERRORS = (OutputParserException, ValidationError, json.JSONDecodeError)
+
+
+class Route(NamedTuple):
+    model: str
+    max_tokens: Optional[int]
+    timeout: float
+
+
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    "intent_planner": {"max_tokens": 600, "timeout": 20.0},
+    "fused_planner": {"max_tokens": 1200, "timeout": 25.0},
+    "query_generate": {"max_tokens": 1000, "timeout": 20.0},
+    "speculative_query": {"max_tokens": 1000, "timeout": 20.0},
+    "repair": {"max_tokens": 1000, "timeout": 20.0},
+    "data_analyser": {"max_tokens": 1500, "timeout": 30.0},
+    "general_response": {"max_tokens": 500, "timeout": 15.0},
+    "session_summary": {"max_tokens": SESSION_SUMMARY_MAX_TOKENS, "timeout": 30.0},
+}
+
+
+def repeated_graphql_error(messages: Sequence[BaseMessage]) -> bool:
+    """True once this run has hit ``LLM_ESCALATE_AFTER_ERRORS`` GraphQL errors."""
+    errors = sum(1 for message in messages if str(message.content).strip().startswith(GRAPHQL_ERROR_PREFIX))
+    return LLM_ESCALATE_AFTER_ERRORS > 0 and errors >= LLM_ESCALATE_AFTER_ERRORS
+
+
+class ModelRouter:
+    def __init__(self, routes: Optional[Dict[str, Dict[str, Any]]] = None, escalation_model: str = LLM_ESCALATION_MODEL):
+        overrides = LLM_ROUTES if routes is None else routes
+        self.routes: Dict[str, Route] = {
+            node: self._route({**DEFAULT_ROUTES.get(node, {}), **overrides.get(node, {})})
+            for node in {*DEFAULT_ROUTES, *overrides}
+        }
+        self.default_route = self._route({})
+        self.escalation_model = escalation_model
+        self._models: Dict[Route, ChatOpenAI] = {}
+        self._runnables: Dict[Tuple, Any] = {}
+        self._calls: Dict[str, int] = {}
+        self._escalations: Dict[str, int] = {}
+        self._failures: Dict[str, int] = {}
+        self.parse_failures = 0
+
+    @staticmethod
+    def _route(settings: Dict[str, Any]) -> Route:
+        max_tokens = settings.get("max_tokens")
+        return Route(
+            str(settings.get("model") or OPENAI_MODEL),
+            int(max_tokens) if max_tokens else None,
+            float(settings.get("timeout") or LLM_DEFAULT_TIMEOUT),
+        )
+
+    def route(self, node: str, escalated: bool = False) -> Route:
+        route = self.routes.get(node, self.default_route)
+        return route._replace(model=self.escalation_model) if escalated else route
+
+    def can_escalate(self, node: str) -> bool:
+        return bool(self.escalation_model) and self.escalation_model != self.route(node).model
+
+    def llm(self, node: str, escalated: bool = False) -> ChatOpenAI:
+        """The chat model of ``node``'s route; nodes with the same route share one client."""
+        route = self.route(node, escalated)
+        model = self._models.get(route)
+        if model is None:
+            model = self._models[route] = ChatOpenAI(
+                model=route.model, temperature=0, max_tokens=route.max_tokens, timeout=route.timeout, api_key=OPENAI_API_KEY
+            )
+        return model
+
+    def runnable(self, node: str, escalated: bool = False, tools: Optional[Sequence[Any]] = None, schema: Optional[type] = None):
+        """``node``'s model, with ``tools`` bound or answering in ``schema``'s JSON-schema mode."""
+        key = (node, escalated, tuple(id(tool) for tool in tools or ()), schema)
+        runnable = self._runnables.get(key)
+        if runnable is None:
+            runnable = self.llm(node, escalated)
+            if tools:
+                runnable = runnable.bind_tools(list(tools))
+            if schema is not None:
+                runnable = runnable.with_structured_output(schema, method="json_schema")
+            self._runnables[key] = runnable
+        return runnable
+
+    async def ainvoke(self, node: str, prompt: Any, *, tools: Optional[Sequence[Any]] = None,
+                      schema: Optional[type] = None, escalate: bool = False) -> Any:
+        """
+        Call ``node``'s model. ``escalate`` sends the call to the escalation model right away;
+        otherwise a response that fails to parse is retried there once.
+        """
+        escalated = escalate and self.can_escalate(node)
+        self._calls[node] = self._calls.get(node, 0) + 1
+        if escalated:
+            self._escalate(node, "requested by the caller")
+        try:
+            return await self.runnable(node, escalated, tools, schema).ainvoke(prompt)
+        except PARSE_ERRORS as e:
+            self.parse_failures += 1
+            if escalated or not self.can_escalate(node):
+                self._fail(node)
+                raise
+            self._escalate(node, f"unparsable output: {e}")
+        except Exception:
+            self._fail(node)
+            raise
+        try:
+            return await self.runnable(node, True, tools, schema).ainvoke(prompt)
+        except Exception:
+            self._fail(node)
+            raise
+
+    def _escalate(self, node: str, reason: str) -> None:
+        self._escalations[node] = self._escalations.get(node, 0) + 1
+        logger.warning(f"[MODEL_ROUTER] Escalating {node} to {self.escalation_model}: {reason}")
+
+    def _fail(self, node: str) -> None:
+        self._failures[node] = self._failures.get(node, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        calls = sum(self._calls.values())
+        escalations = sum(self._escalations.values())
+        return {
+            "calls": calls,
+            "escalations": escalations,
+            "escalation_ratio": round(escalations / calls, 4) if calls else 0.0,
+            "parse_failures": self.parse_failures,
+            "failures": sum(self._failures.values()),
+            **{f"{node}_calls": count for node, count in self._calls.items()},
+            **{f"{node}_escalations": count for node, count in self._escalations.items()},
+            **{f"{node}_failures": count for node, count in self._failures.items()},
+        }
+
+
+model_router = ModelRouter()
+
@@ -0,0 +1,50 @@
+"""
+Prompt assembly in prefix-cache order.
+
+The provider caches the longest previously seen prefix of a prompt (OpenAI: from 1024 tokens,
+in 128-token steps), so every LLM call in hospital/ and blood_bank/ is laid out as
+
+1. the static prompt: identical for every company and request (no values, no timestamp),
+2. per-request content: time, resolved values, history, question, data.
+
+There is no per-company tier: the company's filter values never reach a prompt, the entity
+extractor turns them into the values resolved for the question, which are per-request.
+
+``assemble`` builds that message list and remembers a fingerprint of the static part per
+call site; a call site that ever shows more than one fingerprint has volatile content in its
+prefix, which ``stats`` reports next to the share of prompt tokens served from the cache.
+"""
+import hashlib
+from typing import Any, Dict, List, Set
+
+from langchain_core.messages import BaseMessage  # type: ignore
+
+from metrics import prompt_cache_stats
+
+# Fingerprints kept per call site; a stable prefix needs one
+MAX_FINGERPRINTS = 16
+
+_fingerprints: Dict[str, Set[str]] = {}
+
+
+def _text(message: Any) -> str:
+    return message.content if isinstance(message, BaseMessage) else str(message)
+
+
+def assemble(name: str, static: Any, *request: Any) -> List[Any]:
+    """
+    Message list for call site ``name``: the ``static`` prompt, then the ``request`` content.
+    Messages keep their type; plain strings are sent as human messages.
+    """
+    fingerprints = _fingerprints.setdefault(name, set())
+    if len(fingerprints) < MAX_FINGERPRINTS:
+        fingerprints.add(hashlib.blake2b(_text(static).encode("utf-8"), digest_size=8).hexdigest())
+    return [static, *request]
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        **prompt_cache_stats(),
+        "call_sites": len(_fingerprints),
+        "unstable_prefixes": sum(len(fingerprints) > 1 for fingerprints in _fingerprints.values()),
+    }
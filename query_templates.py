@@ -0,0 +1,174 @@
+"""
+Deterministic GraphQL templates for the high-frequency question shapes, so query_generate
+can skip its LLM call (and the occasional repair call) for them:
+
+- orders by status ("pending orders", "rejected and cancelled requests")
+- current/tracked orders ("track my orders", "order status")
+- orders by blood group, optionally with a status ("pending O+ orders")
+- any of the above within one date range ("orders created today", "pending orders last week")
+- monthly cost ("cost for June 2025", "billing this month")
+
+Matching is deliberately closed-vocabulary: the rephrased question of the IntentPlan
+may only contain words the template understands, once its time phrases are resolved by
+date_resolver. Anything else (names, reasons, components, groupings, several separate
+periods) falls back to the LLM. Like static_query_generate, a query returns at most
+TEMPLATE_LIMIT rows.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from date_resolver import MONTH_RE, MONTHS, RELATIVE_MONTH_RE, resolve_dates, strip_dates
+from intent_plan import IntentPlan
+
+ORDER_VIEWS = {"HOSPITAL": "blood_order_view", "BLOODBANK": "blood_bank_order_view"}
+
+ORDER_FIELDS = {
+    "HOSPITAL": [
+        "request_id", "blood_group", "status", "creation_date_and_time", "delivery_date_and_time", "reason",
+        "patient_id", "first_name", "last_name", "age", "order_line_items", "blood_bank_name",
+    ],
+    "BLOODBANK": [
+        "request_id", "blood_group", "status", "creation_date_and_time", "delivery_date_and_time", "reason",
+        "patient_id", "first_name", "last_name", "age", "order_line_items", "hospital_name",
+    ],
+}
+DEFAULT_ORDER_FIELDS = ["request_id", "status", "blood_group", "creation_date_and_time", "delivery_date_and_time", "order_line_items"]
+COST_FIELDS = ["company_name", "month_year", "blood_component", "total_patient", "overall_blood_unit", "total_cost"]
+
+FINALIZED_STATUSES = ["CMP", "REJ", "CAL"]
+# Rows a template query returns at most, as static_query_generate does
+TEMPLATE_LIMIT = 100
+
+STATUS_WORDS = {
+    "pending": "PA", "waiting": "PA",
+    "approved": "AA", "cleared": "AA",
+    "completed": "CMP", "complete": "CMP", "finished": "CMP", "delivered": "CMP",
+    "rejected": "REJ",
+    "cancelled": "CAL", "canceled": "CAL",
+}
+TRACK_WORDS = {"track", "tracking", "current", "ongoing", "active", "open", "progress", "status", "update", "updates", "latest", "recent"}
+ORDER_WORDS = {"order", "orders", "request", "requests"}
+COST_WORDS = {"cost", "costs", "billing", "bill", "bills", "charges", "charge", "spend", "spending", "expense", "expenses", "invoice"}
+FILLER_WORDS = {
+    "show", "me", "my", "our", "the", "all", "list", "get", "give", "what", "whats", "what's", "are", "is", "of",
+    "for", "in", "with", "please", "a", "an", "blood", "details", "detail", "view", "see", "can", "you", "i",
+    "want", "to", "know", "display", "fetch", "tell", "about", "which", "have", "has", "there", "any", "and",
+    "or", "how", "many", "much", "count", "number", "total", "summary", "monthly", "month", "group", "type",
+    "currently", "now", "we", "us", "do", "did", "were", "was", "be", "on", "created", "raised",
+}
+
+BLOOD_GROUP_RE = re.compile(r"\b(ab|a|b|oh|o)\s*(\+|-|−|\s+positive|\s+negative|\s+pos|\s+neg|\s*ve\+|\s*ve-)(?=\s|$|[,.?!])")
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+_hits: Dict[str, int] = {}
+_misses: Dict[str, int] = {}
+
+
+def canonical_blood_group(letters: str, sign: str) -> str:
+    negative = sign.strip() in ("-", "−", "negative", "neg", "ve-")
+    return letters.upper() + ("-" if negative else "+")
+
+
+def _resolve_blood_group(group: str, possible_values: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The stored spelling of a blood group (e.g. "O−" vs "O-"), or None if the company has no such value."""
+    known = [item.get("blood_group") for item in (possible_values or {}).get("blood_groups", []) if item.get("blood_group")]
+    if not known:
+        return group
+    for value in known:
+        if value.upper().replace("−", "-").replace(" ", "") == group:
+            return value
+    return None
+
+
+def _selection(fields_needed: List[str], allowed: List[str], defaults: List[str]) -> List[str]:
+    return list(dict.fromkeys(defaults + [f for f in fields_needed if f in allowed]))
+
+
+def _render(view: str, where: Dict[str, Any], order_by: str, fields: List[str]) -> str:
+    args = []
+    if where:
+        args.append(f"where: {_gql_value(where)}")
+    args.append(f"order_by: {{ {order_by}: desc }}")
+    args.append(f"limit: {TEMPLATE_LIMIT}")
+    arguments = ",\n    ".join(args)
+    body = "\n    ".join(fields)
+    return f"query {{\n  {view}(\n    {arguments}\n  ) {{\n    {body}\n  }}\n}}"
+
+
+def _gql_value(value: Any) -> str:
+    if isinstance(value, dict):
+        return "{ " + ", ".join(f"{key}: {_gql_value(val)}" for key, val in value.items()) + " }"
+    if isinstance(value, list):
+        return "[" + ", ".join(_gql_value(val) for val in value) + "]"
+    return json.dumps(value, ensure_ascii=False)
+
+
+def match_template(company_type: str, plan: IntentPlan, possible_values: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """GraphQL query for an intent plan whose question fits a template, else None."""
+    company_type = getattr(company_type, "value", company_type)
+    query = _match(company_type, plan, possible_values)
+    counter = _hits if query else _misses
+    counter[company_type] = counter.get(company_type, 0) + 1
+    return query
+
+
+def _match(company_type: str, plan: IntentPlan, possible_values: Optional[Dict[str, Any]]) -> Optional[str]:
+    if company_type not in ORDER_VIEWS or plan.ask_for.strip():
+        return None
+    text = " ".join(plan.rephrased_question.lower().split())
+    if not text:
+        return None
+
+    blood_groups = [canonical_blood_group(*m.groups()) for m in BLOOD_GROUP_RE.finditer(text)]
+    text = BLOOD_GROUP_RE.sub(" ", text)
+    dates = resolve_dates(text)
+    if dates and len(dates.ranges) > 1:
+        # Separate periods need an _or of ranges: left to the LLM
+        return None
+    text = strip_dates(text)
+
+    words = WORD_RE.findall(text)
+    statuses = list(dict.fromkeys(STATUS_WORDS[w] for w in words if w in STATUS_WORDS))
+    known = FILLER_WORDS | ORDER_WORDS | COST_WORDS | TRACK_WORDS | STATUS_WORDS.keys()
+    if any(w not in known for w in words):
+        return None
+    is_cost = any(w in COST_WORDS for w in words)
+    is_order = any(w in ORDER_WORDS for w in words) or bool(statuses)
+
+    if is_cost:
+        # Monthly cost: whole calendar months, nothing order-specific
+        if is_order or blood_groups or not dates or not dates.whole_months or not dates.month_years:
+            return None
+        return _render("cost_and_billing_view", {"month_year": dates.month_year_filter()}, "month_year", COST_FIELDS)
+
+    if not is_order or len(blood_groups) > 1:
+        return None
+
+    where: Dict[str, Any] = {}
+    if len(statuses) == 1:
+        where["status"] = {"_eq": statuses[0]}
+    elif statuses:
+        where["status"] = {"_in": statuses}
+    elif not dates:
+        # "Orders" with no status or date means current, not finalized, orders
+        where["status"] = {"_nin": FINALIZED_STATUSES}
+    if blood_groups:
+        blood_group = _resolve_blood_group(blood_groups[0], possible_values)
+        if blood_group is None:
+            return None
+        where["blood_group"] = {"_eq": blood_group}
+    if dates:
+        where["creation_date_and_time"] = dates.creation_filter()
+
+    fields = _selection(plan.fields_needed, ORDER_FIELDS[company_type], DEFAULT_ORDER_FIELDS)
+    return _render(ORDER_VIEWS[company_type], where, "creation_date_and_time", fields)
+
+
+def stats() -> Dict[str, Any]:
+    hits, misses = sum(_hits.values()), sum(_misses.values())
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+    }
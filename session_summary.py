@@ -0,0 +1,224 @@
+"""
+Rolling conversation summary per chat session.
+
+Sessions live for days, so the planner gets a compact summary of the conversation so far plus
+the turns it does not cover yet, instead of a history window that drops old context abruptly.
+
+After each turn ``schedule`` folds the messages that have left the recent window
+(``SESSION_SUMMARY_RECENT_MESSAGES``) into the summary with one small LLM call, in a background
+task: the response never waits for it. One update runs per session at a time; turns that
+arrive meanwhile are folded by a single follow-up update.
+
+Summaries are stored in the ``summary`` (jsonb) column of ``chat_sessions`` and cached per
+(user_id, session_id); the summary remembers a fingerprint of the last message it covers, so
+only newer messages are folded and given to the prompt as raw turns. When the history window
+has slid past that message, the summary is re-anchored before the recent turns instead.
+"""
+import asyncio
+import contextvars
+import hashlib
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from cachetools import TTLCache
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage  # type: ignore
+
+from config.config import (
+    HISTORY_ANSWER_MAX_TOKENS,
+    SESSION_SUMMARY_CACHE_MAX,
+    SESSION_SUMMARY_CACHE_TTL,
+    SESSION_SUMMARY_ENABLED,
+    SESSION_SUMMARY_RECENT_MESSAGES,
+)
+from config.logging_config import setup_logger
+from hasura.graphql_memory import HasuraMemory
+from history_context import truncate
+from model_router import model_router
+from prompt_assembly import assemble
+
+logger = setup_logger()
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and a healthcare data assistant.
+You are given the current summary (possibly empty) and the messages that follow it.
+Return the updated summary, at most 120 words, as plain text without a preamble:
+- keep what later questions may refer to: the entities (hospitals, blood banks, blood groups, components, statuses), time periods and figures discussed, and what the user is trying to find out;
+- prefer the newer information when it contradicts the summary;
+- drop greetings, thanks and anything already resolved that later questions cannot depend on.
+"""
+
+# Lead-in of the summary in the planner's history context
+SUMMARY_LEAD_IN = "Summary of the earlier conversation: "
+
+
+class SessionSummary(NamedTuple):
+    text: str
+    last_message: str  # fingerprint of the newest message the summary covers
+    messages: int  # messages folded in so far
+
+    def to_json(self) -> Dict[str, Any]:
+        return self._asdict()
+
+    @classmethod
+    def from_json(cls, data: Optional[Dict[str, Any]]) -> "SessionSummary":
+        data = data or {}
+        return cls(str(data.get("text") or ""), str(data.get("last_message") or ""), int(data.get("messages") or 0))
+
+
+EMPTY_SUMMARY = SessionSummary("", "", 0)
+
+
+def fingerprint(message: BaseMessage) -> str:
+    return hashlib.blake2b(f"{message.type}:{message.content}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _line(message: BaseMessage) -> str:
+    if isinstance(message, HumanMessage):
+        return f"User: {message.content}"
+    return f"Assistant: {truncate(str(message.content), HISTORY_ANSWER_MAX_TOKENS)}"
+
+
+class SessionSummarizer:
+    def __init__(self, recent_messages: int = SESSION_SUMMARY_RECENT_MESSAGES, enabled: bool = SESSION_SUMMARY_ENABLED):
+        self.recent_messages = recent_messages
+        self.enabled = enabled
+        # (user_id, session_id) -> SessionSummary; sessions without one cache EMPTY_SUMMARY
+        self._cache = TTLCache(maxsize=SESSION_SUMMARY_CACHE_MAX, ttl=SESSION_SUMMARY_CACHE_TTL)
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        # Latest messages per session waiting for the running update to finish
+        self._pending: Dict[Tuple[str, str], Tuple[HasuraMemory, List[BaseMessage]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.folded = 0
+        self.superseded = 0
+        self.reanchored = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    async def get(self, hasura_memory: HasuraMemory, session_id: str) -> Optional[SessionSummary]:
+        """The session's summary (EMPTY_SUMMARY when it has none), or None when it could not be read."""
+        if not self.enabled:
+            return EMPTY_SUMMARY
+        key = (hasura_memory.user_id, session_id)
+        summary = self._cache.get(key)
+        if summary is not None:
+            self.hits += 1
+            return summary
+        self.misses += 1
+        data = await hasura_memory.aget_session_summary(session_id)
+        if data is None:
+            return None
+        summary = SessionSummary.from_json(data)
+        self._cache[key] = summary
+        return summary
+
+    @staticmethod
+    def _position(summary: Optional[SessionSummary], history: Sequence[BaseMessage]) -> Optional[int]:
+        """Index in ``history`` of the last message ``summary`` covers, None when it is not there."""
+        if summary and summary.last_message:
+            for index in range(len(history) - 1, -1, -1):
+                if fingerprint(history[index]) == summary.last_message:
+                    return index
+        return None
+
+    def unsummarized(self, summary: Optional[SessionSummary], history: Sequence[BaseMessage]) -> List[BaseMessage]:
+        """
+        The messages of ``history`` newer than the last one ``summary`` covers. When the history
+        window has slid past that message, only the recent messages are given verbatim: the
+        older ones in the window are left to the summary rather than repeated in full.
+        """
+        history = list(history or [])
+        if not summary or not summary.last_message:
+            return history
+        position = self._position(summary, history)
+        if position is not None:
+            return history[position + 1:]
+        return history[-self.recent_messages:] if self.recent_messages else []
+
+    def schedule(self, hasura_memory: HasuraMemory, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        """Fold ``messages`` (the session's history including the new turn) into its summary in the background."""
+        if not self.enabled:
+            return
+        key = (hasura_memory.user_id, session_id)
+        if key in self._pending:
+            self.superseded += 1
+        self._pending[key] = (hasura_memory, list(messages))
+        if key not in self._tasks:
+            # A fresh context: the update must not report into the finished request's timings
+            self._tasks[key] = asyncio.create_task(self._drain(key), context=contextvars.Context())
+
+    async def _drain(self, key: Tuple[str, str]) -> None:
+        try:
+            while key in self._pending:
+                hasura_memory, messages = self._pending.pop(key)
+                try:
+                    await self._update(hasura_memory, key[1], messages)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"[SESSION_SUMMARY] Update failed for session_id={key[1]}: {e}")
+        finally:
+            self._tasks.pop(key, None)
+
+    async def _update(self, hasura_memory: HasuraMemory, session_id: str, messages: List[BaseMessage]) -> None:
+        summary = await self.get(hasura_memory, session_id)
+        if summary is None:
+            # Unknown stored summary: do not overwrite it with one that lacks the older turns
+            return
+        if summary.last_message and self._position(summary, messages) is None:
+            # The window slid past the summary: move its anchor to the message before the recent
+            # ones instead of folding the whole window into it a second time
+            older = messages[:-self.recent_messages] if self.recent_messages else messages
+            if older:
+                await self._store(hasura_memory, session_id, summary._replace(last_message=fingerprint(older[-1])))
+                self.reanchored += 1
+            return
+        unsummarized = self.unsummarized(summary, messages)
+        to_fold = unsummarized[:-self.recent_messages] if self.recent_messages else unsummarized
+        if not to_fold:
+            return
+
+        new_messages = "\n".join(_line(message) for message in to_fold)
+        response = await model_router.ainvoke("session_summary", assemble(
+            "session_summary",
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=f"Current summary: {summary.text or '(none)'}\n\nNew messages:\n{new_messages}"),
+        ))
+        usage = getattr(response, "usage_metadata", None) or {}
+        self.prompt_tokens += usage.get("input_tokens", 0)
+        self.completion_tokens += usage.get("output_tokens", 0)
+
+        updated = SessionSummary(str(response.content).strip(), fingerprint(to_fold[-1]), summary.messages + len(to_fold))
+        self.updates += 1
+        self.folded += len(to_fold)
+        await self._store(hasura_memory, session_id, updated)
+
+    async def _store(self, hasura_memory: HasuraMemory, session_id: str, summary: SessionSummary) -> None:
+        self._cache[(hasura_memory.user_id, session_id)] = summary
+        if not await hasura_memory.aupdate_session_summary(session_id, summary.to_json()):
+            self.failed += 1
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Wait for running updates (at shutdown, before the HTTP pools close)."""
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "running": len(self._tasks),
+            "updates": self.updates,
+            "folded_messages": self.folded,
+            "superseded": self.superseded,
+            "reanchored": self.reanchored,
+            "failed": self.failed,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+session_summaries = SessionSummarizer()
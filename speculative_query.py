@@ -0,0 +1,147 @@
+"""
+Speculative query generation.
+
+With ``SPECULATIVE_QUERY_ENABLED``, ``intent_planner`` starts the query-generation LLM call on
+the raw message (plus history) at the same time as its own call. Once the plan is known the
+speculative query is kept only if the plan is a ``data_query`` whose rephrased question
+carries the same key terms as the raw message (blood groups, statuses, months, numbers,
+known filter values); otherwise the call is cancelled. ``query_generate`` then uses the kept
+query instead of making its own call.
+
+Tokens of speculative calls that end up unused are counted as wasted. A call cancelled
+before it finished is counted with the estimated size of its prompt.
+"""
+import asyncio
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from langchain_core.messages import AIMessage, BaseMessage  # type: ignore
+
+from cache.memory_cache import estimate_tokens
+from config.logging_config import setup_logger
+from intent_plan import IntentPlan
+from query_templates import BLOOD_GROUP_RE, MONTH_RE, RELATIVE_MONTH_RE, STATUS_WORDS, WORD_RE, canonical_blood_group
+
+logger = setup_logger()
+
+TIME_WORDS = {"today", "yesterday", "tomorrow", "day", "days", "week", "weeks", "months", "year", "years", "quarter"}
+NUMBER_RE = re.compile(r"\b\d+\b")
+
+# Metadata of the speculative LLM call, so its latency and tokens are reported separately
+SPECULATIVE_CALL_CONFIG = {"metadata": {"langgraph_node": "speculative_query"}}
+
+
+def key_terms(text: str, vocabulary: Iterable[str] = ()) -> Set[str]:
+    """The terms of a question that decide which data it asks for."""
+    text = " ".join(text.lower().split())
+    terms = {canonical_blood_group(*m.groups()) for m in BLOOD_GROUP_RE.finditer(text)}
+    text = BLOOD_GROUP_RE.sub(" ", text)
+    terms.update("last month" if m.group(1) in ("last", "previous") else "this month" for m in RELATIVE_MONTH_RE.finditer(text))
+    text = RELATIVE_MONTH_RE.sub(" ", text)
+    terms.update(f"{m.group(1)[:3]} {m.group(2) or ''}".strip() for m in MONTH_RE.finditer(text))
+    text = MONTH_RE.sub(" ", text)
+    terms.update(NUMBER_RE.findall(text))
+    words = WORD_RE.findall(text)
+    for word in words:
+        if word in STATUS_WORDS:
+            terms.add(STATUS_WORDS[word])
+        elif word in TIME_WORDS:
+            terms.add(word)
+    # Whole-word matches only, so a short value never matches inside a longer word
+    padded = f" {' '.join(words)} "
+    terms.update(value for value in vocabulary if f" {value} " in padded)
+    return terms
+
+
+def same_meaning(message: str, rephrased: str, vocabulary: Iterable[str] = ()) -> bool:
+    """True when the rephrasing neither adds nor drops a key term of the raw message."""
+    vocabulary = [" ".join(WORD_RE.findall(value.lower())) for value in vocabulary]
+    vocabulary = [value for value in vocabulary if value]
+    return key_terms(message, vocabulary) == key_terms(rephrased, vocabulary)
+
+
+def filter_vocabulary(possible_values: Optional[Dict[str, Any]]) -> List[str]:
+    """Filter values (names, reasons, ...) from get_possible_values, flattened."""
+    return [value for items in (possible_values or {}).values() if isinstance(items, list)
+            for item in items if isinstance(item, dict) for value in item.values() if isinstance(value, str)]
+
+
+class Speculation(NamedTuple):
+    task: asyncio.Task
+    prompt_tokens: int
+
+
+class QuerySpeculation:
+    def __init__(self):
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.wasted_tokens = 0
+
+    def start(self, runnable, prompt: List[Any]) -> Speculation:
+        """Start the speculative query-generation call in the background."""
+        self.started += 1
+        task = asyncio.create_task(runnable.ainvoke(prompt, SPECULATIVE_CALL_CONFIG))
+        return Speculation(task, sum(estimate_tokens(str(getattr(msg, "content", msg))) for msg in prompt))
+
+    async def resolve(
+        self, speculation: Optional[Speculation], plan: IntentPlan, message: str, vocabulary: Iterable[str] = ()
+    ) -> Optional[AIMessage]:
+        """
+        The speculative response when the plan confirms it, else None (the call is cancelled).
+        query_generate reports whether it then ``used`` the response or it was ``superseded``.
+        """
+        if speculation is None:
+            return None
+        if plan.route() != "data_query" or not same_meaning(message, plan.rephrased_question, vocabulary):
+            self._discard(speculation)
+            return None
+        try:
+            return await speculation.task
+        except Exception as e:
+            logger.error(f"[SPECULATION] Speculative query generation failed: {e}")
+            self.failed += 1
+            self.misses += 1
+            return None
+
+    def used(self) -> None:
+        self.hits += 1
+
+    def superseded(self, response: BaseMessage) -> None:
+        """A confirmed speculation that query_generate did not need (a template matched)."""
+        self.misses += 1
+        self.wasted_tokens += self._tokens(response)
+
+    def _discard(self, speculation: Speculation) -> None:
+        self.misses += 1
+        task = speculation.task
+        if not task.done():
+            task.cancel()
+            self.cancelled += 1
+            self.wasted_tokens += speculation.prompt_tokens
+        elif not task.cancelled() and task.exception() is None:
+            self.wasted_tokens += self._tokens(task.result())
+        else:
+            self.failed += 1
+
+    @staticmethod
+    def _tokens(response: BaseMessage) -> int:
+        usage = getattr(response, "usage_metadata", None) or {}
+        return usage.get("total_tokens", 0)
+
+    def stats(self) -> Dict[str, Any]:
+        decided = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / decided, 4) if decided else 0.0,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "wasted_tokens": self.wasted_tokens,
+        }
+
+
+query_speculation = QuerySpeculation()
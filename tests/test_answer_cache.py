@@ -0,0 +1,67 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+
+from cache.answer_cache import AnswerCache
+from cache.data_freshness import DataFreshness
+import hasura.graphql_memory as graphql_memory
+from hasura.graphql_memory import HasuraMemory
+
+
+class StubHasura:
+    permission_scope = ("admin", "c1", "u1")
+
+    def __init__(self):
+        self.orders = 3
+        self.queries = 0
+
+    async def arun_query(self, query, variables=None):
+        self.queries += 1
+        return {"orders": {"aggregate": {"count": self.orders}}}
+
+
+def answer(text: str):
+    return {"messages": [AIMessage(content=text)], "nodes": ["data_analyser"]}
+
+
+def test_changed_freshness_token_misses():
+    cache = AnswerCache()
+    old = cache.key("HOSPITAL", ("admin", "c1", "u1"), "show pending orders", freshness="token-a")
+    cache.put(old, answer("3 pending orders"), 1200.0)
+    assert cache.get(cache.key("HOSPITAL", ("admin", "c1", "u1"), "show pending orders", freshness="token-a")).response == "3 pending orders"
+    assert cache.get(cache.key("HOSPITAL", ("admin", "c1", "u1"), "show pending orders", freshness="token-b")) is None
+
+
+def test_no_freshness_token_bypasses_the_cache():
+    assert AnswerCache().key("HOSPITAL", ("admin", "c1", "u1"), "show pending orders", freshness=None) is None
+
+
+def test_token_follows_the_data():
+    async def run():
+        hasura = StubHasura()
+        # ttl=0: every call asks Hasura again
+        freshness = DataFreshness(ttl=0)
+        before = await freshness.token("HOSPITAL", hasura)
+        same = await freshness.token("HOSPITAL", hasura)
+        hasura.orders += 1
+        after = await freshness.token("HOSPITAL", hasura)
+        return before, same, after
+
+    before, same, after = asyncio.run(run())
+    assert before == same
+    assert before != after
+
+
+def test_scopes_do_not_share_answers():
+    cache = AnswerCache()
+    cache.put(cache.key("HOSPITAL", ("admin", "c1", "u1"), "show pending orders", freshness="token"), answer("3 pending orders"), 1200.0)
+    assert cache.get(cache.key("HOSPITAL", ("admin", "c1", "u2"), "show pending orders", freshness="token")) is None
+
+
+def test_permission_scope(monkeypatch):
+    def scope(user_id):
+        return HasuraMemory("http://hasura", "secret", user_id=user_id, company_id="c1", hasura_role="admin").permission_scope
+
+    assert scope("u1") != scope("u2")
+    monkeypatch.setattr(graphql_memory, "HASURA_PERMISSION_SCOPE", "company")
+    assert scope("u1") == scope("u2") == ("admin", "c1")
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+
+import httpx
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import PydanticOutputParser
+
+import main
+from hasura.graphql_memory import HasuraMemory
+from model_router import model_router
+
+LLM_LATENCY = 0.2
+HASURA_LATENCY = 0.02
+CONCURRENT_CHATS = 10
+
+PLAN = {
+    "intent": "data_query",
+    "rephrased_question": "how many orders are pending",
+    "chain_of_thought": "count the pending orders",
+    "ask_for": "",
+    "fields_needed": ["status"],
+}
+QUERY = 'query { blood_order_view(where: {status: {_eq: "PA"}}) { status } }'
+RESPONSES = {
+    "intent_planner": json.dumps(PLAN),
+    "fused_planner": json.dumps({**PLAN, "graphql_query": QUERY}),
+    "query_generate": QUERY,
+    "speculative_query": QUERY,
+    "data_analyser": "You have 1 pending order.",
+    "general_response": "Hello!",
+    "session_summary": "The user asked about pending orders.",
+}
+
+
+class SlowLLM(FakeMessagesListChatModel):
+    """A chat model that answers one fixed message after LLM_LATENCY, without blocking the loop."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def with_structured_output(self, schema, **kwargs):
+        return self | PydanticOutputParser(pydantic_object=schema)
+
+    async def _agenerate(self, *args, **kwargs):
+        await asyncio.sleep(LLM_LATENCY)
+        return self._generate(*args, **kwargs)
+
+
+async def slow_apost(self, payload, timeout=None):
+    await asyncio.sleep(HASURA_LATENCY)
+    query = payload["query"]
+    if "insert_chat_messages" in query:
+        return {"data": {"insert_chat_messages": {"affected_rows": 2}}}
+    if "chat_messages" in query:
+        return {"data": {"chat_messages": []}}
+    if "chat_sessions" in query:
+        return {"data": {"chat_sessions": []}}
+    return {"data": {"blood_order_view": [{"status": "PA"}]}}
+
+
+def blocking_post(self, payload, timeout=None):
+    # A blocking call on the request path serializes the chats and fails the timing below
+    time.sleep(HASURA_LATENCY)
+    return {"data": {}}
+
+
+def chat(client: httpx.AsyncClient, index: int):
+    return client.post("/chat", json={
+        "user_id": f"user-{index}",
+        "company_id": "company-1",
+        "company_type": "HOSPITAL",
+        "session_id": f"session-{index}",
+        "message": f"how many orders are pending for ward {index}",
+    })
+
+
+def test_concurrent_chats_overlap(monkeypatch):
+    llms = {node: SlowLLM(responses=[AIMessage(content=content)]) for node, content in RESPONSES.items()}
+    monkeypatch.setattr(model_router, "llm", lambda node, escalated=False: llms[node])
+    monkeypatch.setattr(model_router, "_runnables", {})
+    monkeypatch.setattr(HasuraMemory, "_apost", slow_apost)
+    monkeypatch.setattr(HasuraMemory, "_post", blocking_post)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # Warm up: graph compilation and first-use imports are not part of the timing
+            (await chat(client, -1)).raise_for_status()
+
+            start = time.perf_counter()
+            single = await chat(client, 0)
+            single_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(chat(client, index) for index in range(1, CONCURRENT_CHATS + 1)))
+            concurrent_elapsed = time.perf_counter() - start
+            return single, single_elapsed, responses, concurrent_elapsed
+
+    single, single_elapsed, responses, concurrent_elapsed = asyncio.run(run())
+
+    assert single.status_code == 200
+    assert single.json()["response"] == RESPONSES["data_analyser"]
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()["response"] == RESPONSES["data_analyser"] for response in responses)
+    # Serialized chats would take CONCURRENT_CHATS times as long as one
+    assert concurrent_elapsed < single_elapsed * CONCURRENT_CHATS / 3
@@ -0,0 +1,48 @@
+from datetime import date, datetime
+
+from date_resolver import TIMEZONE, resolve_dates
+from intent_plan import IntentPlan
+from query_templates import match_template
+
+NOW = datetime(2026, 10, 17, 10, 0, tzinfo=TIMEZONE)
+
+
+def plan(question: str) -> IntentPlan:
+    return IntentPlan(intent="data_query", rephrased_question=question, chain_of_thought="", ask_for="", fields_needed=[])
+
+
+def test_since_runs_up_to_today():
+    slots = resolve_dates("orders since january", NOW)
+    assert [(r.start, r.end, r.open_ended) for r in slots.ranges] == [(date(2026, 1, 1), date(2026, 10, 18), True)]
+    assert "up to now" in slots.context()
+
+
+def test_after_starts_when_the_period_ends():
+    slots = resolve_dates("orders after march", NOW)
+    assert (slots.ranges[0].start, slots.ranges[0].end) == (date(2026, 4, 1), date(2026, 10, 18))
+
+
+def test_separate_phrases_stay_separate():
+    slots = resolve_dates("cost for june 2024 and june 2025", NOW)
+    assert [(r.start, r.end) for r in slots.ranges] == [
+        (date(2024, 6, 1), date(2024, 7, 1)),
+        (date(2025, 6, 1), date(2025, 7, 1)),
+    ]
+    assert slots.month_years == ["June-2024", "June-2025"]
+    assert slots.creation_filter() is None
+
+
+def test_from_to_is_one_range():
+    slots = resolve_dates("orders from june to august 2025", NOW)
+    assert [(r.start, r.end, r.open_ended) for r in slots.ranges] == [(date(2025, 6, 1), date(2025, 9, 1), False)]
+
+
+def test_templates_skip_open_and_separate_periods():
+    assert match_template("HOSPITAL", plan("orders since january"), {}) is None
+    assert match_template("HOSPITAL", plan("cost for june 2024 and june 2025"), {}) is None
+    assert match_template("HOSPITAL", plan("cost for june 2025"), {}) is not None
+
+
+def test_template_queries_are_limited():
+    assert "limit: 100" in match_template("HOSPITAL", plan("track my orders"), {})
+    assert "limit: 100" in match_template("HOSPITAL", plan("cost for june 2025"), {})
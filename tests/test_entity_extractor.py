@@ -0,0 +1,20 @@
+from entity_extractor import resolve_entities
+
+BANKS = {"bank_names": [{"blood_bank_name": name} for name in ("Blood Bank A", "City Blood Bank", "Apollo Blood Centre")]}
+
+
+def names(message: str):
+    return resolve_entities("HOSPITAL", message, BANKS).slots.get("blood_bank_name")
+
+
+def test_ordinary_words_are_not_names():
+    assert names("give me a list of pending orders") is None
+    assert names("orders delivered in the city") is None
+    assert names("which blood bank has the most orders") is None
+
+
+def test_names_are_resolved():
+    assert names("orders from blood bank a") == ["Blood Bank A"]
+    assert names("orders from the city blood bank") == ["City Blood Bank"]
+    assert names("pending orders from city") == ["City Blood Bank"]
+    assert names("orders placed with apolo") == ["Apollo Blood Centre"]
@@ -0,0 +1,18 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from fast_path import FastPath
+
+HISTORY = [HumanMessage(content="show pending orders"), AIMessage(content="You have 3 pending orders.")]
+
+
+def test_what_is_this_goes_to_the_graph():
+    fast_path = FastPath(company_types=["HOSPITAL"])
+    assert fast_path.match("HOSPITAL", "what is this") is None
+    assert fast_path.match("HOSPITAL", "what is this?") is None
+
+
+def test_capability_only_without_history():
+    fast_path = FastPath(company_types=["HOSPITAL"])
+    assert fast_path.match("HOSPITAL", "how does this work?").rule == "capability"
+    assert fast_path.match("HOSPITAL", "how does this work?", HISTORY) is None
+    assert fast_path.match("HOSPITAL", "thanks!", HISTORY).rule == "thanks"
@@ -0,0 +1,41 @@
+import asyncio
+
+import main
+from cache import session_cache
+from hasura.graphql_memory import HasuraMemory
+
+
+def request(session_id: str) -> main.ChatRequest:
+    return main.ChatRequest(user_id="u1", company_id="c1", company_type="HOSPITAL", session_id=session_id, message="hi")
+
+
+def upsert(response):
+    calls = []
+
+    async def apost(self, payload, timeout=None):
+        calls.append(payload)
+        return response
+
+    return calls, apost
+
+
+def test_failed_upsert_is_retried(monkeypatch):
+    calls, apost = upsert({"errors": [{"message": "permission denied"}]})
+    monkeypatch.setattr(HasuraMemory, "_apost", apost)
+    req = request("init-failed")
+
+    asyncio.run(main.ensure_session(req, main.chat_hasura_client(req)))
+    asyncio.run(main.ensure_session(req, main.chat_hasura_client(req)))
+    assert not session_cache.is_known("u1", "init-failed")
+    assert len(calls) == 2
+
+
+def test_upsert_of_an_existing_session_is_known(monkeypatch):
+    calls, apost = upsert({"data": {"insert_chat_sessions": {"returning": []}}})
+    monkeypatch.setattr(HasuraMemory, "_apost", apost)
+    req = request("init-existing")
+
+    asyncio.run(main.ensure_session(req, main.chat_hasura_client(req)))
+    asyncio.run(main.ensure_session(req, main.chat_hasura_client(req)))
+    assert session_cache.is_known("u1", "init-existing")
+    assert len(calls) == 1
@@ -0,0 +1,50 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from model_router import model_router
+from session_summary import SessionSummarizer, SessionSummary, fingerprint
+
+
+class StubHasura:
+    user_id = "u1"
+
+    def __init__(self, summary):
+        self.stored = summary
+
+    async def aget_session_summary(self, session_id):
+        return self.stored
+
+    async def aupdate_session_summary(self, session_id, summary):
+        self.stored = summary
+        return True
+
+
+def conversation(turns: int):
+    messages = []
+    for turn in range(turns):
+        messages += [HumanMessage(content=f"question {turn}"), AIMessage(content=f"answer {turn}")]
+    return messages
+
+
+def test_window_slid_past_the_summary(monkeypatch):
+    summaries = SessionSummarizer(recent_messages=4)
+    messages = conversation(10)
+    # The summary ends at a message that is no longer in the history window
+    summary = SessionSummary("older turns", fingerprint(messages[3]), 4)
+    window = messages[8:]
+
+    assert summaries.unsummarized(summary, window) == window[-4:]
+    assert summaries.unsummarized(summary, messages) == messages[4:]
+
+    async def summarize(*args, **kwargs):
+        raise AssertionError("the window must not be folded again")
+
+    monkeypatch.setattr(model_router, "ainvoke", summarize)
+    hasura = StubHasura(summary.to_json())
+    asyncio.run(summaries._update(hasura, "s1", window))
+
+    reanchored = SessionSummary.from_json(hasura.stored)
+    assert reanchored.text == "older turns"
+    assert reanchored.last_message == fingerprint(window[-5])
+    assert summaries.unsummarized(reanchored, window) == window[-4:]
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import httpx
+
+import hasura.write_behind as write_behind
+from hasura.write_behind import MessageWriteBehind
+
+
+def writer(tmp_path, rejected=(), down=False):
+    """A writer whose inserts fail for the rows with a ``step`` in ``rejected`` (or all rows when ``down``)."""
+    message_writer = MessageWriteBehind(
+        batch_size=10,
+        spill_path=str(tmp_path / "spill.jsonl"),
+        max_attempts=3,
+        dead_letter_path=str(tmp_path / "dead_letter.jsonl"),
+    )
+
+    async def insert(rows):
+        return not down and not any(row["step"] in rejected for row in rows)
+
+    message_writer._insert = insert
+    return message_writer
+
+
+def read(path):
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+class FlakyHasura:
+    """chat_messages in memory; the first insert is written but its response is lost."""
+
+    def __init__(self):
+        self.rows = []
+        self.posts = 0
+
+    async def post(self, url, json=None, headers=None):
+        self.posts += 1
+        rows = json["variables"]["objects"]
+        if "on_conflict" in json["query"]:
+            stored = {(row["conversation_id"], row["step"]) for row in self.rows}
+            rows = [row for row in rows if (row["conversation_id"], row["step"]) not in stored]
+        self.rows += rows
+        if self.posts == 1:
+            raise httpx.ReadTimeout("response lost")
+        return httpx.Response(200, json={"data": {"insert_chat_messages": {"affected_rows": len(rows)}}},
+                              request=httpx.Request("POST", url))
+
+
+def replay_after_lost_response(tmp_path, monkeypatch, conflict_constraint):
+    hasura = FlakyHasura()
+    monkeypatch.setattr(write_behind, "get_async_client", lambda: hasura)
+    message_writer = MessageWriteBehind(
+        spill_path=str(tmp_path / "spill.jsonl"),
+        dead_letter_path=str(tmp_path / "dead_letter.jsonl"),
+        conflict_constraint=conflict_constraint,
+    )
+
+    async def run():
+        message_writer.enqueue([{"conversation_id": "c1", "step": 0}, {"conversation_id": "c1", "step": 1}])
+        await message_writer._flush_batch()
+        # The next successful flush replays the spilled batch, which Hasura already has
+        message_writer.enqueue([{"conversation_id": "c2", "step": 0}])
+        await message_writer.stop()
+
+    asyncio.run(run())
+    return sorted((row["conversation_id"], row["step"]) for row in hasura.rows)
+
+
+def test_replaying_a_written_batch_is_idempotent(tmp_path, monkeypatch):
+    rows = replay_after_lost_response(tmp_path, monkeypatch, "chat_messages_conversation_id_step_key")
+    assert rows == [("c1", 0), ("c1", 1), ("c2", 0)]
+
+
+def test_plain_inserts_duplicate_a_replayed_batch(tmp_path, monkeypatch):
+    rows = replay_after_lost_response(tmp_path, monkeypatch, "")
+    assert rows == [("c1", 0), ("c1", 0), ("c1", 1), ("c1", 1), ("c2", 0)]
+
+
+def test_rejected_row_is_dead_lettered(tmp_path):
+    message_writer = writer(tmp_path, rejected={2})
+    rows = [{"conversation_id": "c1", "step": step} for step in range(4)]
+
+    async def run():
+        await message_writer._spill(rows, attempts=1)
+        for _ in range(5):
+            await message_writer._replay_spill()
+
+    asyncio.run(run())
+    assert message_writer.replayed_rows == 3
+    assert read(tmp_path / "spill.jsonl") == []
+    assert read(tmp_path / "dead_letter.jsonl") == [{"row": {"conversation_id": "c1", "step": 2}, "attempts": 3}]
+
+
+def test_outage_keeps_rows_for_later(tmp_path):
+    message_writer = writer(tmp_path, down=True)
+    rows = [{"conversation_id": "c1", "step": step} for step in range(25)]
+
+    async def run():
+        await message_writer._spill(rows, attempts=0)
+        await message_writer._replay_spill()
+
+    asyncio.run(run())
+    spilled = read(tmp_path / "spill.jsonl")
+    # Only the chunk that was tried is charged an attempt
+    assert sorted(entry["row"]["step"] for entry in spilled) == list(range(25))
+    assert sum(entry["attempts"] for entry in spilled) == 10
+    assert read(tmp_path / "dead_letter.jsonl") == []
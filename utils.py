@@ -1,3 +1,4 @@
+import re
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
@@ -21,3 +22,7 @@ def get_message_unique_id() -> str:
     """Generates a unique message ID based on the current date and time."""
     return datetime.now().strftime("%Y_%m_%d_%H_%M_%S_%f")  # e.g. 2025_07_01_13_07_51_957074
 
+
+def normalize_message(message: str) -> str:
+    """Lower-cases a user message, collapses whitespace and drops trailing punctuation."""
+    return re.sub(r"\s+", " ", message or "").strip().lower().rstrip("?.! ")